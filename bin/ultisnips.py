@@ -0,0 +1,2292 @@
+__requesting = True
+def coc_UltiSnips_create():
+    import re, vim, os, sys, json, dis, ctypes, builtins, threading
+    from bisect import bisect_right
+    from collections import namedtuple, OrderedDict
+    from contextlib import contextmanager
+    from itertools import accumulate
+    from time import perf_counter
+
+    _Placeholder = namedtuple("_Placeholder", ["current_text", "start", "end"])
+    _VisualContent = namedtuple("_VisualContent", ["mode", "text"])
+    _Position = namedtuple("_Position", ["line", "col"])
+    # is_vim = vim.eval('has("nvim")') == '0'
+
+    class EditorState(object):
+        """
+        State of the editor used by snippet code, read by one vim.eval() on
+        first use and kept for one evaluation cycle. A cycle starts with each
+        python code executed by coc, or when the buffer is written by the
+        runtime, by invalidate(). The selected text, which could be large, is
+        read on first access only.
+
+        Values are returned like vim.eval(), numbers could be strings.
+        """
+
+        fields = (
+            ("shiftwidth", "exists('*shiftwidth') ? shiftwidth() : &shiftwidth"),
+            ("expandtab", "&expandtab"),
+            ("tabstop", "&tabstop"),
+            ("encoding", "&encoding"),
+            ("filetype", "&filetype"),
+            ("path", "coc#util#get_fullpath()"),
+            ("fn", 'expand("%:t")'),
+            ("basename", 'expand("%:t:r")'),
+            ("visualmode", "visualmode()"),
+            ("last_placeholder", 'get(g:,"coc_last_placeholder",v:null)'),
+            ("cursor", "[line('.'), col('.') - 1]"),
+            ("changedtick", "b:changedtick"),
+        )
+        expression = "{%s}" % ", ".join("'%s': %s" % field for field in fields)
+        selection = 'get(g:,"coc_selected_text","")'
+        visual = """[visualmode(), line("'<"), col("'<"), line("'>"), col("'>"), &selection, &encoding, bufnr('%'), b:changedtick]"""
+        # expressions evaluated for the snapshot of the python worker, the
+        # selection and visual, which could be large, are requested on use
+        snapshot = (expression, "b:changedtick")
+        # options of opt() in the state
+        options = {
+            "&expandtab": "expandtab",
+            "&tabstop": "tabstop",
+            "&encoding": "encoding",
+            "&filetype": "filetype",
+        }
+
+        def __init__(self):
+            self._values = None
+            self._options = {}
+            self._selected_text = None
+
+        def invalidate(self):
+            self._values = None
+            self._options.clear()
+            self._selected_text = None
+
+        def get(self, key):
+            values = self._values
+            if values is None:
+                values = self._values = vim.eval(self.expression)
+            return values[key]
+
+        @property
+        def shiftwidth(self):
+            return int(self.get("shiftwidth"))
+
+        @property
+        def expandtab(self):
+            return str(self.get("expandtab")) == "1"
+
+        @property
+        def tabstop(self):
+            return int(self.get("tabstop"))
+
+        @property
+        def encoding(self):
+            return self.get("encoding")
+
+        @property
+        def cursor(self):
+            """(line, col) of vim.current.window.cursor."""
+            return tuple(int(n) for n in self.get("cursor"))
+
+        @property
+        def changedtick(self):
+            return int(self.get("changedtick"))
+
+        @property
+        def selected_text(self):
+            """Text selected by the visual mapping of coc."""
+            if self._selected_text is None:
+                self._selected_text = vim.eval(self.selection)
+            return self._selected_text
+
+        def option(self, option, default=None):
+            """Value of vim option or variable, default when not exists."""
+            key = self.options.get(option)
+            if key is not None:
+                return self.get(key)
+            if option not in self._options:
+                value = None
+                if vim.eval("exists('%s')" % option) == "1":
+                    try:
+                        value = vim.eval(option)
+                    except vim.error:
+                        pass
+                self._options[option] = value
+            value = self._options[option]
+            return default if value is None else value
+
+    class ColumnConverter(object):
+        """
+        Convert between byte indexes used by vim and character columns of
+        buffer lines.
+
+        The encoding is read once and the byte offset table of a line is built
+        on first use, so any number of conversions on the same line don't call
+        vim again. Create a new instance when the buffer could be changed.
+        """
+
+        def __init__(self, encoding=None):
+            self._encoding = encoding
+            self._lines = {}
+            self._tables = {}
+
+        @property
+        def encoding(self):
+            if self._encoding is None:
+                self._encoding = state.encoding
+            return self._encoding
+
+        def line(self, line):
+            """Text of the 1 based line."""
+            text = self._lines.get(line)
+            if text is None:
+                text = self._lines[line] = vim.current.buffer[line - 1]
+            return text
+
+        def fetch(self, start, end):
+            """Text of 1 based lines from start to end inclusive, read by one
+            request and kept for conversions."""
+            lines = vim.current.buffer[start - 1:end]
+            self._lines.update(zip(range(start, end + 1), lines))
+            return lines
+
+        def offsets(self, line):
+            """Byte offset of each column of the 1 based line, None when every
+            character is a single byte."""
+            if line in self._tables:
+                return self._tables[line]
+            text = self.line(line)
+            encoding = self.encoding
+            offsets = None
+            if len(text.encode(encoding, "replace")) != len(text):
+                offsets = [0]
+                offsets.extend(accumulate(len(c.encode(encoding, "replace")) for c in text))
+            self._tables[line] = offsets
+            return offsets
+
+        def byte2col(self, line, nbyte):
+            """Convert a byteidx of a mark or cursor position inside of vim
+            into a column."""
+            offsets = self.offsets(line)
+            total = len(self.line(line)) if offsets is None else offsets[-1]
+            nbyte = max(0, total + nbyte) if nbyte < 0 else min(nbyte, total)
+            if offsets is None:
+                return nbyte
+            col = bisect_right(offsets, nbyte) - 1
+            # A partial character is decoded as one replacement character.
+            return col if offsets[col] == nbyte else col + 1
+
+        def col2byte(self, line, col):
+            """Convert a valid column index into a byte index inside of vims
+            buffer."""
+            text = self.line(line)
+            # We pad the line so that selecting the +1 st column still works.
+            size = len(text) + 2
+            col = max(0, size + col) if col < 0 else min(col, size)
+            offsets = self.offsets(line)
+            if offsets is None:
+                return col
+            if col <= len(text):
+                return offsets[col]
+            return offsets[-1] + col - len(text)
+
+    # last visual selection and its content
+    _visual = [None, ""]
+
+    def get_visual_content():
+        """Text of the last visual selection, the marks and lines are read by
+        one request each, the text is kept until the selection or the buffer
+        is changed."""
+        selection = vim.eval(EditorState.visual)
+        if selection[0] == '':
+          return ''
+        if _visual[0] == selection:
+            return _visual[1]
+        sl, sbyte, el, ebyte = map(int, selection[1:5])
+        columns = ColumnConverter(selection[6])
+        lines = columns.fetch(sl, el)
+        sc = columns.byte2col(sl, sbyte - 1)
+        ec = columns.byte2col(el, ebyte - 1)
+        # When 'selection' is 'exclusive', the > mark is one column behind the
+        # actual content being copied, but never before the < mark.
+        if selection[5] == "exclusive":
+            if not (sl == el and sbyte == ebyte):
+                ec -= 1
+
+        if sl == el:
+            text = (lines[0] + "\n")[sc : ec + 1]
+        else:
+            parts = [lines[0][sc:]]
+            parts.extend(lines[1:-1])
+            parts.append((lines[-1] + "\n")[: ec + 1])
+            text = "\n".join(parts)
+        _visual[:] = [selection, text]
+        return text
+
+    def _last_placeholder():
+        p = state.get("last_placeholder")
+        if not p:
+            return None
+        start = _Position(int(p["start"]["line"]), int(p["start"]["col"]))
+        end = _Position(int(p["end"]["line"]), int(p["end"]["col"]))
+        return _Placeholder(p["current_text"], start, end)
+
+    def _requesting():
+        """True when the code is executed during a request of coc."""
+        return __requesting
+
+    def _call(name, *args):
+        """Call vim function, python values of args are converted by vim."""
+        if hasattr(vim, "call"):
+            return vim.call(name, *args)
+        return vim.Function(name)(*args)
+
+    class AnonymousExpansions(object):
+        """
+        Anonymous snippets expanded by python code. Expansions in batch() are
+        queued and sent to coc by one request when the batch ends, in the
+        order of expand_anon() calls.
+        """
+
+        def __init__(self):
+            self._items = []
+            self._depth = 0
+
+        def __len__(self):
+            return len(self._items)
+
+        @contextmanager
+        def batch(self):
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.flush()
+
+        def add(self, value, trigger=""):
+            """Queue snippet which replaces trigger before the cursor."""
+            pos = vim.eval("coc#cursor#position()")
+            line, character = int(pos[0]), int(pos[1])
+            self._items.append({
+                "range": {
+                    "start": {"line": line, "character": character - len(trigger)},
+                    "end": {"line": line, "character": character},
+                },
+                "text": value,
+            })
+            if self._depth == 0:
+                self.flush()
+
+        def flush(self):
+            items, self._items = self._items, []
+            if not items:
+                return
+            # Python of vim doesn't have event loop, use vim's timer
+            if _requesting():
+                _call("coc#util#timer", "coc#rpc#notify", ["snippetInsertBatch", [items]])
+            else:
+                _call("coc#rpc#request", "snippetInsertBatch", [items])
+                vim.command("redraw")
+
+    def expand_anon(value, trigger="", cursor = None):
+        if len(value) == 0:
+            return
+        expansions.add(value, trigger)
+        if cursor is not None:
+            cursor.preserve()
+
+    class Position:
+        """Represents a Position in a text file: (0 based line index, 0 based column
+        index) and provides methods for moving them around."""
+
+        def __init__(self, line, col):
+            self.line = line
+            self.col = col
+
+        def move(self, pivot, delta):
+            """'pivot' is the position of the first changed character, 'delta' is
+            how text after it moved."""
+            if self < pivot:
+                return
+            if delta.line == 0:
+                if self.line == pivot.line:
+                    self.col += delta.col
+            elif delta.line > 0:
+                if self.line == pivot.line:
+                    self.col += delta.col - pivot.col
+                self.line += delta.line
+            else:
+                self.line += delta.line
+                if self.line == pivot.line:
+                    self.col += -delta.col + pivot.col
+
+        def __add__(self, pos):
+            assert isinstance(pos, Position)
+            return Position(self.line + pos.line, self.col + pos.col)
+
+        def __sub__(self, pos):
+            assert isinstance(pos, Position)
+            return Position(self.line - pos.line, self.col - pos.col)
+
+        def __eq__(self, other):
+            return (self.line, self.col) == (other.line, other.col)
+
+        def __ne__(self, other):
+            return (self.line, self.col) != (other.line, other.col)
+
+        def __lt__(self, other):
+            return (self.line, self.col) < (other.line, other.col)
+
+        def __le__(self, other):
+            return (self.line, self.col) <= (other.line, other.col)
+
+        def __repr__(self):
+            return "(%i,%i)" % (self.line, self.col)
+
+        def __getitem__(self, index):
+            if index > 1:
+                raise IndexError("position can be indexed only 0 (line) and 1 (column)")
+            if index == 0:
+                return self.line
+            else:
+                return self.col
+
+    def _common_prefix(a, b):
+        """Length of the common prefix of 'a' and 'b'."""
+        lo, hi = 0, min(len(a), len(b))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if a[:mid] == b[:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _common_suffix(a, b):
+        """Length of the common suffix of 'a' and 'b'."""
+        lo, hi = 0, min(len(a), len(b))
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if a[len(a) - mid:] == b[len(b) - mid:]:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _middle_snake(a, b):
+        """Return the (x, y) split point on the middle snake of the shortest
+        edit script between 'a' and 'b', both paths are walked at the same
+        time so only O(N) memory is needed. None when the edit distance is
+        over DIFF_EDIT_LIMIT."""
+        n, m = len(a), len(b)
+        max_d = (n + m + 1) // 2
+        offset = max_d
+        size = 2 * max_d + 2
+        vf = [-1] * size
+        vb = [-1] * size
+        vf[offset + 1] = 0
+        vb[offset + 1] = 0
+        delta = n - m
+        odd = delta % 2 != 0
+        # Shrink the k ranges when a path leaves the edit graph.
+        f_start = f_end = b_start = b_end = 0
+        for d in range(min(max_d, DIFF_EDIT_LIMIT // 2 + 1)):
+            for k in range(-d + f_start, d + 1 - f_end, 2):
+                i = offset + k
+                if k == -d or (k != d and vf[i - 1] < vf[i + 1]):
+                    x = vf[i + 1]
+                else:
+                    x = vf[i - 1] + 1
+                y = x - k
+                while x < n and y < m and a[x] == b[y]:
+                    x += 1
+                    y += 1
+                vf[i] = x
+                if x > n:
+                    f_end += 2
+                elif y > m:
+                    f_start += 2
+                elif odd:
+                    j = offset + delta - k
+                    if 0 <= j < size and vb[j] != -1 and x >= n - vb[j]:
+                        return x, y
+            for k in range(-d + b_start, d + 1 - b_end, 2):
+                i = offset + k
+                if k == -d or (k != d and vb[i - 1] < vb[i + 1]):
+                    x = vb[i + 1]
+                else:
+                    x = vb[i - 1] + 1
+                y = x - k
+                while x < n and y < m and a[n - x - 1] == b[m - y - 1]:
+                    x += 1
+                    y += 1
+                vb[i] = x
+                if x > n:
+                    b_end += 2
+                elif y > m:
+                    b_start += 2
+                elif not odd:
+                    j = offset + delta - k
+                    if 0 <= j < size and vf[j] != -1 and vf[j] >= n - x:
+                        return vf[j], offset + vf[j] - j
+        return None
+
+    def _diff_ops(a, b, ops):
+        """Append the ("=", "D", "I") operations that turn 'a' into 'b' to
+        'ops'."""
+        # The common suffix is trimmed first, so edits happen as early as
+        # possible.
+        suffix = _common_suffix(a, b)
+        tail = a[len(a) - suffix:] if suffix else ""
+        if suffix:
+            a, b = a[:len(a) - suffix], b[:len(b) - suffix]
+        prefix = _common_prefix(a, b)
+        if prefix:
+            ops.append(("=", a[:prefix]))
+            a, b = a[prefix:], b[prefix:]
+        if not a:
+            if b:
+                ops.append(("I", b))
+        elif not b:
+            ops.append(("D", a))
+        else:
+            split = _middle_snake(a, b)
+            if split is None or split == (0, 0) or split == (len(a), len(b)):
+                # too many edits, replaced as a whole
+                ops.append(("D", a))
+                ops.append(("I", b))
+            else:
+                x, y = split
+                _diff_ops(a[:x], b[:y], ops)
+                _diff_ops(a[x:], b[y:], ops)
+        if tail:
+            ops.append(("=", tail))
+
+    def _to_runs(ops):
+        """Group ("=", "D", "I") operations to runs, an equal text or a
+        [deleted, inserted] pair of the edits between equal texts."""
+        runs = []
+        for kind, text in ops:
+            if kind == "=":
+                if runs and isinstance(runs[-1], str):
+                    runs[-1] += text
+                else:
+                    runs.append(text)
+            elif runs and isinstance(runs[-1], list):
+                runs[-1][0 if kind == "D" else 1] += text
+            else:
+                runs.append([text, ""] if kind == "D" else ["", text])
+        return runs
+
+    def _from_runs(runs):
+        """Convert runs of _to_runs() back to operations, the deletion of a
+        run goes before its insertion."""
+        res = []
+        for run in runs:
+            if isinstance(run, str):
+                if run:
+                    res.append(("=", run))
+                continue
+            if run[0]:
+                res.append(("D", run[0]))
+            if run[1]:
+                res.append(("I", run[1]))
+        return res
+
+    def _merge_equalities(runs):
+        """Fold equalities that are not longer than the edits on both sides
+        into those edits, so 'world' -> 'there' is one deletion and one
+        insertion instead of character level fragments. The edits after the
+        equality have to delete something, a pure insertion is left to
+        _coalesce()."""
+        i = 1
+        while i < len(runs) - 1:
+            eq, before, after = runs[i], runs[i - 1], runs[i + 1]
+            if (
+                isinstance(eq, str)
+                and isinstance(before, list)
+                and isinstance(after, list)
+                and after[0]
+                and "\n" not in eq
+                and len(eq) <= max(len(before[0]), len(before[1]))
+                and len(eq) <= max(len(after[0]), len(after[1]))
+                and len(eq) < max(len(before[0]), len(before[1]), len(after[0]), len(after[1]))
+            ):
+                runs[i - 1 : i + 2] = [[before[0] + eq + after[0], before[1] + eq + after[1]]]
+                i = max(1, i - 1)
+            else:
+                i += 1
+        return runs
+
+    def _coalesce(runs):
+        """Move a deletion or an insertion over the equality between two runs
+        when the equal text allows it, so it joins the same kind of edit on
+        the other side: 'abXab' -> 'aab' deletes 'bXa' at once."""
+        i = 1
+        while i < len(runs) - 1:
+            eq, before, after = runs[i], runs[i - 1], runs[i + 1]
+            if (
+                not (isinstance(eq, str) and isinstance(before, list) and isinstance(after, list))
+                or "\n" in eq
+            ):
+                i += 1
+                continue
+            changed = False
+            for k in (0, 1):
+                e, f = before[k], after[k]
+                if "\n" in e or "\n" in f:
+                    continue
+                if f and (eq + f)[len(f):] == eq:
+                    before[k] = e + (eq + f)[: len(f)]
+                    after[k] = ""
+                    changed = True
+                elif e and f and (e + eq)[: len(eq)] == eq:
+                    after[k] = (e + eq)[len(eq):] + f
+                    before[k] = ""
+                    changed = True
+            if changed:
+                # drop the emptied runs and join the equalities around them
+                runs[:] = _to_runs(_from_runs(runs))
+                i = max(1, i - 1)
+            else:
+                i += 1
+        return runs
+
+    def _slide_left(ops):
+        """Move isolated insertions and deletions within a line as far left as
+        the equal text before them allows, 'aab' -> 'aaab' inserts the 'a' at
+        the start of the line. Newlines are placed by _diff_ops() already."""
+        res = []
+        for i, (kind, text) in enumerate(ops):
+            if (
+                kind != "="
+                and "\n" not in text
+                and res
+                and res[-1][0] == "="
+                and (i + 1 == len(ops) or ops[i + 1][0] == "=")
+            ):
+                eq = res[-1][1]
+                size = len(text)
+                count = 0
+                while count < len(eq) and eq[-1 - count] == text[(size - 1 - count) % size]:
+                    count += 1
+                if count:
+                    shift = count % size
+                    if shift:
+                        text = text[-shift:] + text[:-shift]
+                    if count == len(eq):
+                        res.pop()
+                    else:
+                        res[-1] = ("=", eq[:-count])
+                    res.append((kind, text))
+                    res.append(("=", eq[-count:]))
+                    continue
+            if kind == "=" and res and res[-1][0] == "=":
+                res[-1] = ("=", res[-1][1] + text)
+            else:
+                res.append((kind, text))
+        return res
+
+    # Edits after which diff() replaces the text as a whole.
+    DIFF_EDIT_LIMIT = 200
+
+    def diff(a, b, sline=0):
+        """
+        Return a list of deletions and insertions that will turn 'a' into 'b'.
+        Each hunk is ("D" | "I", line, col, text), the position is relative to
+        the text with all previous hunks applied.
+
+        Texts are diffed by the linear space variant of Myers' O(ND) algorithm
+        on the text left after trimming the common prefix and suffix:
+
+            - Consecutive insertions or deletions are coalesced into a single
+              hunk, a newline is always a hunk of its own.
+            - Short equalities between edits are treated as edits [1].
+            - Edits are placed as early as possible [2].
+            - Texts with more than DIFF_EDIT_LIMIT edits are replaced as a
+              whole, by one deletion and one insertion.
+
+        [1] This is that world -> aolsa will be "D" world + "I" aolsa instead
+            of "D" w , "D" rld, "I" a, "I" lsa
+        [2] This is that "hello\n\n" -> "hello\n\n\n" will insert a newline after
+            hello and not after \n
+        """
+        ops = []
+        _diff_ops(a, b, ops)
+        runs = _coalesce(_merge_equalities(_to_runs(ops)))
+        return _hunks(_slide_left(_from_runs(runs)), sline)
+
+    def _hunks(ops, sline):
+        """Convert ("=", "D", "I") operations to hunks of diff()."""
+        hunks = []
+        line, col = sline, 0
+        for kind, text in ops:
+            for part in re.split(r"(\n)", text):
+                if not part:
+                    continue
+                if kind == "=":
+                    if part == "\n":
+                        line, col = line + 1, 0
+                    else:
+                        col += len(part)
+                    continue
+                last = hunks[-1] if hunks else None
+                if kind == "D":
+                    if (
+                        last
+                        and last[0] == "D"
+                        and last[1] == line
+                        and last[2] == col
+                        and part != "\n"
+                        and last[3] != "\n"
+                    ):
+                        hunks[-1] = ("D", line, col, last[3] + part)
+                    else:
+                        hunks.append(("D", line, col, part))
+                elif part == "\n":
+                    hunks.append(("I", line, col, part))
+                    line, col = line + 1, 0
+                else:
+                    if (
+                        last
+                        and last[0] == "I"
+                        and last[1] == line
+                        and last[2] + len(last[3]) == col
+                        and last[3] != "\n"
+                    ):
+                        hunks[-1] = ("I", line, last[2], last[3] + part)
+                    else:
+                        hunks.append(("I", line, col, part))
+                    col += len(part)
+        return tuple(hunks)
+
+    class VimHooks(object):
+        """
+        Callbacks called before each vim.eval() and vim.command(). The
+        functions of the vim module are wrapped once when the first callback
+        is added and restored when the last one is removed, so users of the
+        hooks never save and restore the functions of each other.
+        """
+
+        def __init__(self):
+            self._hooks = []
+            self._origin = None
+
+        def __len__(self):
+            return len(self._hooks)
+
+        def add(self, hook):
+            if self._origin is None:
+                self._origin = (vim.eval, vim.command)
+                vim.eval = self._wrap(self._origin[0])
+                vim.command = self._wrap(self._origin[1])
+            self._hooks.append(hook)
+
+        def remove(self, hook):
+            self._hooks.remove(hook)
+            if not self._hooks and self._origin is not None:
+                vim.eval, vim.command = self._origin
+                self._origin = None
+
+        def _wrap(self, fn):
+            hooks = self._hooks
+
+            def wrapper(*args, **kwargs):
+                for hook in hooks:
+                    hook()
+                return fn(*args, **kwargs)
+            return wrapper
+
+    class Profiler(object):
+        """
+        Invocations, wall time and vim calls of snippet code by trigger of
+        snippet, kind and id of the code.
+
+        Only code with trigger is measured, vim.eval and vim.command are
+        counted after the first measure until disabled.
+        """
+
+        def __init__(self):
+            self._records = {}
+            self._enabled = False
+            self._calls = 0
+
+        @property
+        def enabled(self):
+            return self._enabled
+
+        def _count(self):
+            self._calls += 1
+
+        def disable(self):
+            """Stop counting vim calls, records are kept."""
+            if self._enabled:
+                hooks.remove(self._count)
+                self._enabled = False
+
+        def measure(self, trigger, kind, code_id, fn, *args):
+            """Call fn with args and record it."""
+            if not self._enabled:
+                hooks.add(self._count)
+                self._enabled = True
+            calls = self._calls
+            start = perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                key = (trigger, kind, code_id)
+                record = self._records.get(key)
+                if record is None:
+                    record = self._records[key] = [0, 0.0, 0]
+                record[0] += 1
+                record[1] += perf_counter() - start
+                record[2] += self._calls - calls
+
+        def report(self, clear=False):
+            """Records as [trigger, kind, code_id, count, milliseconds, vim
+            calls], sorted by time."""
+            items = [list(key) + [r[0], r[1] * 1000, r[2]] for key, r in self._records.items()]
+            items.sort(key=lambda item: item[4], reverse=True)
+            if clear:
+                self._records.clear()
+            return items
+
+    class TimeBudgetExceeded(BaseException):
+        """Raised in snippet code over the time budget, not an Exception, so
+        it's not caught by `except Exception` of the code."""
+
+    class Watchdog(object):
+        """
+        Time budget in seconds of each execution of snippet code, 0 to
+        disable.
+
+        A daemon thread raises TimeBudgetExceeded in the thread of the code
+        when the budget is exceeded, by PyThreadState_SetAsyncExc(), so loops
+        of the code are interrupted without tracing, a single long call of a
+        builtin is interrupted after it returns. Code over the budget is
+        disabled for the session, later executions of it raise at once, until
+        the code is evicted by release of its snippets or buffer.
+        """
+
+        def __init__(self):
+            self.budget = 0
+            self._disabled = {}
+            self._lock = threading.Lock()
+            self._wake = threading.Event()
+            # [thread id, deadline, fired] of the execution
+            self._current = None
+            self._thread = None
+
+        def __contains__(self, code_id):
+            return code_id in self._disabled
+
+        def _error(self, code_id):
+            return TimeBudgetExceeded("Snippet code %s exceeded time budget of %dms, disabled for the session" % (
+                code_id, self._disabled[code_id]))
+
+        def _interrupt(self, thread_id, exc):
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), exc)
+
+        def _watch(self):
+            while True:
+                current = self._current
+                timeout = None if current is None or current[2] else current[1] - perf_counter()
+                if timeout is None or timeout > 0:
+                    self._wake.wait(timeout)
+                    self._wake.clear()
+                    continue
+                with self._lock:
+                    if self._current is current:
+                        current[2] = True
+                        self._interrupt(current[0], ctypes.py_object(TimeBudgetExceeded))
+
+        def run(self, code_id, fn, *args):
+            """Call fn with args in the budget of code."""
+            if code_id in self._disabled:
+                raise self._error(code_id)
+            budget = self.budget
+            # nested executions are in the budget of the outer one
+            if not budget or self._current is not None:
+                return fn(*args)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name="coc-snippet-watchdog")
+                self._thread.daemon = True
+                self._thread.start()
+            current = [threading.get_ident(), perf_counter() + budget, False]
+            self._current = current
+            try:
+                try:
+                    self._wake.set()
+                    return fn(*args)
+                finally:
+                    self._stop(current)
+            except TimeBudgetExceeded:
+                # raised before or in the stop of finally, stop again
+                self._stop(current)
+                if not current[2]:
+                    raise
+                self._disabled[code_id] = int(budget * 1000)
+                raise self._error(code_id)
+
+        def _stop(self, current):
+            """Stop watching the execution, the exception fired but not raised
+            yet is cleared."""
+            with self._lock:
+                if self._current is current:
+                    self._current = None
+            if current[2]:
+                self._interrupt(current[0], None)
+
+        def release(self, code_ids):
+            """Enable codes disabled for the session, called when the codes
+            are evicted."""
+            for code_id in code_ids:
+                self._disabled.pop(code_id, None)
+
+    class CodeRegistry(object):
+        """
+        Compiled code objects of snippet python code.
+
+        Each distinct source is compiled once, keyed by the hash of the source,
+        and executed by id afterwards. Codes are owned by the snippets that use
+        them, by id of the snippet, or by the buffer for codes of no snippet,
+        and evicted when the last owner releases them.
+        """
+
+        # global names of pure code, builtins which don't read or change state,
+        # reflective builtins could reach attributes of snip by name
+        pure_globals = frozenset(name for name in dir(builtins) if name not in (
+            "open", "input", "print", "globals", "locals", "vars", "exec", "eval", "compile",
+            "__import__", "breakpoint", "help", "exit", "quit", "getattr", "setattr", "delattr",
+            "hasattr", "dir",
+        )) | frozenset(["snip", "t", "match"])
+        # attributes of snip which read or change the editor
+        impure_attributes = frozenset([
+            "buffer", "cursor", "window", "expand_anon", "p", "last_placeholder", "opt", "v",
+            "visual_content", "fn", "basename", "ft", "context", "snippet_start", "snippet_end",
+        ])
+        # instructions using global names, names stored by the code are not
+        # global when loaded
+        global_ops = frozenset(["LOAD_NAME", "LOAD_GLOBAL", "STORE_GLOBAL", "DELETE_GLOBAL"])
+
+        def __init__(self):
+            self._codes = {}
+            self._owners = {}
+            self._names = {}
+            self._globals = {}
+
+        def __len__(self):
+            return len(self._codes)
+
+        def __contains__(self, code_id):
+            return code_id in self._codes
+
+        def get(self, code_id, source=None, owner=0, mode="exec"):
+            """Code object by id, the source is only needed when the code is
+            not compiled, mode is "eval" for expression."""
+            code = self._codes.get(code_id)
+            if code is None:
+                if source is None:
+                    raise LookupError("Unknown code %s" % code_id)
+                code = compile(source, "<snippet code %s>" % code_id, mode)
+                self._codes[code_id] = code
+            self._owners.setdefault(code_id, set()).add(owner)
+            return code
+
+        def names(self, code_id):
+            """Names of globals and attributes used by code and its nested
+            code objects."""
+            names = self._names.get(code_id)
+            if names is None:
+                names = set()
+                stack = [self._codes[code_id]]
+                while stack:
+                    code = stack.pop()
+                    names.update(code.co_names)
+                    stack.extend(c for c in code.co_consts if hasattr(c, "co_names"))
+                names = self._names[code_id] = frozenset(names)
+            return names
+
+        def global_names(self, code_id):
+            """Global names read or written by code and its nested code
+            objects, names assigned by the code before use are not included.
+            An import is the use of __import__."""
+            names = self._globals.get(code_id)
+            if names is None:
+                names = set()
+                stored = set()
+                stack = [self._codes[code_id]]
+                while stack:
+                    code = stack.pop()
+                    for ins in dis.get_instructions(code):
+                        if ins.opname in self.global_ops:
+                            if not (ins.opname.startswith("LOAD") and ins.argval in stored):
+                                names.add(ins.argval)
+                        elif ins.opname in ("STORE_NAME", "DELETE_NAME"):
+                            stored.add(ins.argval)
+                        elif ins.opname == "IMPORT_NAME":
+                            names.add("__import__")
+                    stack.extend(c for c in code.co_consts if hasattr(c, "co_names"))
+                names = self._globals[code_id] = frozenset(names)
+            return names
+
+        def pure(self, code_id):
+            """Code only uses builtins, snip, t and match as globals, and no
+            attribute of snip which reads the editor, so the result only
+            depends on tabstops and snip.c. Special attributes like __class__
+            could reach the other attributes, they make the code impure."""
+            names = self.names(code_id)
+            return (self.global_names(code_id) <= self.pure_globals
+                    and not (names & self.impure_attributes)
+                    and not any(name.startswith("__") for name in names))
+
+        def run(self, code_id, scope, owner=0, source=None, trigger=None, kind="code"):
+            """Execute code in scope, which is globals() of :pyx command, the
+            execution is profiled when trigger is not None."""
+            code = self.get(code_id, source, owner)
+            if trigger is None:
+                watchdog.run(code_id, self._exec, code, scope)
+            else:
+                profiler.measure(trigger, kind, code_id, watchdog.run, code_id, self._exec, code, scope)
+
+        def _exec(self, code, scope):
+            snip = scope.get("snip")
+            # Anonymous snippets are inserted after the code finished.
+            with expansions.batch():
+                if isinstance(snip, BaseContext):
+                    # Writes of snippet action to snip.buffer are sent in batch.
+                    with snip.buffer.batch():
+                        exec(code, scope)
+                else:
+                    exec(code, scope)
+
+        def release(self, owner, ids=None):
+            """Release codes of snippets by ids, or of owner and all snippets
+            of owner, returns ids of evicted codes."""
+            if ids is None:
+                prefix = "%s-" % owner
+                ids = set(o for owners in self._owners.values() for o in owners
+                          if str(o) == str(owner) or str(o).startswith(prefix))
+            else:
+                ids = set(ids)
+            evicted = []
+            for code_id, owners in list(self._owners.items()):
+                owners.difference_update(ids)
+                if not owners:
+                    del self._owners[code_id]
+                    del self._codes[code_id]
+                    self._names.pop(code_id, None)
+                    self._globals.pop(code_id, None)
+                    evicted.append(code_id)
+            watchdog.release(evicted)
+            return evicted
+
+    class TabStops(object):
+        """
+        Values of tabstops by snippet, which are changed by changes of values
+        from the snippet, instead of recreating the tuple of all values.
+        """
+
+        def __init__(self):
+            self._values = {}
+            self._memos = {}
+
+        def __contains__(self, snippet_id):
+            return snippet_id in self._values
+
+        def get(self, snippet_id):
+            """Values of snippet as tuple, same as t of snippet code."""
+            return tuple(self._values.get(snippet_id, ()))
+
+        def sync(self, changes, scope=None):
+            """
+            Apply changes of snippet, which is a dict or json string of:
+
+                id: id of the snippet.
+                size: count of tabstop values.
+                deltas: changed values by tabstop index.
+                reset: deltas contains all values.
+
+            Set t of scope when scope exists, returns the values.
+            """
+            if isinstance(changes, str):
+                changes = json.loads(changes)
+            snippet_id = changes["id"]
+            values = self._values.get(snippet_id)
+            if changes.get("reset"):
+                values = self._values[snippet_id] = []
+                self._memos.pop(snippet_id, None)
+            elif values is None:
+                raise LookupError("Unknown tabstops %s" % snippet_id)
+            size = changes["size"]
+            if len(values) > size:
+                del values[size:]
+            else:
+                values.extend([""] * (size - len(values)))
+            for index, value in changes["deltas"].items():
+                values[int(index)] = value
+            if scope is not None:
+                scope["t"] = tuple(values)
+            return values
+
+        def memo(self, snippet_id):
+            """Results of pure blocks of snippet, [inputs, rv] by code id."""
+            return self._memos.setdefault(snippet_id, {})
+
+        def release(self, owner, ids=None):
+            """Remove values of snippets by ids, or all snippets of owner."""
+            if ids is None:
+                prefix = "%s-" % owner
+                ids = [k for k in self._values if k.startswith(prefix)]
+            for snippet_id in ids:
+                self._values.pop(snippet_id, None)
+                self._memos.pop(snippet_id, None)
+
+    class ContextStore(object):
+        """
+        Context and match of snippet expansions by context id, which is
+        bufnr-n. Contexts are kept by buffer, the least recently used contexts
+        are evicted when the count of buffer exceeds the limit.
+        """
+
+        def __init__(self, limit=20):
+            self.limit = limit
+            self._buffers = {}
+
+        def __len__(self):
+            return sum(len(bucket) for bucket in self._buffers.values())
+
+        def __contains__(self, context_id):
+            return context_id in self._buffers.get(context_id.split("-")[0], ())
+
+        def set(self, context_id, context, match, limit=None):
+            if limit is not None:
+                self.limit = max(1, limit)
+            bucket = self._buffers.setdefault(context_id.split("-")[0], OrderedDict())
+            bucket[context_id] = (context, match)
+            bucket.move_to_end(context_id)
+            while len(bucket) > self.limit:
+                bucket.popitem(last=False)
+
+        def get(self, context_id):
+            """Returns (context, match), (None, None) when not exists."""
+            bucket = self._buffers.get(context_id.split("-")[0])
+            if bucket is None or context_id not in bucket:
+                return (None, None)
+            bucket.move_to_end(context_id)
+            return bucket[context_id]
+
+        def release(self, owner, ids=None):
+            """Remove contexts by ids, or all contexts of owner."""
+            key = str(owner)
+            if ids is None:
+                self._buffers.pop(key, None)
+                return
+            bucket = self._buffers.get(key, {})
+            for context_id in ids:
+                bucket.pop(context_id, None)
+            if not bucket:
+                self._buffers.pop(key, None)
+
+    class TriggerMatcher(object):
+        """
+        Regex triggers of snippets matched with python semantics. Patterns
+        are compiled once for the lifetime of the process, invalid patterns
+        are kept as None and never match.
+        """
+
+        def __init__(self):
+            self._patterns = {}
+
+        def __len__(self):
+            return len(self._patterns)
+
+        def compile(self, regex):
+            """Compiled pattern of regex, raises re.error when invalid."""
+            pattern = self._patterns.get(regex)
+            if pattern is None:
+                if regex in self._patterns:
+                    raise re.error("Invalid pattern %s" % regex)
+                try:
+                    pattern = re.compile(regex)
+                except re.error:
+                    self._patterns[regex] = None
+                    raise
+                self._patterns[regex] = pattern
+            return pattern
+
+        def match(self, prefix, triggers):
+            """
+            Match regex triggers against the line before cursor, like
+            UltiSnips the match should end at the end of prefix. Returns
+            [index, start, groups] of matched triggers, start is the column of
+            matched text in prefix and groups are the groups of the match.
+            """
+            if isinstance(triggers, str):
+                triggers = json.loads(triggers)
+            end = len(prefix)
+            matches = []
+            for index, regex in enumerate(triggers):
+                try:
+                    pattern = self.compile(regex)
+                except re.error:
+                    continue
+                for match in pattern.finditer(prefix):
+                    if match.end() == end:
+                        matches.append([index, match.start(), list(match.groups())])
+                        break
+            return matches
+
+    def eval_contexts(scope, args):
+        """
+        Evaluate context expressions of snippet candidates against one
+        ContextSnippet shared as `snip` of scope. args is json of:
+
+            owner: buffer number owns the compiled expressions.
+            limit: max count of contexts kept for the buffer.
+            candidates: [context_id, code_id, source, trigger] of snippets,
+                source is None when compiled, profiled when trigger is not None.
+
+        Truthy contexts are saved by context id. Returns [active, error] of
+        each candidate, error is message of the exception raised by the
+        expression.
+        """
+        if isinstance(args, str):
+            args = json.loads(args)
+        owner = args.get("owner", 0)
+        limit = args.get("limit")
+        scope["snip"] = ContextSnippet()
+        results = []
+        for context_id, code_id, source, trigger in args["candidates"]:
+            # LookupError of code not compiled is raised, the client sends
+            # all sources again.
+            try:
+                code = registry.get(code_id, source, owner, "eval")
+                if trigger is None:
+                    context = watchdog.run(code_id, eval, code, scope)
+                else:
+                    context = profiler.measure(trigger, "context", code_id, watchdog.run, code_id, eval, code, scope)
+            except (Exception, TimeBudgetExceeded) as e:
+                if isinstance(e, LookupError) and code_id not in registry:
+                    raise
+                results.append([False, "%s: %s" % (type(e).__name__, e)])
+                continue
+            if context:
+                contexts.set(context_id, context, None, limit)
+            results.append([bool(context), None])
+        return results
+
+    def _schedule_ranks(positions, related, affected):
+        """
+        Topological ranks of scheduled blocks, a block depends on the blocks
+        which affect tabstops of its related. Returns ranks by position and
+        positions of blocks in cycles, which are ranked after others.
+        """
+        dependents = dict((pos, []) for pos in positions)
+        degrees = dict((pos, 0) for pos in positions)
+        for pos in positions:
+            for other in positions:
+                if other != pos and affected[other] & related[pos]:
+                    dependents[other].append(pos)
+                    degrees[pos] += 1
+        ranks = {}
+        ready = [pos for pos in positions if degrees[pos] == 0]
+        while ready:
+            pos = ready.pop(0)
+            ranks[pos] = len(ranks)
+            for dep in dependents[pos]:
+                degrees[dep] -= 1
+                if degrees[dep] == 0:
+                    ready.append(dep)
+        cycles = [pos for pos in positions if pos not in ranks]
+        for pos in cycles:
+            ranks[pos] = len(ranks)
+        return ranks, cycles
+
+    def eval_blocks(scope, args):
+        """
+        Evaluate python blocks of a snippet in one call, scope is globals() of
+        :pyx command with snip defined, args is a json string of:
+
+            owner: id of the snippet owns the compiled codes.
+            blocks: [code_id, source, current text, related, memo] of blocks,
+                    source is null when the code is compiled, related are
+                    indexes of tabstops used by the code, memo is true when
+                    the code only reads t by the indexes of related.
+            order: positions of blocks to evaluate first.
+            schedule: positions of blocks evaluated when their related tabstops
+                      changed, by topological order until values not change.
+            after: positions of blocks to evaluate last.
+            limit: max evaluations of each scheduled block, default 10.
+            tabstops: changes of tabstop values, see TabStops.sync.
+            templates: parts of the tabstop values which contain blocks, by
+                       tabstop index, a part is text, position of block or
+                       [index] of nested tabstop.
+            trigger: trigger of the snippet, blocks are profiled when exists.
+
+        Tabstop values are updated when a block changed, so blocks evaluated
+        later see the new values by t. Tabstops in the deltas of changes are
+        considered changed for scheduled blocks.
+
+        Results of pure blocks with memo are kept by the snippet, a block is
+        not executed when values of its related tabstops, and snip.c when the
+        code uses it, are the same as the last execution.
+
+        Returns text of changed blocks by position, tabstop values changed by
+        blocks, positions of scheduled blocks in cycles and whether the limit
+        is reached.
+        """
+        args = json.loads(args)
+        owner = args.get("owner", 0)
+        blocks = args["blocks"]
+        # lookup all codes first, nothing evaluated when a code is unknown.
+        codes = [registry.get(block[0], block[1], owner) for block in blocks]
+        current = [block[2] for block in blocks]
+        related = [set(block[3]) for block in blocks]
+        # related indexes and whether snip.c is used of memoized blocks
+        inputs = [(sorted(block[3]), "c" in registry.names(block[0])) if len(block) > 4 and block[4] and
+                  registry.pure(block[0]) else None for block in blocks]
+        changes = args["tabstops"]
+        values = tabstops.sync(changes)
+        memo = tabstops.memo(changes["id"])
+        dirty = set(int(index) for index in changes["deltas"])
+        updated = set()
+        templates = dict((int(k), v) for k, v in args["templates"].items())
+        block_tabstop = {}
+        tabstop_parents = {}
+        for index, parts in templates.items():
+            for part in parts:
+                if isinstance(part, int):
+                    block_tabstop[part] = index
+                elif isinstance(part, list):
+                    tabstop_parents.setdefault(part[0], set()).add(index)
+
+        def ancestors(index):
+            res = set()
+            stack = [index]
+            while stack:
+                index = stack.pop()
+                if index not in res:
+                    res.add(index)
+                    stack.extend(tabstop_parents.get(index, ()))
+            return res
+
+        def update(index, indexes):
+            if index in indexes:
+                return
+            text = "".join(
+                part if isinstance(part, str) else
+                current[part] if isinstance(part, int) else
+                values[part[0]] for part in templates[index]
+            )
+            if text == values[index]:
+                return
+            values[index] = text
+            indexes.add(index)
+            for parent in tabstop_parents.get(index, ()):
+                update(parent, indexes)
+
+        snip = scope["snip"]
+        scope["t"] = tuple(values)
+        changed = {}
+        trigger = args.get("trigger")
+
+        def evaluate(pos):
+            """Evaluate block, returns indexes of changed tabstops."""
+            code_id = blocks[pos][0]
+            key = None
+            if inputs[pos] is not None:
+                indexes, use_c = inputs[pos]
+                key = (tuple(values[i] if i < len(values) else "" for i in indexes), current[pos] if use_c else None)
+            last = memo.get(code_id)
+            if key is not None and last is not None and last[0] == key:
+                rv = last[1]
+            else:
+                snip._reset(current[pos])
+                if trigger is None:
+                    watchdog.run(code_id, exec, codes[pos], scope)
+                else:
+                    profiler.measure(trigger, "block", code_id, watchdog.run, code_id, exec, codes[pos], scope)
+                rv = str(snip.rv)
+                if key is not None:
+                    memo[code_id] = (key, rv)
+            if rv == current[pos]:
+                return set()
+            current[pos] = rv
+            changed[pos] = rv
+            indexes = set()
+            if pos in block_tabstop:
+                update(block_tabstop[pos], indexes)
+                scope["t"] = tuple(values)
+                updated.update(indexes)
+            return indexes
+
+        for pos in args.get("order", []):
+            dirty.update(evaluate(pos))
+        schedule = args.get("schedule", [])
+        affected = dict((pos, ancestors(block_tabstop[pos]) if pos in block_tabstop else set()) for pos in schedule)
+        ranks, cycles = _schedule_ranks(schedule, related, affected)
+        limit = args.get("limit", 10)
+        counts = dict((pos, 0) for pos in schedule)
+        pending = set(pos for pos in schedule if related[pos] & dirty)
+        truncated = False
+        while pending:
+            pos = min(pending, key=ranks.get)
+            pending.discard(pos)
+            if counts[pos] == limit:
+                truncated = True
+                break
+            counts[pos] += 1
+            indexes = evaluate(pos)
+            if indexes:
+                pending.update(other for other in schedule if related[other] & indexes)
+        for pos in args.get("after", []):
+            evaluate(pos)
+        return {
+            "blocks": dict((str(pos), rv) for pos, rv in changed.items()),
+            "values": dict((str(index), values[index]) for index in updated),
+            "cycles": cycles,
+            "truncated": truncated,
+        }
+
+    class BufferLines(object):
+        """
+        Read-through snapshot of the lines of a vim buffer.
+
+        Lines are fetched by chunks of `chunk_size` on first read and kept
+        while b:changedtick is the tick of the snapshot, writes made through
+        the snapshot update the cached lines in place, so reads of a large
+        buffer cost a few calls of vim. Changes made by others are detected
+        by validate(), which drops the cached lines.
+
+        Between begin() and end(), writes only change the cached lines and
+        are recorded as edits [start, end, origin_start, origin_end], lines
+        from start to end replace the lines from origin_start to origin_end
+        of the buffer. Edits are sorted and merged when they overlap or
+        touch, commit() sends one replacement for each of them.
+        """
+
+        chunk_size = 500
+
+        def __init__(self, buffer, tick=None):
+            self._buffer = buffer
+            self._lines = None
+            self._tick = tick
+            self._edits = None
+
+        @property
+        def number(self):
+            return self._buffer.number
+
+        def validate(self, tick=None):
+            """Drop cached lines when b:changedtick is not the tick of the
+            snapshot, returns the tick."""
+            self.commit()
+            if tick is None:
+                tick = int(vim.eval("b:changedtick"))
+            if tick != self._tick:
+                self._lines = None
+                self._tick = tick
+            return tick
+
+        @property
+        def pending(self):
+            """Count of edits not sent to vim."""
+            return len(self._edits) if self._edits else 0
+
+        def begin(self):
+            """Keep writes in memory until end()."""
+            if self._edits is None:
+                self._edits = []
+
+        def end(self):
+            """Send recorded edits to vim and stop recording, returns the
+            count of writes."""
+            count = self.commit()
+            self._edits = None
+            return count
+
+        def commit(self):
+            """Send recorded edits to vim, returns the count of writes."""
+            edits = self._edits
+            if not edits:
+                return 0
+            self._edits = []
+            lines = self._lines
+            # From the last edit, so origin lines of others are not moved.
+            for start, end, origin_start, origin_end in reversed(edits):
+                if end - start == 1 and origin_end - origin_start == 1:
+                    self._buffer[origin_start] = lines[start]
+                else:
+                    self._buffer[origin_start:origin_end] = lines[start:end]
+            self._tick += len(edits)
+            state.invalidate()
+            return len(edits)
+
+        def _record(self, start, end, count):
+            """Record lines from start to end replaced by count lines."""
+            edits = self._edits
+            delta = 0
+            i = 0
+            while i < len(edits) and edits[i][1] < start:
+                edit = edits[i]
+                delta += (edit[1] - edit[0]) - (edit[3] - edit[2])
+                i += 1
+            merged = [start, end, start - delta, None]
+            j = i
+            while j < len(edits) and edits[j][0] <= end:
+                edit = edits[j]
+                if edit[0] < merged[0]:
+                    merged[0], merged[2] = edit[0], edit[2]
+                if edit[1] >= merged[1]:
+                    merged[1], merged[3] = edit[1], edit[3]
+                delta += (edit[1] - edit[0]) - (edit[3] - edit[2])
+                j += 1
+            if merged[3] is None:
+                merged[3] = end - delta
+            shift = count - (end - start)
+            merged[1] += shift
+            for edit in edits[j:]:
+                edit[0] += shift
+                edit[1] += shift
+            edits[i:j] = [merged]
+
+        def _load(self):
+            if self._tick is None:
+                self._tick = int(vim.eval("b:changedtick"))
+            self._lines = [None] * len(self._buffer)
+            return self._lines
+
+        def _fetch(self, start, end):
+            """Fetch the chunks contain lines from start to end (exclusive),
+            lines of recorded edits are always cached, others are read from
+            their origin lines."""
+            size = self.chunk_size
+            start = start - start % size
+            end = min(len(self._lines), max(end, start + size))
+            delta = 0
+            prev = 0
+            for edit in self._edits or ():
+                if edit[0] > start:
+                    self._fill(max(start, prev), min(end, edit[0]), delta)
+                delta += (edit[1] - edit[0]) - (edit[3] - edit[2])
+                prev = edit[1]
+            self._fill(max(start, prev), end, delta)
+
+        def _fill(self, start, end, delta):
+            lines = self._lines
+            while start < end and lines[start] is not None:
+                start += 1
+            while end > start and lines[end - 1] is not None:
+                end -= 1
+            if start < end:
+                lines[start:end] = self._buffer[start - delta:end - delta]
+
+        def __len__(self):
+            lines = self._lines
+            if lines is None:
+                lines = self._load()
+            return len(lines)
+
+        def __getitem__(self, key):
+            lines = self._lines
+            if lines is None:
+                lines = self._load()
+            if isinstance(key, slice):
+                start, end, _ = key.indices(len(lines))
+                if start < end:
+                    self._fetch(start, end)
+                return lines[key]
+            line = key + len(lines) if key < 0 else key
+            if not 0 <= line < len(lines):
+                raise IndexError("line index out of range")
+            text = lines[line]
+            if text is None:
+                self._fetch(line, line + 1)
+                text = lines[line]
+            return text
+
+        def __setitem__(self, key, value):
+            if self._edits is not None:
+                lines = self._lines
+                if lines is None:
+                    lines = self._load()
+                if isinstance(key, slice):
+                    start, end, _ = key.indices(len(lines))
+                    end = max(start, end)
+                    self._record(start, end, len(value))
+                else:
+                    start = key + len(lines) if key < 0 else key
+                    self._record(start, start + 1, 1)
+                lines[key] = value
+                return
+            self._buffer[key] = value
+            state.invalidate()
+            if self._lines is not None:
+                self._lines[key] = value
+            if self._tick is not None:
+                self._tick += 1
+
+        def __iter__(self):
+            for i in range(len(self)):
+                yield self[i]
+
+    class VimBuffer:
+
+        """Wrapper around the current Vim buffer."""
+
+        def __init__(self, tick=None):
+            self._buffer = BufferLines(vim.current.buffer, tick)
+
+        def __getitem__(self, idx):
+            return self._buffer[idx]
+
+        def __setitem__(self, idx, text):
+            self._buffer[idx] = text
+
+        def __len__(self):
+            return len(self._buffer)
+
+        @property
+        def number(self):  # pylint:disable=no-self-use
+            """The bufnr() of the current buffer."""
+            return self._buffer.number
+
+        @property
+        def filetypes(self):
+            return [ft for ft in state.get("filetype").split(".") if ft]
+
+    class VimBufferProxy(VimBuffer):
+        """
+        Proxy object used for tracking changes that made from snippet actions.
+
+        Unfortunately, vim by itself lacks of the API for changing text in
+        trackable maner.
+
+        Vim marks offers limited functionality for tracking line additions and
+        deletions, but nothing offered for tracking changes within single line.
+
+        Instance of this class is passed to all snippet actions and behaves as
+        internal vim.current.window.buffer.
+
+        All changes that are made by user passed to diff algorithm, and resulting
+        diff applied to internal snippet structures to ensure they are in sync with
+        actual buffer contents.
+        """
+        def __init__(self, handlers, tracker=None):
+            """
+            Instantiate new object, handlers receive each change tuple,
+            positions of tracker are updated by the range of each change.
+            """
+            self._change_tick = state.changedtick
+            super().__init__(self._change_tick)
+            self._forward_edits = True
+            self._handlers = handlers
+            self._tracker = tracker
+            self._batch_depth = 0
+
+        def is_buffer_changed_outside(self):
+            """
+            Returns true, if buffer was changed without using proxy object, like
+            with vim.command() or through internal vim.current.window.buffer.
+            """
+            self._commit()
+            return self._change_tick < self._buffer.validate()
+
+        @contextmanager
+        def batch(self):
+            """
+            Keep writes in memory and send them to vim as bulk replacements
+            when the outermost batch exits, changes are forwarded to handlers
+            on each write as before. Pending writes are sent before calls of
+            vim.eval() and vim.command(), which could use the buffer.
+            """
+            self._batch_depth += 1
+            if self._batch_depth > 1:
+                try:
+                    yield self
+                finally:
+                    self._batch_depth -= 1
+                return
+            def flush():
+                if self._buffer.pending:
+                    self._commit()
+            hooks.add(flush)
+            self._buffer.begin()
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                hooks.remove(flush)
+                self._change_tick += self._buffer.end()
+
+        def _commit(self):
+            """Send pending writes to vim."""
+            self._change_tick += self._buffer.commit()
+
+        def validate_buffer(self):
+            """
+            Raises exception if buffer is changed beyond proxy object.
+            """
+            if self.is_buffer_changed_outside():
+                raise os.error(
+                    "buffer was modified using vim.command or "
+                    + "vim.current.buffer; that changes are untrackable and leads to "
+                    + "errors in snippet expansion; use special variable `snip.buffer` "
+                    "for buffer modifications.\n\n"
+                    + "See :help UltiSnips-buffer-proxy for more info."
+                )
+
+        def __setitem__(self, key, value):
+            """
+            Behaves as vim.current.window.buffer.__setitem__ except it tracks
+            changes and applies them to the current snippet stack.
+            """
+            forward = self._forward_edits
+            changes = ()
+            if isinstance(key, slice):
+                value = [line for line in value]
+                start, end, _ = key.indices(len(self._buffer))
+                end = max(start, end)
+                if forward and self._handlers:
+                    changes = list(self._get_diff(start, end, value))
+                self._buffer[start:end] = [line.strip("\n") for line in value]
+                if forward and self._tracker is not None:
+                    self._tracker.replace_lines(start, end, len(value))
+            else:
+                line = key + len(self._buffer) if key < 0 else key
+                before = self._buffer[line]
+                tracked = self._tracker is not None and self._tracker.tracks(line)
+                if forward and (self._handlers or tracked):
+                    changes = list(self._get_line_diff(line, before, value))
+                self._buffer[line] = value
+                if forward and tracked:
+                    if before == "":
+                        self._tracker.replace_lines(line, line + 1, 1)
+                    else:
+                        self._tracker.apply_changes(changes)
+
+            if not self._batch_depth:
+                self._change_tick += 1
+
+            for change in changes:
+                self._apply_change(change)
+
+        def __setslice__(self, i, j, text):
+            """
+            Same as __setitem__.
+            """
+            self.__setitem__(slice(i, j), text)
+
+        def __getitem__(self, key):
+            """
+            Same as vim.current.window.buffer.__getitem__, read from snapshot
+            of buffer lines.
+            """
+            return self._buffer[key]
+
+        def __getslice__(self, i, j):
+            """
+            Same as __getitem__.
+            """
+            return self.__getitem__(slice(i, j))
+
+        def __len__(self):
+            """
+            Same as len(vim.current.window.buffer).
+            """
+            return len(self._buffer)
+
+        def append(self, line, line_number=-1):
+            """
+            Same as vim.current.window.buffer.append(), but with tracking changes.
+            """
+            if line_number < 0:
+                line_number = len(self)
+            if not isinstance(line, list):
+                line = [line]
+            self[line_number:line_number] = [l for l in line]
+
+        def insert(self, index, line):
+            self[index:index] = [line]
+
+        def __delitem__(self, key):
+            if isinstance(key, slice):
+                self.__setitem__(key, [])
+            else:
+                self.__setitem__(slice(key, key + 1), [])
+
+        def _get_diff(self, start, end, new_value):
+            """
+            Very fast diffing algorithm when changes are across many lines.
+            """
+            for line_number in range(start, end):
+                if line_number < 0:
+                    line_number = len(self._buffer) + line_number
+                yield ("D", line_number, 0, self._buffer[line_number], True)
+
+            if start < 0:
+                start = len(self._buffer) + start
+            for line_number in range(0, len(new_value)):
+                yield ("I", start + line_number, 0, new_value[line_number], True)
+
+        def _get_line_diff(self, line_number, before, after):
+            """
+            Use precise diffing for tracking changes in single line.
+            """
+            if before == "":
+                for change in self._get_diff(line_number, line_number + 1, [after]):
+                    yield change
+            else:
+                for change in diff(before, after):
+                    yield (change[0], line_number, change[2], change[3])
+
+        def _apply_change(self, change):
+            """
+            Apply changeset to current snippets stack, correctly moving around
+            snippet itself or its child.
+            """
+            # ('I', 4, 0, 'xy')
+            # change_type, line_number, column_number, change_text = change[0:4]
+            for handler in self._handlers:
+                handler._apply_change(change)
+
+        def _disable_edits(self):
+            """
+            Temporary disable applying changes to snippets stack. Should be done
+            while expanding anonymous snippet in the middle of jump to prevent
+            double tracking.
+            """
+            self._forward_edits = False
+
+        def _enable_edits(self):
+            """
+            Enables changes forwarding back.
+            """
+            self._forward_edits = True
+
+    class PositionWrapper(object):
+        """Position tracked by PositionTracker, invalid when the text around
+        it is removed."""
+
+        __slots__ = ("_position", "_valid")
+
+        def __init__(self, position):
+            self._position = position
+            self._valid = True
+
+        @property
+        def valid(self):
+            return self._valid
+
+        @property
+        def position(self):
+            return self._position
+
+    class PositionTracker(object):
+        """
+        Positions kept sorted by (line, col), shifted or invalidated by the
+        range of a change in one pass. Positions are changed in place, and
+        removed from the tracker when invalid.
+        """
+
+        __slots__ = ("_wrappers",)
+
+        def __init__(self):
+            self._wrappers = []
+
+        def __len__(self):
+            return len(self._wrappers)
+
+        def _bisect(self, line, col=0):
+            """Index of the first position not before (line, col)."""
+            wrappers = self._wrappers
+            lo, hi = 0, len(wrappers)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                pos = wrappers[mid]._position
+                if pos.line < line or (pos.line == line and pos.col < col):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo
+
+        def track(self, position):
+            """Track position, returns the PositionWrapper."""
+            wrapper = PositionWrapper(position)
+            self._wrappers.insert(self._bisect(position.line, position.col), wrapper)
+            return wrapper
+
+        def tracks(self, line):
+            """True when a position is on line."""
+            i = self._bisect(line)
+            return i < len(self._wrappers) and self._wrappers[i]._position.line == line
+
+        def replace_lines(self, start, end, count):
+            """Lines from start to end (exclusive) replaced by count lines,
+            positions in the replaced lines are invalid, positions below are
+            moved by the count of added or removed lines."""
+            wrappers = self._wrappers
+            lo = self._bisect(start)
+            hi = self._bisect(end)
+            for wrapper in wrappers[lo:hi]:
+                wrapper._valid = False
+            del wrappers[lo:hi]
+            delta = count - (end - start)
+            if delta:
+                for i in range(lo, len(wrappers)):
+                    wrappers[i]._position.line += delta
+
+        def apply_changes(self, changes):
+            """
+            Apply ("I" | "D", line, col, text) changes of one line, from
+            diff() of the line. An insertion moves positions at or after its
+            column. A deletion invalidates positions of the line before its
+            end, including the position at its column, and moves positions
+            after it.
+            """
+            wrappers = self._wrappers
+            for kind, line, col, text in changes:
+                if kind == "I":
+                    lo, delta = self._bisect(line, col), len(text)
+                else:
+                    lo, delta = self._bisect(line), -len(text)
+                    hi = self._bisect(line, col + len(text))
+                    for wrapper in wrappers[lo:hi]:
+                        wrapper._valid = False
+                    del wrappers[lo:hi]
+                for i in range(lo, self._bisect(line + 1)):
+                    wrappers[i]._position.col += delta
+
+    class SnippetUtilCursor(object):
+        def __init__(self, cursor):
+            self._cursor = [cursor[0] - 1, cursor[1]]
+            self._set = False
+
+        def preserve(self):
+            self._set = True
+            cursor = vim.current.window.cursor
+            self._cursor = [cursor[0] - 1, cursor[1]]
+
+        def is_set(self):
+            return self._set
+
+        def set(self, line, column):
+            self.__setitem__(0, line)
+            self.__setitem__(1, column)
+            # vim.current.window.cursor = self.to_vim_cursor()
+
+        def to_vim_cursor(self):
+            return (self._cursor[0] + 1, self._cursor[1])
+
+        def __getitem__(self, index):
+            return self._cursor[index]
+
+        def __setitem__(self, index, value):
+            self._set = True
+            self._cursor[index] = value
+
+        def __len__(self):
+            return 2
+
+        def __str__(self):
+            return str((self._cursor[0], self._cursor[1]))
+
+    class IndentUtil(object):
+
+        """Utility class for dealing properly with indentation."""
+
+        _properties = ("shiftwidth", "_expandtab", "_tabstop")
+
+        def reset(self):
+            """Spacing properties are read from the editor state on next
+            use."""
+            for name in self._properties:
+                self.__dict__.pop(name, None)
+
+        def __getattr__(self, name):
+            if name not in self._properties:
+                raise AttributeError(name)
+            self.shiftwidth = state.shiftwidth
+            self._expandtab = state.expandtab
+            self._tabstop = state.tabstop
+            return self.__dict__[name]
+
+        def ntabs_to_proper_indent(self, ntabs):
+            """Convert 'ntabs' number of tabs to the proper indent prefix."""
+            line_ind = ntabs * self.shiftwidth * " "
+            line_ind = self.indent_to_spaces(line_ind)
+            line_ind = self.spaces_to_indent(line_ind)
+            return line_ind
+
+        def indent_to_spaces(self, indent):
+            """Converts indentation to spaces respecting Vim settings."""
+            indent = indent.expandtabs(self._tabstop)
+            right = (len(indent) - len(indent.rstrip(" "))) * " "
+            indent = indent.replace(" ", "")
+            indent = indent.replace("\t", " " * self._tabstop)
+            return indent + right
+
+        def spaces_to_indent(self, indent):
+            """Converts spaces to proper indentation respecting Vim settings."""
+            if not self._expandtab:
+                indent = indent.replace(" " * self._tabstop, "\t")
+            return indent
+
+    class BaseContext(object):
+        def __init__(self):
+            super().__init__()
+            self._cursor = SnippetUtilCursor(state.cursor)
+            line = self._cursor[0]
+            self._columns = ColumnConverter()
+            pos = Position(line, self._columns.byte2col(line + 1, self._cursor[1]))
+            self._tracker = PositionTracker()
+            self._handlers = []
+            self._position = self._tracker.track(pos)
+            self._buffer = VimBufferProxy(self._handlers, self._tracker)
+
+        @property
+        def window(self):
+            return vim.current.window
+
+        @property
+        def buffer(self):
+            return self._buffer
+
+        @property
+        def cursor(self):
+            return self._cursor
+
+        @property
+        def line(self):
+            return vim.current.window.cursor[0] - 1
+
+        @property
+        def column(self):
+            return vim.current.window.cursor[1]
+
+        @property
+        def visual_mode(self):
+            return state.get("visualmode")
+
+        @property
+        def visual_text(self):
+            return state.selected_text
+
+        @property
+        def last_placeholder(self):
+            return _last_placeholder()
+
+        def expand_anon(self, value, trigger="", description="", options="", context=None, actions=None):
+            expand_anon(value, trigger, self._cursor)
+            return True
+
+    class ReturnValue(object):
+        """Append-only text of snip.rv, parts are joined when it's read."""
+
+        __slots__ = ("_parts", "newlines")
+
+        def __init__(self, text=""):
+            self._parts = [text] if text else []
+            self.newlines = text.count("\n")
+
+        def append(self, text):
+            self._parts.append(text)
+            self.newlines += text.count("\n")
+
+        def __str__(self):
+            parts = self._parts
+            if len(parts) > 1:
+                parts[:] = ["".join(parts)]
+            return parts[0] if parts else ""
+
+    class SnippetUtil(object):
+
+        def __init__(self, _initial_indent, start, end, context):
+            self._ind = IndentUtil()
+            self._initial_indent = _initial_indent
+            self._reset("")
+            self._start = Position(start[0], start[1])
+            self._end = Position(end[0], end[1])
+            self._context = context
+
+        def _reset(self, cur):
+            """Gets the snippet ready for another update.
+
+            :cur: the new value for c.
+
+            """
+            self._ind.reset()
+            self._cur = cur
+            self._rv = ReturnValue()
+            self._changed = False
+            self.reset_indent()
+
+        def shift(self, amount=1):
+            """Shifts the indentation level. Note that this uses the shiftwidth
+            because thats what code formatters use.
+
+            :amount: the amount by which to shift.
+
+            """
+            self.indent += " " * self._ind.shiftwidth * amount
+
+        def unshift(self, amount=1):
+            """Unshift the indentation level. Note that this uses the shiftwidth
+            because thats what code formatters use.
+
+            :amount: the amount by which to unshift.
+
+            """
+            by = -self._ind.shiftwidth * amount
+            try:
+                self.indent = self.indent[:by]
+            except IndexError:
+                self.indent = ""
+
+        def mkline(self, line="", indent=None):
+            """Creates a properly set up line.
+
+            :line: the text to add
+            :indent: the indentation to have at the beginning
+                    if None, it uses the default amount
+
+            """
+            if indent is None:
+                indent = self.indent
+                # this deals with the fact that the first line is
+                # already properly indented
+                rv = self._rv
+                if (rv.newlines == 0 if isinstance(rv, ReturnValue) else "\n" not in rv):
+                    try:
+                        indent = indent[len(self._initial_indent) :]
+                    except IndexError:
+                        indent = ""
+                indent = self._ind.spaces_to_indent(indent)
+
+            return indent + line
+
+        def reset_indent(self):
+            """Clears the indentation."""
+            self.indent = self._initial_indent
+
+        def expand_anon(self, value, trigger="", description="", options="", context=None, actions=None):
+            expand_anon(value, trigger)
+            return True
+
+
+        # Utility methods
+        @property
+        def fn(self):  # pylint:disable=no-self-use,invalid-name
+            """The filename."""
+            return state.get("fn") or ""
+
+        @property
+        def basename(self):  # pylint:disable=no-self-use
+            """The filename without extension."""
+            return state.get("basename") or ""
+
+        @property
+        def ft(self):  # pylint:disable=invalid-name
+            """The filetype."""
+            return self.opt("&filetype", "")
+
+        @property
+        def rv(self):  # pylint:disable=invalid-name
+            """The return value.
+
+            The text to insert at the location of the placeholder.
+
+            """
+            rv = self._rv
+            return str(rv) if isinstance(rv, ReturnValue) else rv
+
+        @rv.setter
+        def rv(self, value):  # pylint:disable=invalid-name
+            """See getter."""
+            self._changed = True
+            self._rv = ReturnValue(value) if isinstance(value, str) else value
+
+        @property
+        def _rv_changed(self):
+            """True if rv has changed."""
+            return self._changed
+
+        @property
+        def c(self):  # pylint:disable=invalid-name
+            """The current text of the placeholder."""
+            return self._cur
+
+        @property
+        def v(self):  # pylint:disable=invalid-name
+            """Content of visual expansions."""
+            return _VisualContent(state.get("visualmode"), state.selected_text)
+
+        @property
+        def p(self):
+            return _last_placeholder()
+
+        @property
+        def context(self):
+            return self._context
+
+        def opt(self, option, default=None):  # pylint:disable=no-self-use
+            """Gets a Vim variable."""
+            return state.option(option, default)
+
+        def __add__(self, value):
+            """Appends the given line to rv using mkline."""
+            if not isinstance(self._rv, ReturnValue):
+                self.rv += "\n"  # pylint:disable=invalid-name
+                self.rv += self.mkline(value)
+                return self
+            # not the first line, indent is not reduced by the initial indent
+            self._changed = True
+            self._rv.append("\n" + self.mkline(value, self._ind.spaces_to_indent(self.indent)))
+            return self
+
+        def __lshift__(self, other):
+            """Same as unshift."""
+            self.unshift(other)
+
+        def __rshift__(self, other):
+            """Same as shift."""
+            self.shift(other)
+
+        @property
+        def snippet_start(self):
+            """
+            Returns start of the snippet in format (line, column).
+            """
+            return self._start
+
+        @property
+        def snippet_end(self):
+            """
+            Returns end of the snippet in format (line, column).
+            """
+            return self._end
+
+        @property
+        def buffer(self):
+            return vim.current.buffer
+
+    class ContextSnippet(BaseContext):
+        def __init__(self):
+            super().__init__()
+            # Text of cursor line is read by the column converter already.
+            text = self._columns.line(self._cursor[0] + 1)
+            col = self._position.position.col
+            self._before = text[:col]
+            self._after = text[col:]
+
+        @property
+        def before(self):
+            return self._before
+
+        @property
+        def after(self):
+            return self._after
+
+    class PreExpandContext(BaseContext):
+        @property
+        def visual_content(self):  # pylint:disable=no-self-use
+            return state.selected_text
+
+        def getResult(self):
+            # The action could change the buffer, only keep the encoding.
+            columns = ColumnConverter(self._columns.encoding)
+            wrapper = self._position
+            valid = wrapper.valid and not self._cursor.is_set()
+            if (self._cursor.is_set()):
+                vimcursor = self._cursor.to_vim_cursor()
+            else:
+                if wrapper.valid:
+                    position = wrapper.position
+                    line = position.line + 1
+                    vimcursor = (line, columns.col2byte(line, position.col))
+                else:
+                    vimcursor = vim.current.window.cursor
+            # vim.current.window.cursor = vimcursor
+            # 0 based, line - character
+            cursor = [vimcursor[0] - 1, columns.byte2col(vimcursor[0], vimcursor[1])]
+            return [valid, cursor]
+
+    class PostExpandContext(BaseContext):
+        def __init__(self, positions):
+            super().__init__()
+            self._start = self._tracker.track(Position(positions[0], positions[1]))
+            self._end = self._tracker.track(Position(positions[2], positions[3]))
+
+        @property
+        def snippet_start(self):
+            return self._start.position
+
+        @property
+        def snippet_end(self):
+            return self._end.position
+
+    class PostJumpContext(PostExpandContext):
+        def __init__(self, positions, tabstop, forward):
+            super().__init__(positions)
+            self.tabstop = tabstop
+            self.jump_direction = 1 if forward else -1
+
+        @property
+        def tabstops(self):
+            vimtabstops = vim.vars["coc_ultisnips_tabstops"]
+            if vimtabstops is None:
+                return {}
+            tabstops = {}
+            for stop in vimtabstops:
+                index = stop['index']
+                indexes = stop['range']
+                start = _Position(indexes[0], indexes[1])
+                end =  _Position(indexes[2], indexes[3])
+                tabstops[index] = _Placeholder(stop['text'], start, end)
+            return tabstops
+
+    hooks = VimHooks()
+    profiler = Profiler()
+    watchdog = Watchdog()
+    state = EditorState()
+    expansions = AnonymousExpansions()
+    registry = CodeRegistry()
+    tabstops = TabStops()
+    contexts = ContextStore()
+    triggers = TriggerMatcher()
+    namespace = {
+        'diff': diff,
+        'ColumnConverter': ColumnConverter,
+        'BufferLines': BufferLines,
+        'Position': Position,
+        'PositionTracker': PositionTracker,
+        'state': state,
+        'codes': registry,
+        'hooks': hooks,
+        'profiler': profiler,
+        'watchdog': watchdog,
+        'TimeBudgetExceeded': TimeBudgetExceeded,
+        'tabstops': tabstops,
+        'contexts': contexts,
+        'triggers': triggers,
+        'eval_blocks': eval_blocks,
+        'eval_contexts': eval_contexts,
+        'get_visual_content': get_visual_content,
+        'expansions': expansions,
+        'ReturnValue': ReturnValue,
+        'SnippetUtil': SnippetUtil,
+        'ContextSnippet': ContextSnippet,
+        'PreExpandContext': PreExpandContext,
+        'PostExpandContext': PostExpandContext,
+        'PostJumpContext': PostJumpContext,
+    }
+    return namespace
+
+coc_ultisnips_dict = coc_UltiSnips_create()
+SnippetUtil = coc_ultisnips_dict['SnippetUtil']
+ContextSnippet = coc_ultisnips_dict['ContextSnippet']
+
+# vim:set et sw=4 ts=4:
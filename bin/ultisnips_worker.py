@@ -0,0 +1,341 @@
+"""
+Worker process evaluating python code of the UltiSnips runtime outside of the
+editor, started with path of the runtime, ultisnips.py next to this script by
+default:
+
+    python3 ultisnips_worker.py [/path/to/ultisnips.py]
+
+The msgpack package is required, install it by `python3 -m pip install
+msgpack`. Messages are msgpack-rpc over stdio, the client sends requests:
+
+    expressions() -> expressions of the snapshot, from EditorState.snapshot
+    execute(code, expr, snapshot) -> [value of expr, changes]
+
+The `vim` module is replaced by a stand-in which reads the snapshot of editor
+state sent with the request, other expressions, global variables and options
+not in the snapshot and lines of buffers are requested by `eval` to the
+client. Values of vim.eval() are converted like the python of the host editor
+in `host` of the snapshot, numbers are strings with vim. Writes to buffers,
+variables, options, cursor and commands are collected and returned as changes,
+applied by the client in one batch.
+"""
+import os, sys, types, traceback
+
+try:
+    import msgpack
+except ImportError:
+    sys.stderr.write("ultisnips_worker.py requires the msgpack package of python, "
+                     "install it by: %s -m pip install msgpack\n" % os.path.basename(sys.executable))
+    sys.exit(2)
+
+
+# value of variable or option not exists
+_MISSING = object()
+
+
+def _to_vim(value):
+    """Convert value like vim.eval() of vim, which returns numbers as
+    strings."""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, list):
+        return [_to_vim(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _to_vim(v) for k, v in value.items()}
+    return value
+
+
+class Client(object):
+    """msgpack-rpc connection with the client over stdio."""
+
+    def __init__(self, stdin, stdout):
+        self._fd = stdin.fileno()
+        self._stdout = stdout
+        self._unpacker = msgpack.Unpacker(raw=False)
+        self._msgid = 0
+
+    def read(self):
+        while True:
+            try:
+                return next(self._unpacker)
+            except StopIteration:
+                pass
+            data = os.read(self._fd, 65536)
+            if not data:
+                raise EOFError()
+            self._unpacker.feed(data)
+
+    def write(self, msg):
+        self._stdout.write(msgpack.packb(msg, use_bin_type=True, default=str))
+        self._stdout.flush()
+
+    def request(self, method, params):
+        """Send request to the client and wait for the response, the client
+        doesn't send other requests before current one finished."""
+        self._msgid += 1
+        msgid = self._msgid
+        self.write([0, msgid, method, params])
+        while True:
+            msg = self.read()
+            if msg[0] == 1 and msg[1] == msgid:
+                if msg[2]:
+                    raise VimStub.error(msg[2])
+                return msg[3]
+
+    def serve(self, handlers):
+        while True:
+            try:
+                msg = self.read()
+            except EOFError:
+                return
+            if msg[0] != 0:
+                continue
+            _, msgid, method, params = msg
+            try:
+                result, error = handlers[method](*params), None
+            except Exception:
+                result, error = None, traceback.format_exc()
+            self.write([1, msgid, error, result])
+
+
+def _quote(name):
+    return "'%s'" % name.replace("'", "''")
+
+
+class Buffer(object):
+    """Lines of buffer, fetched from the client on first use."""
+
+    def __init__(self, client, number):
+        self._client = client
+        self.number = number
+        self._origin = None
+        self._lines = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._origin = self._client.request("eval", ["getbufline(%d, 1, '$')" % self.number])
+            self._lines = list(self._origin)
+        return self._lines
+
+    def __getitem__(self, idx):
+        return self.lines[idx]
+
+    def __setitem__(self, idx, value):
+        self.lines[idx] = value
+
+    def __delitem__(self, idx):
+        del self.lines[idx]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def append(self, lines, nr=None):
+        if isinstance(lines, str):
+            lines = [lines]
+        if nr is None:
+            nr = len(self.lines)
+        self.lines[nr:nr] = lines
+
+    def changes(self):
+        """[start, end, lines] to replace lines of the buffer, None when not
+        changed."""
+        a, b = self._origin, self._lines
+        if b is None or a == b:
+            return None
+        start = 0
+        while start < min(len(a), len(b)) and a[start] == b[start]:
+            start += 1
+        end = 0
+        while end < min(len(a), len(b)) - start and a[-1 - end] == b[-1 - end]:
+            end += 1
+        return [start, len(a) - end, b[start:len(b) - end]]
+
+
+class Window(object):
+    def __init__(self, buffer, cursor):
+        self.buffer = buffer
+        self._cursor = tuple(cursor)
+        self.changed = False
+
+    @property
+    def cursor(self):
+        return self._cursor
+
+    @cursor.setter
+    def cursor(self, value):
+        self._cursor = tuple(value)
+        self.changed = True
+
+
+class Buffers(object):
+    """Buffers by number like vim.buffers, the current buffer is included."""
+
+    def __init__(self, client, current):
+        self._client = client
+        self._buffers = {current.number: current}
+
+    def _numbers(self):
+        return self._client.request("eval", ["map(getbufinfo(), 'v:val.bufnr')"])
+
+    def __getitem__(self, number):
+        buffer = self._buffers.get(number)
+        if buffer is None:
+            if not self._client.request("eval", ["bufexists(%d)" % number]):
+                raise KeyError(number)
+            buffer = self._buffers[number] = Buffer(self._client, number)
+        return buffer
+
+    def __contains__(self, number):
+        return number in self._buffers or bool(self._client.request("eval", ["bufexists(%d)" % number]))
+
+    def __iter__(self):
+        return iter([self[number] for number in self._numbers()])
+
+    def __len__(self):
+        return len(self._numbers())
+
+    def changes(self):
+        """[bufnr, start, end, lines] of changed buffers."""
+        res = []
+        for number, buffer in self._buffers.items():
+            change = buffer.changes()
+            if change is not None:
+                res.append([number] + change)
+        return res
+
+
+class Mapping(object):
+    """Global variables or options of the editor, values not in the snapshot
+    are requested from the client on first use. Writes are collected as
+    changes, deleted variable is changed to None."""
+
+    def __init__(self, client, values, expr):
+        self._client = client
+        # expression of [value] or [] when not exists by quoted name
+        self._expr = expr
+        self._values = {k: _MISSING if v is None else v for k, v in values.items()}
+        self.changed = {}
+
+    def _fetch(self, key):
+        value = self._values.get(key)
+        if value is None:
+            found = self._client.request("eval", [self._expr.format(name=_quote(key))])
+            value = self._values[key] = found[0] if found else _MISSING
+        return value
+
+    def __getitem__(self, key):
+        value = self._fetch(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._fetch(key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return self._fetch(key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self.changed[key] = value
+
+    def __delitem__(self, key):
+        if self._fetch(key) is _MISSING:
+            raise KeyError(key)
+        self._values[key] = _MISSING
+        self.changed[key] = None
+
+
+class VimStub(types.ModuleType):
+    """Stand-in of the vim module backed by snapshot of editor state."""
+
+    class error(Exception):
+        pass
+
+    def __init__(self, client):
+        super().__init__("vim")
+        self._client = client
+        self.reset({})
+
+    def reset(self, snapshot):
+        self._exprs = snapshot.get("exprs", {})
+        self._commands = []
+        # vim.eval() of vim returns numbers as strings, neovim keeps types
+        self._convert = _to_vim if snapshot.get("host", "vim") == "vim" else (lambda value: value)
+        self.vars = Mapping(self._client, snapshot.get("vars", {}),
+                            "has_key(g:, {name}) ? [get(g:, {name})] : []")
+        self.options = Mapping(self._client, {}, "exists('&' . {name}) ? [eval('&g:' . {name})] : []")
+        buffer = Buffer(self._client, snapshot.get("bufnr", 0))
+        window = Window(buffer, snapshot.get("cursor", (1, 0)))
+        self.buffers = Buffers(self._client, buffer)
+        self.current = types.SimpleNamespace(buffer=buffer, window=window)
+
+    def eval(self, expr):
+        if expr in self._exprs:
+            return self._convert(self._exprs[expr])
+        return self._convert(self._client.request("eval", [expr]))
+
+    def call(self, name, *args):
+        return self._client.request("call", [name, list(args)])
+
+    def command(self, cmd):
+        self._commands.append(cmd)
+
+    def changes(self):
+        window = self.current.window
+        return {
+            "buffers": self.buffers.changes(),
+            "vars": self.vars.changed,
+            "options": self.options.changed,
+            "cursor": list(window.cursor) if window.changed else None,
+            "commands": self._commands,
+        }
+
+
+class Worker(object):
+    def __init__(self, client, runtime):
+        self.vim = VimStub(client)
+        sys.modules["vim"] = self.vim
+        self.scope = {"__name__": "__main__"}
+        with open(runtime) as f:
+            exec(compile(f.read(), runtime, "exec"), self.scope)
+
+    def expressions(self):
+        """Expressions of editor state evaluated by the runtime."""
+        return list(self.scope["coc_ultisnips_dict"]["state"].snapshot)
+
+    def execute(self, code, expr=None, snapshot=None):
+        """Execute code and evaluate expr in scope of the runtime, state of
+        previous request is kept when snapshot is None."""
+        if snapshot is not None:
+            self.vim.reset(snapshot)
+        if code:
+            exec(code, self.scope)
+        value = None if expr is None else eval(expr, self.scope)
+        return [value, self.vim.changes()]
+
+
+def main():
+    stdout = sys.stdout.buffer
+    # print of snippet code should not break messages.
+    sys.stdout = sys.stderr
+    client = Client(sys.stdin.buffer, stdout)
+    if len(sys.argv) > 1:
+        runtime = sys.argv[1]
+    else:
+        runtime = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ultisnips.py")
+    worker = Worker(client, runtime)
+    client.serve({"execute": worker.execute, "expressions": worker.expressions})
+
+
+if __name__ == "__main__":
+    main()
+
+# vim:set et sw=4 ts=4:
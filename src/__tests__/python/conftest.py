@@ -0,0 +1,158 @@
+"""
+Benchmarks of the UltiSnips runtime (bin/ultisnips.py) with the stand-in vim
+module of this directory, run by:
+
+    python3 -m pytest src/__tests__/python
+
+Each benchmark reports time, allocated memory and vim.eval() calls of one
+run, compared with baselines.json. A benchmark fails when it calls vim.eval()
+more than its baseline, time and memory over the tolerance are reported as
+regressions and fail with --bench-strict. Use --bench-update to store the
+results as new baselines.
+"""
+import gc, json, os, statistics, sys, time, tracemalloc
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUNTIME = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(HERE))), "bin", "ultisnips.py")
+BASELINES = os.path.join(HERE, "baselines.json")
+
+sys.path.insert(0, HERE)
+import vim  # noqa: E402
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption("--bench-update", action="store_true", help="store results as baselines")
+    group.addoption("--bench-strict", action="store_true", help="fail on time and memory regressions")
+    group.addoption("--bench-tolerance", type=float, default=0.5,
+                    help="allowed ratio over baselines of time and memory, default 0.5")
+    group.addoption("--bench-rounds", type=int, default=20, help="timed rounds of each benchmark")
+
+
+class Result(object):
+    def __init__(self, name, seconds, peak, blocks, evals):
+        self.name = name
+        self.seconds = seconds
+        self.peak = peak
+        self.blocks = blocks
+        self.evals = evals
+        self.regressions = []
+
+    def to_json(self):
+        return {"time": round(self.seconds, 6), "peak": self.peak, "blocks": self.blocks, "evals": self.evals}
+
+
+class Bench(object):
+    """Run fn for warm up, count vim.eval() calls and allocations of one run,
+    then time the rounds by median. Each run is a new evaluation cycle of the
+    runtime."""
+
+    def __init__(self, name, rounds):
+        self.name = name
+        self.rounds = rounds
+        self.result = None
+
+    def __call__(self, fn, setup=None):
+        args = setup() if setup else ()
+        vim.new_cycle()
+        fn(*args)
+        args = setup() if setup else ()
+        vim.new_cycle()
+        vim.stats.clear()
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        fn(*args)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        evals = vim.stats.eval_count
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+        times = []
+        for _ in range(self.rounds):
+            args = setup() if setup else ()
+            vim.new_cycle()
+            start = time.perf_counter()
+            fn(*args)
+            times.append(time.perf_counter() - start)
+        self.result = Result(self.name, statistics.median(times), peak, blocks, evals)
+        return self.result
+
+
+class Baselines(object):
+    def __init__(self, config):
+        self.config = config
+        self.results = []
+        try:
+            with open(BASELINES) as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = {}
+
+    def check(self, result):
+        """Compare result with baseline, returns message of failure."""
+        self.results.append(result)
+        base = self.data.get(result.name)
+        if base is None or self.config.getoption("bench_update"):
+            return None
+        tolerance = 1 + self.config.getoption("bench_tolerance")
+        if result.seconds > base["time"] * tolerance:
+            result.regressions.append("time %.3fms > %.3fms" % (result.seconds * 1e3, base["time"] * 1e3))
+        if result.peak > base["peak"] * tolerance:
+            result.regressions.append("peak %d > %d" % (result.peak, base["peak"]))
+        if result.evals > base["evals"]:
+            return "vim.eval() called %d times, baseline %d" % (result.evals, base["evals"])
+        if result.regressions and self.config.getoption("bench_strict"):
+            return ", ".join(result.regressions)
+        return None
+
+    def save(self):
+        data = dict(self.data)
+        for result in self.results:
+            data[result.name] = result.to_json()
+        with open(BASELINES, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+def pytest_configure(config):
+    config._bench_baselines = Baselines(config)
+
+
+@pytest.fixture(scope="session")
+def runtime():
+    """Namespace of the runtime, like globals() of :pyxfile."""
+    scope = {"__name__": "__main__"}
+    with open(RUNTIME) as f:
+        exec(compile(f.read(), RUNTIME, "exec"), scope)
+    vim.cycle_hooks.append(scope["coc_ultisnips_dict"]["state"].invalidate)
+    return scope
+
+
+@pytest.fixture
+def bench(request):
+    vim.reset()
+    b = Bench(request.node.name, request.config.getoption("bench_rounds"))
+    yield b
+    if b.result is not None:
+        message = request.config._bench_baselines.check(b.result)
+        if message:
+            pytest.fail(message)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    baselines = config._bench_baselines
+    if not baselines.results:
+        return
+    tr = terminalreporter
+    tr.write_sep("-", "benchmarks")
+    tr.write_line("%-32s %10s %10s %8s %6s  %s" % ("name", "time(ms)", "peak(KB)", "blocks", "evals", "baseline"))
+    for result in sorted(baselines.results, key=lambda r: r.seconds, reverse=True):
+        base = baselines.data.get(result.name)
+        note = "new" if base is None else ", ".join(result.regressions) or "ok"
+        tr.write_line("%-32s %10.3f %10.1f %8d %6d  %s" % (
+            result.name, result.seconds * 1e3, result.peak / 1024, result.blocks, result.evals, note))
+    if config.getoption("bench_update"):
+        baselines.save()
+        tr.write_line("baselines saved to %s" % BASELINES)
@@ -0,0 +1,395 @@
+"""
+Representative workloads of the UltiSnips runtime, see conftest.py.
+"""
+import json
+import vim
+
+LINES = ["    def method_%d(self, value):  # 中文注释 %d" % (i, i) for i in range(200)]
+
+
+def test_diff_line_edits(bench, runtime):
+    diff = runtime["coc_ultisnips_dict"]["diff"]
+    pairs = [(line, line.replace("value", "other_value")) for line in LINES[:50]]
+
+    def run():
+        for a, b in pairs:
+            diff(a, b)
+
+    result = bench(run)
+    assert result.evals == 0
+
+
+def test_diff_long_line(bench, runtime):
+    diff = runtime["coc_ultisnips_dict"]["diff"]
+    a = '{"key": "value", "list": [1, 2, 3]}, ' * 500
+    b = a[:9000] + a[9000:9200].replace("value", "other") + a[9200:]
+    bench(lambda: diff(a, b))
+
+
+def test_buffer_proxy_line_changes(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+
+    def setup():
+        vim.reset(lines=LINES, cursor=(100, 8))
+        return (ns["PreExpandContext"](),)
+
+    def run(snip):
+        buffer = snip.buffer
+        for i in range(50, 150):
+            buffer[i] = buffer[i].replace("method", "fn")
+        snip.getResult()
+
+    bench(run, setup)
+
+
+def test_buffer_proxy_insert_lines(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+
+    def setup():
+        vim.reset(lines=LINES, cursor=(100, 8))
+        return (ns["PostExpandContext"]([99, 4, 99, 10]),)
+
+    def run(snip):
+        for i in range(50):
+            snip.buffer.append(["# inserted %d" % i, ""], 90)
+        del snip.buffer[10:30]
+        assert snip.snippet_start.line == 99 + 100 - 20
+
+    bench(run, setup)
+
+
+def test_buffer_proxy_replace_slice(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+    lines = LINES * 5
+
+    def setup():
+        vim.reset(lines=lines + [""], cursor=(1001, 8))
+        snip = ns["PostExpandContext"]([1000, 4, 1000, 10])
+        for i in range(0, 1000, 100):
+            snip._tracker.track(ns["Position"](i + 50, 4))
+        return (snip,)
+
+    def run(snip):
+        snip.buffer[0:1000] = [line.replace("method", "fn") for line in lines[:1000]] + ["", ""]
+        assert snip.snippet_start.line == 1002
+
+    bench(run, setup)
+
+
+def test_buffer_proxy_scan(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+    lines = ["import mod_%d" % i for i in range(20)] + LINES * 50
+
+    def setup():
+        vim.reset(lines=lines, cursor=(len(lines), 0))
+        return (ns["PreExpandContext"](),)
+
+    def run(snip):
+        buffer = snip.buffer
+        imports = [i for i in range(len(buffer)) if buffer[i].startswith("import ")]
+        classes = [line for line in buffer if line.startswith("class ")]
+        buffer[len(imports)] = "import extra"
+        assert buffer[len(imports)] == "import extra" and not classes
+        assert vim.stats.reads < 50
+
+    bench(run, setup)
+
+
+def test_buffer_proxy_batch_inserts(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+
+    def setup():
+        vim.reset(lines=LINES, cursor=(100, 8))
+        return (ns["PostExpandContext"]([99, 4, 99, 10]),)
+
+    def run(snip):
+        with snip.buffer.batch():
+            for i in range(100):
+                snip.buffer.append("# inserted %d" % i, 10 + i)
+            for i in range(150, 200):
+                snip.buffer[i] = snip.buffer[i].replace("method", "fn")
+        assert snip.snippet_start.line == 199
+        assert vim.current.buffer[200] == LINES[100]
+        # one replacement of each edited range
+        assert vim.current.buffer.changedtick == 3
+
+    bench(run, setup)
+
+
+def test_snippet_util_mkline(bench, runtime):
+    SnippetUtil = runtime["SnippetUtil"]
+
+    def run():
+        snip = SnippetUtil("    ", (0, 4), (0, 8), None)
+        for i in range(200):
+            if i % 20 == 0:
+                snip.shift()
+            snip += "line %d" % i
+            if i % 20 == 19:
+                snip.unshift()
+        return snip.rv
+
+    bench(run)
+
+
+def test_snippet_util_many_lines(bench, runtime):
+    SnippetUtil = runtime["SnippetUtil"]
+
+    def run():
+        snip = SnippetUtil("    ", (0, 4), (0, 8), None)
+        snip.rv = "enum Value {"
+        snip.shift()
+        for i in range(5000):
+            snip += "VALUE_%d = %d," % (i, i)
+        snip.unshift()
+        snip += "}"
+        assert snip.rv.count("\n") == 5001 and snip._rv_changed
+        return snip.rv
+
+    bench(run)
+
+
+def test_snippet_util_with_latency(bench, runtime):
+    SnippetUtil = runtime["SnippetUtil"]
+    vim.reset(delay=0.0005)
+
+    def run():
+        snip = SnippetUtil("", (0, 0), (0, 0), None)
+        for _ in range(10):
+            # each block is evaluated by a call of coc
+            vim.new_cycle()
+            snip._reset("")
+            snip.rv = snip.fn + snip.basename + snip.ft
+        return snip
+
+    bench(run)
+
+
+def test_indent_util(bench, runtime):
+    SnippetUtil = runtime["SnippetUtil"]
+    vim.reset(exprs={"&expandtab": "0", "&tabstop": "4"})
+    indent = SnippetUtil("", (0, 0), (0, 0), None)._ind
+
+    def run():
+        for i in range(500):
+            indent.ntabs_to_proper_indent(i % 8)
+            indent.indent_to_spaces("\t  \t" * (i % 4))
+        indent.reset()
+
+    bench(run)
+
+
+def test_get_visual_content(bench, runtime):
+    get_visual_content = runtime["coc_ultisnips_dict"]["get_visual_content"]
+    state = {"n": 0}
+
+    def setup():
+        state["n"] += 1
+        vim.reset(lines=LINES)
+        # content of another buffer state, not cached
+        vim.current.buffer.changedtick = state["n"]
+        vim.set_visual("v", (10, 9), (60, 20))
+        return ()
+
+    def run():
+        text = get_visual_content()
+        assert text.count("\n") == 50
+
+    bench(run, setup)
+
+
+def test_get_visual_content_large(bench, runtime):
+    get_visual_content = runtime["coc_ultisnips_dict"]["get_visual_content"]
+    lines = LINES * 25
+    state = {"n": 0}
+
+    def setup():
+        state["n"] += 1
+        vim.reset(lines=lines)
+        vim.current.buffer.changedtick = state["n"]
+        vim.set_visual("V", (1, 1), (len(lines), 2147483647))
+        return ()
+
+    def run():
+        text = get_visual_content()
+        assert text.count("\n") == len(lines)
+        # kept for the same selection
+        assert get_visual_content() is text
+        assert vim.stats.reads <= 1
+
+    bench(run, setup)
+
+
+def test_eval_blocks_chain(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+    SnippetUtil = runtime["SnippetUtil"]
+    size = 20
+    # block of tabstop i + 1 uses value of tabstop i
+    blocks = [["bench-%d" % i, "snip.rv = t[%d] + 'x'" % i, "", [i]] for i in range(size)]
+    templates = dict((i + 1, [i]) for i in range(size))
+    scope = {"snip": SnippetUtil("", (0, 0), (0, 0), None)}
+    state = {"n": 0}
+
+    def setup():
+        state["n"] += 1
+        args = {
+            "owner": 999,
+            "blocks": blocks,
+            "schedule": list(range(size)),
+            "tabstops": {"id": "999-%d" % state["n"], "size": size + 1, "deltas": {"0": "a"}, "reset": True},
+            "templates": templates,
+        }
+        return (json.dumps(args),)
+
+    def run(args):
+        res = ns["eval_blocks"](scope, args)
+        assert res["values"][str(size)] == "a" + "x" * size
+
+    bench(run, setup)
+    ns["codes"].release(999)
+    ns["tabstops"].release(999)
+
+
+def test_eval_blocks_memo(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+    SnippetUtil = runtime["SnippetUtil"]
+    size = 50
+    # block i reads tabstop i + 1, like fields of a class generator
+    blocks = [["memo-%d" % i, "snip.calls.append(%d)\nsnip.rv = 'self.%%s = %%s' %% (t[%d], t[%d])" % (i, i + 1, i + 1),
+               "self.f%d = f%d" % (i + 1, i + 1), [i + 1], True] for i in range(size)]
+    scope = {"snip": SnippetUtil("", (0, 0), (0, 0), None)}
+    scope["snip"].calls = []
+    state = {"n": 0}
+
+    def args(deltas, reset):
+        return json.dumps({
+            "owner": 996,
+            "blocks": blocks,
+            "after": list(range(size)),
+            "tabstops": {"id": "996-%d" % state["n"], "size": size + 1, "deltas": deltas, "reset": reset},
+            "templates": {},
+        })
+
+    def setup():
+        state["n"] += 1
+        ns["eval_blocks"](scope, args(dict((str(i), "f%d" % i) for i in range(size + 1)), True))
+        del scope["snip"].calls[:]
+        # typing in one field
+        return (args({"3": "field"}, False),)
+
+    def run(args):
+        res = ns["eval_blocks"](scope, args)
+        assert res["blocks"] == {"2": "self.field = field"}
+        assert scope["snip"].calls == [2]
+
+    bench(run, setup)
+    ns["codes"].release(996)
+    ns["tabstops"].release(996)
+
+
+def test_column_converter(bench, runtime):
+    ColumnConverter = runtime["coc_ultisnips_dict"]["ColumnConverter"]
+    vim.reset(lines=LINES)
+
+    def run():
+        columns = ColumnConverter()
+        for line in range(1, 101):
+            for col in range(0, 40, 4):
+                columns.byte2col(line, columns.col2byte(line, col))
+
+    result = bench(run)
+    assert result.evals == 1
+
+
+def test_match_regex_triggers(bench, runtime):
+    triggers = runtime["coc_ultisnips_dict"]["triggers"]
+    regexes = json.dumps(["\\b%s(\\d+)" % name for name in ("fn", "cls", "def", "imp")] +
+                         ["(\\w+)\\.%s" % i for i in range(200)])
+    prefix = "    value = obj.%d" % 150
+
+    def run():
+        matches = triggers.match(prefix, regexes)
+        assert [m[0] for m in matches] == [154]
+
+    result = bench(run)
+    assert result.evals == 0
+
+
+def test_eval_contexts(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+    size = 50
+    exprs = ["snip.before.strip().startswith('def') and %d" % i for i in range(size)]
+    exprs += ["snip.after.endswith(':%d')" % i for i in range(size)]
+    state = {"n": 0}
+    scope = {}
+
+    def setup():
+        vim.reset(lines=LINES, cursor=(10, 8))
+        state["n"] += 1
+        candidates = [["998-%d-%d" % (state["n"], i), "ctx-%d" % i, expr, None] for i, expr in enumerate(exprs)]
+        return (json.dumps({"owner": 998, "limit": 200, "candidates": candidates}),)
+
+    def run(args):
+        results = ns["eval_contexts"](scope, args)
+        assert sum(1 for active, _ in results if active) == size - 1
+
+    bench(run, setup)
+    ns["codes"].release(998)
+    ns["contexts"].release(998)
+
+
+def test_watchdog_budget(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+    codes, watchdog = ns["codes"], ns["watchdog"]
+    state = {"n": 0}
+    scope = {}
+
+    def setup():
+        state["n"] += 1
+        return ("loop-%d" % state["n"],)
+
+    def run(code_id):
+        # blocks in budget, then a runaway block aborted and disabled
+        for i in range(50):
+            codes.run("budget-%d" % i, scope, 997, "x = sum(range(%d))" % i)
+        for _ in range(2):
+            try:
+                codes.run(code_id, scope, 997, "try:\n    while True: pass\nexcept Exception: pass")
+            except ns["TimeBudgetExceeded"] as e:
+                assert "exceeded time budget of 5ms" in str(e)
+            else:
+                raise AssertionError("runaway code not aborted")
+        assert code_id in watchdog
+
+    watchdog.budget = 0.005
+    try:
+        bench(run, setup)
+    finally:
+        watchdog.budget = 0
+        codes.release(997)
+    # not watching after the abort, enabled again after evicted
+    assert watchdog._current is None
+    assert "loop-1" not in watchdog
+
+
+def test_expand_anon_batch(bench, runtime):
+    ns = runtime["coc_ultisnips_dict"]
+    codes = ns["codes"]
+    code = "for i in range(20):\n    snip.expand_anon('${1:field_%d} = %d' % (i, i), 'f')"
+    scope = {}
+
+    def setup():
+        vim.reset(lines=["    f"], cursor=(1, 5))
+        scope["snip"] = ns["PostJumpContext"]([0, 4, 0, 5], 1, 1)
+        return ()
+
+    def run():
+        codes.run("anon", scope, 995, code)
+        # one request after the action
+        assert len(vim.stats.requests) == 1 and len(ns["expansions"]) == 0
+        name, method, (action, [items]) = vim.stats.requests[0]
+        assert (name, method, action) == ("coc#util#timer", "coc#rpc#notify", "snippetInsertBatch")
+        assert [item["text"] for item in items][:2] == ["${1:field_0} = 0", "${1:field_1} = 1"]
+
+    bench(run, setup)
+    codes.release(995)
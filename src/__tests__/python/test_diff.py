@@ -0,0 +1,249 @@
+"""
+Hunks of diff() of the runtime compared with the previous implementation,
+kept below as the oracle. Hunks must turn a into b, single insertions and
+deletions must produce the same hunks, and positions tracked over a changed
+line must stay on the same characters, at least as many as the oracle keeps.
+"""
+import random, re, sys, time
+from collections import defaultdict
+
+import vim  # noqa: F401
+
+
+def previous_diff(a, b, sline=0):
+    """
+    Return a list of deletions and insertions that will turn 'a' into 'b'. This
+    is done by traversing an implicit edit graph and searching for the shortest
+    route. The basic idea is as follows:
+
+        - Matching a character is free as long as there was no
+          deletion/insertion before. Then, matching will be seen as delete +
+          insert [1].
+        - Deleting one character has the same cost everywhere. Each additional
+          character costs only have of the first deletion.
+        - Insertion is cheaper the earlier it happens. The first character is
+          more expensive that any later [2].
+
+    [1] This is that world -> aolsa will be "D" world + "I" aolsa instead of
+        "D" w , "D" rld, "I" a, "I" lsa
+    [2] This is that "hello\n\n" -> "hello\n\n\n" will insert a newline after
+        hello and not after \n
+    """
+    d = defaultdict(list)  # pylint:disable=invalid-name
+    seen = defaultdict(lambda: sys.maxsize)
+
+    d[0] = [(0, 0, sline, 0, ())]
+    top = [0]
+    cost = 0
+    deletion_cost = len(a) + len(b)
+    insertion_cost = len(a) + len(b)
+    while True:
+        while len(d[cost]):
+            x, y, line, col, what = d[cost].pop()
+
+            if a[x:] == b[y:]:
+                return what
+
+            if x < len(a) and y < len(b) and a[x] == b[y]:
+                ncol = col + 1
+                nline = line
+                if a[x] == "\n":
+                    ncol = 0
+                    nline += 1
+                lcost = cost + 1
+                if (
+                    what
+                    and what[-1][0] == "D"
+                    and what[-1][1] == line
+                    and what[-1][2] == col
+                    and a[x] != "\n"
+                ):
+                    # Matching directly after a deletion should be as costly as
+                    # DELETE + INSERT + a bit
+                    lcost = (deletion_cost + insertion_cost) * 1.5
+                if seen[x + 1, y + 1] > lcost:
+                    d[lcost].append((x + 1, y + 1, nline, ncol, what))
+                    seen[x + 1, y + 1] = lcost
+            if y < len(b):  # INSERT
+                ncol = col + 1
+                nline = line
+                if b[y] == "\n":
+                    ncol = 0
+                    nline += 1
+                if (
+                    what
+                    and what[-1][0] == "I"
+                    and what[-1][1] == nline
+                    and what[-1][2] + len(what[-1][-1]) == col
+                    and b[y] != "\n"
+                    and seen[x, y + 1] > cost + (insertion_cost + ncol) // 2
+                ):
+                    seen[x, y + 1] = cost + (insertion_cost + ncol) // 2
+                    d[cost + (insertion_cost + ncol) // 2].append(
+                        (
+                            x,
+                            y + 1,
+                            line,
+                            ncol,
+                            what[:-1]
+                            + (("I", what[-1][1], what[-1][2], what[-1][-1] + b[y]),),
+                        )
+                    )
+                elif seen[x, y + 1] > cost + insertion_cost + ncol:
+                    seen[x, y + 1] = cost + insertion_cost + ncol
+                    d[cost + ncol + insertion_cost].append(
+                        (x, y + 1, nline, ncol, what + (("I", line, col, b[y]),))
+                    )
+            if x < len(a):  # DELETE
+                if (
+                    what
+                    and what[-1][0] == "D"
+                    and what[-1][1] == line
+                    and what[-1][2] == col
+                    and a[x] != "\n"
+                    and what[-1][-1] != "\n"
+                    and seen[x + 1, y] > cost + deletion_cost // 2
+                ):
+                    seen[x + 1, y] = cost + deletion_cost // 2
+                    d[cost + deletion_cost // 2].append(
+                        (
+                            x + 1,
+                            y,
+                            line,
+                            col,
+                            what[:-1] + (("D", line, col, what[-1][-1] + a[x]),),
+                        )
+                    )
+                elif seen[x + 1, y] > cost + deletion_cost:
+                    seen[x + 1, y] = cost + deletion_cost
+                    d[cost + deletion_cost].append(
+                        (x + 1, y, line, col, what + (("D", line, col, a[x]),))
+                    )
+        # the routes reaching the end can be dropped, the previous
+        # implementation did not stop then, the oracle returns None
+        if cost >= top[0]:
+            top[0] = max([k for k, v in d.items() if v] or [-1])
+            if top[0] <= cost:
+                return None
+        cost += 1
+
+
+def apply_hunks(text, hunks, sline=0):
+    """Apply hunks of diff() to text starting at line sline."""
+    lines = text.split("\n")
+    for kind, line, col, part in hunks:
+        row = line - sline
+        offset = sum(len(l) + 1 for l in lines[:row]) + col
+        joined = "\n".join(lines)
+        if kind == "D":
+            assert joined[offset : offset + len(part)] == part
+            joined = joined[:offset] + joined[offset + len(part) :]
+        else:
+            joined = joined[:offset] + part + joined[offset:]
+        lines = joined.split("\n")
+    return "\n".join(lines)
+
+
+def random_texts(rnd, count, size, alphabet="ab \n中"):
+    for _ in range(count):
+        yield (
+            "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, size))),
+            "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, size))),
+        )
+
+
+def kept_positions(runtime, a, b, hunks):
+    """Positions of line a kept by PositionTracker over hunks, each has to
+    stay on the same character in b."""
+    Position = runtime["coc_ultisnips_dict"]["Position"]
+    tracker = runtime["coc_ultisnips_dict"]["PositionTracker"]()
+    watched = [tracker.track(Position(1, col)) for col in range(len(a))]
+    tracker.apply_changes(hunks)
+    kept = 0
+    for col, watch in enumerate(watched):
+        if watch.valid and watch.position.col < len(b):
+            assert b[watch.position.col] == a[col], (a, b, hunks)
+            kept += 1
+    return kept
+
+
+def edit_line(rnd, line, count, alphabet="ab_ (中"):
+    b = list(line)
+    for _ in range(count):
+        i = rnd.randint(0, len(b))
+        r = rnd.random()
+        if r < 0.4 and i < len(b):
+            del b[i]
+        elif r < 0.7 and i < len(b):
+            b[i] = rnd.choice(alphabet)
+        else:
+            b.insert(i, rnd.choice(alphabet))
+    return "".join(b)
+
+
+def test_diff_hunks(runtime):
+    diff = runtime["coc_ultisnips_dict"]["diff"]
+    assert diff("b", "  ") == (("D", 0, 0, "b"), ("I", 0, 0, "  "))
+    assert diff("hello world", "hello there") == (("D", 0, 6, "world"), ("I", 0, 6, "there"))
+    assert diff("world", "aolsa") == previous_diff("world", "aolsa")
+    assert diff("hello\n\n", "hello\n\n\n") == (("I", 0, 5, "\n"),)
+    assert diff("abXab", "aab") == (("D", 0, 1, "bX"),)
+    rnd = random.Random(1199)
+    for a, b in random_texts(rnd, 2000, 16):
+        assert apply_hunks(a, diff(a, b, 2), 2) == b, (a, b)
+
+
+def test_diff_single_edits_previous_hunks(runtime):
+    diff = runtime["coc_ultisnips_dict"]["diff"]
+    rnd = random.Random(1)
+    for line in ("    def method(self, value):  # 中文注释", "aaaa  bbbb  aaaa", "a\n\nb\n"):
+        for _ in range(300):
+            i = rnd.randint(0, len(line))
+            if rnd.random() < 0.5:
+                b = line[:i] + "".join(rnd.choice("ab_ (中") for _ in range(rnd.randint(1, 4))) + line[i:]
+            else:
+                b = line[:i] + line[min(len(line), i + rnd.randint(1, 4)):]
+            expected = previous_diff(line, b, 1)
+            if expected is not None:
+                assert diff(line, b, 1) == expected, (line, b)
+
+
+def test_diff_line_kept_positions(runtime):
+    diff = runtime["coc_ultisnips_dict"]["diff"]
+    rnd = random.Random(80)
+    for line, alphabet in (
+        ("    def method(self, value):  # 中文注释", "ab_ (中"),
+        ("foo(bar, baz)", "ab, ()"),
+    ):
+        kept = previous_kept = 0
+        for _ in range(300):
+            b = edit_line(rnd, line, rnd.randint(1, 3), alphabet)
+            expected = previous_diff(line, b, 1)
+            hunks = diff(line, b, 1)
+            assert apply_hunks(line, hunks, 1) == b, b
+            kept += kept_positions(runtime, line, b, hunks)
+            previous_kept += kept_positions(runtime, line, b, expected)
+        assert kept >= previous_kept
+
+
+def test_diff_long_texts(runtime):
+    diff = runtime["coc_ultisnips_dict"]["diff"]
+    rnd = random.Random(5)
+    for a, b in random_texts(rnd, 20, 400):
+        assert apply_hunks(a, diff(a, b)) == b
+    text = "\n".join("    line %d of text" % i for i in range(300))
+    changed = text.replace("line 15 of", "row 15 of").replace("of text", "of texts", 3)
+    hunks = diff(text, changed)
+    assert apply_hunks(text, hunks) == changed
+    assert len(hunks) <= 8
+
+
+def test_diff_edit_limit(runtime):
+    diff = runtime["coc_ultisnips_dict"]["diff"]
+    start = time.perf_counter()
+    hunks = diff("x" * 5000, "y" * 5000)
+    assert time.perf_counter() - start < 2
+    assert hunks == (("D", 0, 0, "x" * 5000), ("I", 0, 0, "y" * 5000))
+    a = "\n".join("abc" * 10 for _ in range(400))
+    b = "\n".join("xyz" * 10 for _ in range(400))
+    assert apply_hunks(a, diff(a, b)) == b
@@ -0,0 +1,227 @@
+"""
+Stand-in of the vim module to run the UltiSnips runtime without an editor.
+
+Buffer, cursor, variables and values of expressions are kept in memory and
+changed by reset(). Values are returned like vim.eval() of vim, numbers as
+strings, list and dict literals of known expressions are evaluated by item.
+Calls of eval() are counted by expression in `stats`, each call
+sleeps `latency` seconds to simulate the cost of a round trip to the editor.
+Reads of the buffer, which are round trips with neovim, are counted as
+`stats.reads`. Requests and notifications to coc made by call() are kept in
+`stats.requests` as tuples of function name and arguments.
+"""
+import re, time
+from collections import Counter
+
+
+class error(Exception):
+    pass
+
+
+class Buffer(list):
+    """Lines of the buffer, changedtick is increased on change."""
+
+    def __init__(self, lines=(), number=1):
+        super().__init__(lines)
+        self.number = number
+        self.changedtick = 1
+
+    def __getitem__(self, key):
+        stats.reads += 1
+        return super().__getitem__(key)
+
+    def __len__(self):
+        stats.reads += 1
+        return super().__len__()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.changedtick += 1
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changedtick += 1
+
+    def append(self, lines, nr=None):
+        if isinstance(lines, str):
+            lines = [lines]
+        if nr is None:
+            nr = len(self)
+        self[nr:nr] = lines
+
+
+class Window(object):
+    def __init__(self, buffer, cursor):
+        self.buffer = buffer
+        self.cursor = tuple(cursor)
+
+
+class Current(object):
+    def __init__(self, buffer, cursor):
+        self.buffer = buffer
+        self.window = Window(buffer, cursor)
+
+
+class Stats(object):
+    def __init__(self):
+        self.evals = Counter()
+        self.commands = []
+        self.requests = []
+        self.reads = 0
+
+    @property
+    def eval_count(self):
+        return sum(self.evals.values())
+
+    def clear(self):
+        self.evals.clear()
+        del self.commands[:]
+        del self.requests[:]
+        self.reads = 0
+
+
+DEFAULT_EXPRS = {
+    "coc#util#get_fullpath()": "",
+    "&encoding": "utf-8",
+    "&filetype": "",
+    "&selection": "inclusive",
+    "&expandtab": "1",
+    "&tabstop": "8",
+    "exists('*shiftwidth') ? shiftwidth() : &shiftwidth": "4",
+    "visualmode()": "",
+    """line("'<")""": "0",
+    """col("'<")""": "0",
+    """line("'>")""": "0",
+    """col("'>")""": "0",
+    'expand("%:t")': "",
+    'expand("%:t:r")': "",
+}
+
+_exists_re = re.compile(r"^exists\('(.+)'\)$")
+_key_re = re.compile(r"^'(\w+)':\s*(.*)$", re.S)
+_rpc_functions = frozenset(["coc#rpc#request", "coc#rpc#notify", "coc#util#timer"])
+
+stats = Stats()
+latency = 0.0
+vars = {}
+current = Current(Buffer(), (1, 0))
+_exprs = dict(DEFAULT_EXPRS)
+# called by new_cycle(), to clear editor state cached by the runtime
+cycle_hooks = []
+
+
+def reset(lines=("",), cursor=(1, 0), exprs=None, variables=None, delay=0.0):
+    """Replace the editor state and clear stats."""
+    global current, vars, latency, _exprs
+    current = Current(Buffer(lines), cursor)
+    vars = dict(variables or {})
+    latency = delay
+    _exprs = dict(DEFAULT_EXPRS)
+    _exprs.update(exprs or {})
+    stats.clear()
+    new_cycle()
+
+
+def new_cycle():
+    """Start new evaluation cycle of the runtime, like python code executed
+    by coc."""
+    for hook in cycle_hooks:
+        hook()
+
+
+def set_visual(mode, start, end):
+    """Set visualmode() and the '< '> marks, start and end are 1 based
+    (line, col) like line() and col()."""
+    _exprs.update({
+        "visualmode()": mode,
+        """line("'<")""": str(start[0]),
+        """col("'<")""": str(start[1]),
+        """line("'>")""": str(end[0]),
+        """col("'>")""": str(end[1]),
+    })
+
+
+def _to_vim(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, list):
+        return [_to_vim(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _to_vim(v)) for k, v in value.items())
+    return value
+
+
+_items = {}
+
+
+def _split(expr):
+    """Split items of list or dict literal by top level commas."""
+    if expr in _items:
+        return _items[expr]
+    items, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(expr):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in "'\"":
+            quote = c
+        elif c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        elif c == "," and depth == 0:
+            items.append(expr[start:i].strip())
+            start = i + 1
+    items.append(expr[start:].strip())
+    items = _items[expr] = [item for item in items if item]
+    return items
+
+
+def _eval(expr):
+    if expr in _exprs:
+        return _exprs[expr]
+    if expr.startswith("[") and expr.endswith("]"):
+        return [_eval(item) for item in _split(expr[1:-1])]
+    if expr.startswith("{") and expr.endswith("}"):
+        items = [_key_re.match(item).groups() for item in _split(expr[1:-1])]
+        return dict((key, _eval(value)) for key, value in items)
+    if expr == "b:changedtick":
+        return current.buffer.changedtick
+    if expr == "bufnr('%')":
+        return current.buffer.number
+    if expr == "coc#cursor#position()":
+        return [current.window.cursor[0] - 1, current.window.cursor[1]]
+    if expr == "line('.')":
+        return current.window.cursor[0]
+    if expr == "col('.') - 1":
+        return current.window.cursor[1]
+    if expr == 'get(g:,"coc_selected_text","")':
+        return vars.get("coc_selected_text", "")
+    if expr == 'get(g:,"coc_last_placeholder",v:null)':
+        return vars.get("coc_last_placeholder")
+    m = _exists_re.match(expr)
+    if m:
+        return m.group(1) in _exprs
+    raise error("Unknown expression: %s" % expr)
+
+
+def eval(expr):
+    stats.evals[expr] += 1
+    if latency:
+        time.sleep(latency)
+    return _to_vim(_eval(expr))
+
+
+def call(name, *args):
+    if latency:
+        time.sleep(latency)
+    if name in _rpc_functions:
+        stats.requests.append((name,) + args)
+        return None
+    raise error("Unknown function: %s" % name)
+
+
+def command(cmd):
+    stats.commands.append(cmd)
@@ -8,6 +8,7 @@ import events from '../../events'
 import languages from '../../languages'
 import Document from '../../model/document'
 import { CompletionItemProvider } from '../../provider'
+import { executePythonCode } from '../../snippets/eval'
 import snippetManager, { SnippetManager } from '../../snippets/manager'
 import { SnippetEdit } from '../../snippets/session'
 import { SnippetString } from '../../snippets/string'
@@ -21,7 +22,7 @@ let doc: Document
 let disposables: Disposable[] = []
 before(async () => {
   nvim = workspace.nvim
-  let pyfile = path.join(import.meta.dirname, '../ultisnips.py')
+  let pyfile = path.join(import.meta.dirname, '../../../bin/ultisnips.py')
   await nvim.command(`execute 'pyxfile '.fnameescape('${pyfile}')`)
 })
 
@@ -137,6 +138,46 @@ describe('snippet provider', () => {
       assert.strictEqual(res, true)
     })
 
+    it('should insert anonymous snippets by action', async t => {
+      await nvim.input('i')
+      let res = await getCurrentPlugin().cocAction('snippetInsertBatch', [
+        { range: Range.create(0, 0, 0, 0), text: '${1:foo} ' },
+        { range: Range.create(0, 0, 0, 0), text: '${1:bar}' }
+      ])
+      assert.strictEqual(res, true)
+      let line = await nvim.line
+      assert.strictEqual(line, 'foo bar')
+      assert.strictEqual(snippetManager.session.placeholder.value, 'bar')
+    })
+
+    it('should insert nested anonymous snippets by one edit', async t => {
+      await nvim.input('i')
+      let doc = await workspace.document
+      let spy = t.mock.method(doc, 'applyEdits')
+      let res = await snippetManager.insertAnonymousSnippets([
+        { range: Range.create(0, 0, 0, 0), text: 'x $1' },
+        { range: Range.create(0, 0, 0, 0), text: '${1:bar}($2)' }
+      ])
+      assert.strictEqual(res, true)
+      assert.strictEqual(spy.mock.calls.length, 1)
+      let line = await nvim.line
+      assert.strictEqual(line, 'x bar()')
+      assert.strictEqual(snippetManager.session.placeholder.value, 'bar')
+    })
+
+    it('should shift ranges of chained anonymous expansions', async t => {
+      await nvim.setLine('a b')
+      await nvim.input('A')
+      await executePythonCode(nvim, [
+        'snip = coc_ultisnips_dict["PostExpandContext"]([0, 0, 0, 3])',
+        'with coc_ultisnips_dict["expansions"].batch():',
+        '    snip.expand_anon("${1:foo}(", "b")',
+        '    snip.expand_anon("${1:bar})", "b")',
+      ])
+      await shared.waitValue(() => nvim.line, 'a foo(bar)')
+      assert.strictEqual(snippetManager.session.placeholder.value, 'bar')
+    })
+
     it('should start new session if session exists', async t => {
       await nvim.setLine('bar')
       await snippetManager.insertSnippet('${1:foo} ')
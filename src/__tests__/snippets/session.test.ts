@@ -12,7 +12,7 @@ let nvim: Neovim
 let disposables: Disposable[] = []
 before(async () => {
   nvim = workspace.nvim
-  let pyfile = path.join(import.meta.dirname, '../ultisnips.py')
+  let pyfile = path.join(import.meta.dirname, '../../../bin/ultisnips.py')
   await nvim.command(`execute 'pyxfile '.fnameescape('${pyfile}')`)
 })
 
@@ -22,7 +22,7 @@ afterEach(async () => {
 
 async function createSession(enableHighlight = false, preferComplete = false, nextOnDelete = false): Promise<SnippetSession> {
   let doc = await workspace.document
-  let config: SnippetConfig = { highlight: enableHighlight, preferComplete, nextOnDelete }
+  let config: SnippetConfig = { highlight: enableHighlight, preferComplete, nextOnDelete, contextLimit: 20, updateDelay: 0 }
   let session = new SnippetSession(nvim, doc, config)
   disposables.push(session)
   disposables.push(workspace.onDidChangeTextDocument(e => {
@@ -44,7 +44,7 @@ describe('SnippetSession', () => {
   async function start(inserted: string, range = defaultRange, select = true, context?: UltiSnippetContext): Promise<boolean> {
     await nvim.input('i')
     let doc = await workspace.document
-    let session = new SnippetSession(nvim, doc, { highlight: false, nextOnDelete: false, preferComplete: false })
+    let session = new SnippetSession(nvim, doc, { highlight: false, nextOnDelete: false, preferComplete: false, contextLimit: 20, updateDelay: 0 })
     return await session.start(inserted, range, select, context)
   }
 
@@ -398,7 +398,7 @@ describe('SnippetSession', () => {
     it('should not nest when stale session range contains new snippet', async t => {
       await nvim.command('startinsert')
       let doc = await workspace.document
-      let session = new SnippetSession(nvim, doc, { highlight: false, nextOnDelete: false, preferComplete: false })
+      let session = new SnippetSession(nvim, doc, { highlight: false, nextOnDelete: false, preferComplete: false, contextLimit: 20, updateDelay: 0 })
       disposables.push(session)
       await session.start('if let ${1} = ${2:Some(()).and(optb)} {$0', defaultRange, false)
 
@@ -711,6 +711,48 @@ describe('SnippetSession', () => {
       session.deactivate()
     })
 
+    it('should merge changes made during python evaluation', async t => {
+      let session = await createSession()
+      await nvim.input('i')
+      await session.start('${1} `!p import time; time.sleep(0.05); snip.rv = t[1]`', defaultRange, false, defaultContext)
+      let spy = t.mock.method(session, '_synchronize')
+      let fn = nvim.command
+      let count = 0
+      nvim.command = (...args: any) => {
+        if (/^pyx /.test(args[0])) count++
+        return fn.apply(nvim, args)
+      }
+      try {
+        for (let i = 1; i <= 10; i++) {
+          await nvim.setLine('x'.repeat(i) + ' ')
+        }
+        await shared.waitValue(() => nvim.line, 'xxxxxxxxxx xxxxxxxxxx')
+        await session.forceSynchronize()
+        assert.ok(spy.mock.callCount() <= 4, `synchronized ${spy.mock.callCount()} times`)
+        assert.ok(count <= 4, `python evaluated ${count} times`)
+      } finally {
+        nvim.command = fn
+      }
+    })
+
+    it('should delay synchronize of python snippet', async t => {
+      let doc = await workspace.document
+      let session = new SnippetSession(nvim, doc, { highlight: false, nextOnDelete: false, preferComplete: false, contextLimit: 20, updateDelay: 50 })
+      disposables.push(session)
+      await nvim.input('i')
+      await session.start('${1} `!p snip.rv = t[1]`', defaultRange, false, defaultContext)
+      let spy = t.mock.method(session, '_synchronize')
+      let promises: Promise<void>[] = []
+      for (let i = 1; i <= 5; i++) {
+        await nvim.setLine('x'.repeat(i) + ' ')
+        await doc.synchronize()
+        promises.push(session.synchronize({ version: doc.version, change: { range: Range.create(0, 0, 0, 0), text: 'x' } }))
+      }
+      await Promise.all(promises)
+      assert.strictEqual(spy.mock.callCount(), 1)
+      assert.strictEqual(await nvim.line, 'xxxxx xxxxx')
+    })
+
     it('should cancel change synchronize', async t => {
       let doc = await workspace.document
       let session = await createSession()
@@ -1,12 +1,16 @@
 import * as shared from '../sharedUtil'
 import { Neovim } from '@chemzqm/neovim'
+import fs from 'fs'
+import os from 'os'
 import path from 'path'
 import { CancellationToken, CancellationTokenSource } from 'vscode-languageserver-protocol'
 import { Position, Range } from 'vscode-languageserver-types'
 import { URI } from 'vscode-uri'
 import events from '../../events'
-import { addPythonTryCatch, executePythonCode, generateContextId, getInitialPythonCode, getVariablesCode, hasPython } from '../../snippets/eval'
+import { addPythonTryCatch, escapeString, evalPythonContexts, evalPythonExpr, evalVimExprs, executePythonBlock, executePythonCode, generateContextId, getCodeId, getInitialPythonCode, getPythonProfile, getResetPythonCode, getTabstopsCode, hasPython, isWorkerContext, matchPythonTriggers, releasePythonCodes, setPythonProfiling, setPythonTimeBudget, setPythonWorker, TabstopChanges } from '../../snippets/eval'
+import { formatProfile } from '../../snippets/manager'
 import { CodeBlock, Placeholder, SnippetParser, Text, TextmateSnippet } from '../../snippets/parser'
+import { disposeShell, evalShellCommand, setShellOptions, ShellProcess } from '../../snippets/shell'
 import { CocSnippet, getNextPlaceholder, getUltiSnipActionCodes } from '../../snippets/snippet'
 import { SnippetString } from '../../snippets/string'
 import { convertRegex, getTextAfter, getTextBefore, normalizeSnippetString, shouldFormat, toSnippetString, UltiSnippetContext } from '../../snippets/util'
@@ -18,7 +22,7 @@ import workspace from '../../workspace'
 let nvim: Neovim
 before(async () => {
   nvim = workspace.nvim
-  let pyfile = path.join(import.meta.dirname, '../ultisnips.py')
+  let pyfile = path.join(import.meta.dirname, '../../../bin/ultisnips.py')
   await nvim.command(`execute 'pyxfile '.fnameescape('${pyfile}')`)
 })
 
@@ -180,9 +184,9 @@ describe('CocSnippet', () => {
       assert.strictEqual(padZero(10), '10')
     })
 
-    it('should getVariablesCode', t => {
-      assert.strictEqual(getVariablesCode({}), 't = ()')
-      assert.strictEqual(getVariablesCode({ 1: 'foo', 3: 'bar' }), 't = ("","foo","","bar",)')
+    it('should getTabstopsCode', t => {
+      let code = getTabstopsCode({ id: '1-1', size: 2, deltas: { 1: 'a"b' }, reset: false })
+      assert.strictEqual(code, 'coc_ultisnips_dict["tabstops"].sync("{\\"id\\":\\"1-1\\",\\"size\\":2,\\"deltas\\":{\\"1\\":\\"a\\\\\\"b\\"},\\"reset\\":false}", globals())')
     })
 
     it('should resolve uppercase variables', async t => {
@@ -494,6 +498,25 @@ describe('CocSnippet', () => {
       await assertResult('${1:`!v indent(".")`} "$1"', '2 "2"', {})
     })
 
+    it('should eval vim blocks in one request', async () => {
+      let fn = nvim.callAtomic
+      let count = 0
+      nvim.callAtomic = (...args: any) => {
+        count++
+        return fn.apply(nvim, args)
+      }
+      try {
+        await assertResult('`!v "a"` ${1:`!v 1 + 1`} `!v v:null`', 'a 2 ', {})
+        assert.strictEqual(count, 1)
+      } finally {
+        nvim.callAtomic = fn
+      }
+      let res = await evalVimExprs(nvim, ['"a"', 'undefined_var', '1', 'undefined_fn()', '[1][0]'])
+      assert.deepStrictEqual(res.map(o => o[0]), ['a', '', '1', '', '1'])
+      assert.deepStrictEqual(res.map(o => o[1] == null), [true, false, true, false, true])
+      await assert.rejects(createSnippet('`!v "a"` `!v undefined_var`', {}), /Error on eval vim block `!v undefined_var`/)
+    })
+
     it('should init code block in placeholders', async t => {
       await assertResult('f ${1:`echo "b"`}', 'f b', {})
       await assertResult('f ${1:`!v "b"`}', 'f b', {})
@@ -552,6 +575,24 @@ describe('CocSnippet', () => {
       await assertPyxValue('ft', 'txt')
     })
 
+    it('should append lines to snip.rv', async () => {
+      await nvim.command('setl shiftwidth=2 expandtab')
+      await executePythonCode(nvim, [
+        'snip = SnippetUtil("  ", (0, 2), (0, 2), None)',
+        'first = snip.mkline("a")',
+        'snip.rv = "{"',
+        'snip.shift()',
+        'for i in range(3): snip += str(i)',
+        'snip.unshift()',
+        'snip += "}"',
+      ])
+      await assertPyxValue('first', 'a')
+      await assertPyxValue('snip.rv', '{\n    0\n    1\n    2\n  }')
+      await assertPyxValue('snip._rv_changed', true)
+      await executePythonCode(nvim, ['snip.rv = 1', 'snip._reset("")', 'snip += "x"'])
+      await assertPyxValue('snip.rv', '\n  x')
+    })
+
     it('should init python code block', async t => {
       await assertResult('`!p snip.rv = "a"` = a', 'a = a', {})
       await assertResult('`!p snip.rv = t[1]` = ${1:a}', 'a = a', {})
@@ -578,6 +619,24 @@ describe('CocSnippet', () => {
     it('should update python block from placeholder', async t => {
       await assertResult('`!p snip.rv = t[1][0] if len(t[1]) > 0 else ""` ${1:`!p snip.rv = t[2]`} ${2:foo}', 'f foo foo', {})
     })
+
+    it('should evaluate python blocks in one call', async t => {
+      let fn = nvim.command
+      let count = 0
+      nvim.command = (...args: any) => {
+        if (/^pyx /.test(args[0])) count++
+        return fn.apply(nvim, args)
+      }
+      try {
+        let body = Array.from({ length: 20 }, (_, i) => `\${${i + 1}:\`!p snip.rv = "${i}" + t[${i + 2}]\`}`).join(' ')
+        let snip = await createSnippet(body + ' ${21:x}', {})
+        // initial code and python blocks
+        assert.strictEqual(count, 2)
+        assert.ok(snip.text.startsWith('012345678910111213141516171819x 12345678910111213141516171819x'))
+      } finally {
+        nvim.command = fn
+      }
+    })
   })
 
   describe('updatePlaceholder()', () => {
@@ -587,7 +646,7 @@ describe('CocSnippet', () => {
       assert.strictEqual(p != null, true)
       p.marker.setOnlyChild(new Text(value))
       await c.tmSnippet.update(nvim, p.marker, CancellationToken.None)
-      assert.strictEqual(c.tmSnippet.toString(), result)
+      if (result !== undefined) assert.strictEqual(c.tmSnippet.toString(), result)
       return c
     }
 
@@ -645,6 +704,67 @@ describe('CocSnippet', () => {
       await assertUpdate('${2:foo `!p snip.rv = t[1]`} ${1:`!p snip.rv = "foo"`}', 'bar', 'foo bar bar')
     })
 
+    it('should update chain of python placeholders in one call', async t => {
+      let body = [1, 2, 3, 4, 5].map(i => `\${${i}:\`!p snip.rv = t[${i + 1}] + "${i}"\`}`).join(' ')
+      let c = await createSnippet(body + ' ${6:a}', {})
+      assert.strictEqual(c.tmSnippet.toString(), 'a54321 a5432 a543 a54 a5 a')
+      let fn = nvim.command
+      let count = 0
+      nvim.command = (...args: any) => {
+        if (/^pyx /.test(args[0])) count++
+        return fn.apply(nvim, args)
+      }
+      try {
+        let p = c.getPlaceholderByIndex(6)
+        p.marker.setOnlyChild(new Text('b'))
+        await c.tmSnippet.update(nvim, p.marker, CancellationToken.None)
+        assert.strictEqual(c.tmSnippet.toString(), 'b54321 b5432 b543 b54 b5 b')
+        assert.strictEqual(count, 1)
+      } finally {
+        nvim.command = fn
+      }
+    })
+
+    it('should not execute python blocks with unchanged related values', async t => {
+      // snip is created for each update, executed blocks are recorded by it
+      const record = (n: number) => `try:\n    snip.calls += [${n}]\nexcept AttributeError:\n    snip.calls = [${n}]\n`
+      let body = '${1:a} ${2:b} `!p ' + record(1) + 'snip.rv = t[1]` `!p ' + record(2) + 'snip.rv = t[2]` `!p # impure\n' + record(3) + 'snip.rv = t[2]`'
+      let c = await createSnippet(body, {})
+      assert.strictEqual(c.tmSnippet.toString(), 'a b a b b')
+      let p = c.getPlaceholderByIndex(1)
+      p.marker.setOnlyChild(new Text('x'))
+      await c.tmSnippet.update(nvim, p.marker, CancellationToken.None)
+      assert.strictEqual(c.tmSnippet.toString(), 'x b x b b')
+      await assertPyxValue('snip.calls', [1, 3])
+    })
+
+    it('should execute python blocks which reach attributes of snip by name', async t => {
+      let c = await createSnippet('${1:a} ${2:b} `!p snip.calls = [0]\nsnip.rv = getattr(snip, "basename") + t[2]` `!p snip.calls.append(1)\nsnip.rv = type(snip).__name__ + t[2]`', {})
+      let p = c.getPlaceholderByIndex(1)
+      p.marker.setOnlyChild(new Text('x'))
+      await c.tmSnippet.update(nvim, p.marker, CancellationToken.None)
+      await assertPyxValue('snip.calls', [0, 1])
+    })
+
+    it('should execute python blocks which use helpers of global', async t => {
+      await executePythonCode(nvim, ['memo_calls = []', 'def memo_helper(value):', '    memo_calls.append(value)', '    return value'])
+      let c = await createSnippet('${1:a} ${2:b} `!p snip.rv = memo_helper(t[2])`', {})
+      assert.strictEqual(c.tmSnippet.toString(), 'a b b')
+      let p = c.getPlaceholderByIndex(1)
+      p.marker.setOnlyChild(new Text('x'))
+      await c.tmSnippet.update(nvim, p.marker, CancellationToken.None)
+      assert.strictEqual(c.tmSnippet.toString(), 'x b b')
+      await assertPyxValue('memo_calls', ['b', 'b'])
+    })
+
+    it('should update cyclic python placeholders until stable', async t => {
+      let c = await createSnippet('${1:`!p snip.rv = t[2][:3]`} ${2:`!p snip.rv = t[1] + t[3]`} ${3:a}', {})
+      assert.strictEqual(c.tmSnippet.toString(), 'aaa aaaa a')
+      // not stable, stopped by limit
+      c = await assertUpdate('${1:`!p snip.rv = t[2]`} ${2:`!p snip.rv = t[1] + t[3]`} ${3:a}', 'b', undefined, 3)
+      assert.match(c.tmSnippet.toString(), /^a+b+ a+b+ b$/)
+    })
+
     it('should update python code blocks with normal placeholder values', async t => {
       await assertUpdate('`!p snip.rv = t[1]` $1 `!p snip.rv = t[1]`', 'bar', 'bar bar bar')
       await assertUpdate('`!p snip.rv = t[2]` ${2:foo $1}', 'bar', 'foo bar foo bar')
@@ -929,3 +1049,708 @@ describe('CocSnippet', () => {
     })
   })
 })
+
+describe('shell blocks', () => {
+  afterEach(() => {
+    setShellOptions({ cacheTTL: 0, persistent: false })
+    disposeShell()
+  })
+
+  it('should run commands by one shell process', async () => {
+    let cwd = import.meta.dirname
+    let proc = new ShellProcess('/bin/sh')
+    try {
+      assert.strictEqual(await proc.run('echo "a b"', cwd), 'a b\n')
+      assert.strictEqual(await proc.run('printf 中文', cwd), '中文')
+      assert.strictEqual(await proc.run('cd /; pwd', cwd), '/\n')
+      assert.strictEqual(await proc.run('pwd', cwd), `${cwd}\n`)
+      assert.strictEqual(await proc.run(`echo 'q'"'"`, cwd), `q'\n`)
+      await assert.rejects(proc.run('echo "unterminated', cwd), /Command failed/)
+      await assert.rejects(proc.run('exit 3', cwd), /Command failed: exit 3/)
+      let res = await Promise.all([proc.run('echo 1', cwd), proc.run('echo 2', cwd)])
+      assert.deepStrictEqual(res, ['1\n', '2\n'])
+      assert.strictEqual(proc.running, true)
+    } finally {
+      proc.dispose()
+    }
+    assert.strictEqual(proc.running, false)
+  })
+
+  it('should kill shell process of command over timeout', async () => {
+    let cwd = import.meta.dirname
+    let proc = new ShellProcess('/bin/sh', 100)
+    try {
+      await assert.rejects(proc.run('sleep 3', cwd), /Command timed out after 100ms: sleep 3/)
+      assert.strictEqual(proc.running, false)
+      // started again for the next command
+      assert.strictEqual(await proc.run('echo 1', cwd), '1\n')
+      assert.strictEqual(proc.running, true)
+    } finally {
+      proc.dispose()
+    }
+  })
+
+  it('should cache output of commands by ttl', async () => {
+    let file = path.join(os.tmpdir(), `coc-shell-${process.pid}`)
+    let command = `echo x >> ${file}; wc -l < ${file}`
+    setShellOptions({ cacheTTL: 200, persistent: true })
+    let res = await Promise.all([evalShellCommand(command), evalShellCommand(command)])
+    assert.deepStrictEqual(res.map(s => s.trim()), ['1', '1'])
+    assert.strictEqual((await evalShellCommand(command)).trim(), '1')
+    assert.strictEqual((await evalShellCommand(command, os.tmpdir())).trim(), '2')
+    await shared.wait(250)
+    assert.strictEqual((await evalShellCommand(command)).trim(), '3')
+    fs.unlinkSync(file)
+  })
+})
+
+describe('ultisnips runtime', () => {
+  type Hunk = [string, number, number, string]
+
+  async function pyDiff(a: string, b: string): Promise<Hunk[]> {
+    return await nvim.call('pyxeval', `coc_ultisnips_dict["diff"]("${escapeString(a)}", "${escapeString(b)}")`) as Hunk[]
+  }
+
+  function applyHunks(text: string, hunks: Hunk[]): string {
+    for (let [kind, line, col, value] of hunks) {
+      let lines = text.split('\n')
+      let offset = lines.slice(0, line).reduce((p, s) => p + s.length + 1, 0) + col
+      if (kind == 'D') {
+        assert.strictEqual(text.slice(offset, offset + value.length), value)
+        text = text.slice(0, offset) + text.slice(offset + value.length)
+      } else {
+        text = text.slice(0, offset) + value + text.slice(offset)
+      }
+    }
+    return text
+  }
+
+  describe('ColumnConverter', () => {
+    async function convert(line: string, method: 'byte2col' | 'col2byte', values: number[]): Promise<number[]> {
+      await nvim.setLine(line)
+      return await nvim.call('pyxeval', `[c.${method}(vim.current.window.cursor[0], n) for c in [coc_ultisnips_dict["ColumnConverter"]()] for n in ${JSON.stringify(values)}]`) as number[]
+    }
+
+    it('should convert ascii line', async () => {
+      assert.deepStrictEqual(await convert('abc', 'byte2col', [0, 1, 3, 5]), [0, 1, 3, 3])
+      assert.deepStrictEqual(await convert('abc', 'col2byte', [0, 2, 3, 4, 5, 6]), [0, 2, 3, 4, 5, 5])
+    })
+
+    it('should convert multibyte and wide characters', async () => {
+      // byte offsets: a 0, é 1, 中 3, 👍 6, end 10
+      let line = 'aé中👍'
+      assert.deepStrictEqual(await convert(line, 'byte2col', [0, 1, 2, 3, 4, 5, 6, 7, 10, 11]), [0, 1, 2, 2, 3, 3, 3, 4, 4, 4])
+      assert.deepStrictEqual(await convert(line, 'col2byte', [0, 1, 2, 3, 4, 5]), [0, 1, 3, 6, 10, 11])
+    })
+
+    it('should convert combining characters', async () => {
+      let line = 'e\u0301x'
+      assert.deepStrictEqual(await convert(line, 'byte2col', [1, 2, 3, 4]), [1, 2, 2, 3])
+      assert.deepStrictEqual(await convert(line, 'col2byte', [1, 2, 3]), [1, 3, 4])
+    })
+
+    it('should reuse the offset table of line', async () => {
+      await nvim.setLine('aé中')
+      await executePythonCode(nvim, [
+        'columns = coc_ultisnips_dict["ColumnConverter"]()',
+        'lnum = vim.current.window.cursor[0]',
+        'columns.byte2col(lnum, 0)',
+        'vim.current.buffer[lnum - 1] = "abc"',
+        'res = [columns.byte2col(lnum, n) for n in range(7)] + [columns.col2byte(lnum, n) for n in range(4)]',
+      ])
+      let res = await nvim.call('pyxeval', 'res')
+      assert.deepStrictEqual(res, [0, 1, 2, 2, 3, 3, 3, 0, 1, 3, 6])
+    })
+  })
+
+  describe('BufferLines', () => {
+    it('should read lines from snapshot until changedtick changed', async () => {
+      let buf = await nvim.buffer
+      await buf.setLines(['a', 'b', 'c'], { start: 0, end: -1 })
+      await executePythonCode(nvim, [
+        'lines = coc_ultisnips_dict["BufferLines"](vim.current.buffer)',
+        'lines[1] = "x"',
+        'res = [len(lines), lines[-1], lines[0:2]]',
+        'vim.command("call setline(1, \'y\')")',
+        'res.append(lines[0])',
+        'lines.validate()',
+        'res.append(list(lines))',
+      ])
+      let res = await nvim.call('pyxeval', 'res')
+      assert.deepStrictEqual(res, [3, 'c', ['a', 'x'], 'a', ['y', 'x', 'c']])
+      assert.deepStrictEqual(await buf.lines, ['y', 'x', 'c'])
+    })
+
+    it('should send writes of snip.buffer batch together', async () => {
+      let buf = await nvim.buffer
+      await buf.setLines(['a', 'b', 'c'], { start: 0, end: -1 })
+      await executePythonCode(nvim, [
+        'snip = coc_ultisnips_dict["PostExpandContext"]([2, 0, 2, 1])',
+        'tick = int(vim.eval("b:changedtick"))',
+        'with snip.buffer.batch():',
+        '    for i in range(5): snip.buffer.append("x%d" % i, 1 + i)',
+        '    snip.buffer[0] = "A"',
+        '    res = [int(vim.eval("b:changedtick")) > tick, vim.eval("getline(2)")]',
+        '    snip.buffer[-1] = "C"',
+        'res.extend([snip.snippet_start.line, snip.buffer.is_buffer_changed_outside()])',
+      ])
+      let res = await nvim.call('pyxeval', 'res')
+      assert.deepStrictEqual(res, [true, 'x0', 7, false])
+      assert.deepStrictEqual(await buf.lines, ['A', 'x0', 'x1', 'x2', 'x3', 'x4', 'b', 'C'])
+    })
+  })
+
+  describe('PositionTracker', () => {
+    it('should shift and invalidate positions by changes', async () => {
+      await executePythonCode(nvim, [
+        'Position = coc_ultisnips_dict["Position"]',
+        'tracker = coc_ultisnips_dict["PositionTracker"]()',
+        'wrappers = [tracker.track(Position(l, c)) for l, c in [(3, 4), (1, 2), (1, 6), (5, 0), (1, 0)]]',
+        // delete 'bc' at col 2 of line 1, positions of line 1 before col 4 are invalid
+        'tracker.apply_changes([("D", 1, 2, "bc"), ("I", 1, 4, "xyz")])',
+        // replace lines 2 to 3 by 4 lines
+        'tracker.replace_lines(2, 4, 4)',
+        'res = [[w.valid, w.position.line, w.position.col] for w in wrappers] + [len(tracker)]',
+      ])
+      let res = await nvim.call('pyxeval', 'res')
+      assert.deepStrictEqual(res, [[false, 3, 4], [false, 1, 2], [true, 1, 7], [true, 7, 0], [false, 1, 0], 2])
+    })
+
+    it('should invalidate position at column of deletion', async () => {
+      await executePythonCode(nvim, [
+        'Position = coc_ultisnips_dict["Position"]',
+        'tracker = coc_ultisnips_dict["PositionTracker"]()',
+        'wrappers = [tracker.track(Position(0, c)) for c in (0, 4, 5, 7)]',
+        'tracker.apply_changes(coc_ultisnips_dict["diff"]("foo bar", "foo ar"))',
+        'res = [[w.valid, w.position.col] for w in wrappers]',
+      ])
+      let res = await nvim.call('pyxeval', 'res')
+      assert.deepStrictEqual(res, [[false, 0], [false, 4], [true, 4], [true, 6]])
+    })
+
+    it('should track positions of single character deletion', async () => {
+      await executePythonCode(nvim, [
+        'Position = coc_ultisnips_dict["Position"]',
+        'tracker = coc_ultisnips_dict["PositionTracker"]()',
+        'wrappers = [tracker.track(Position(0, c)) for c in (1, 2)] + [tracker.track(Position(1, 1))]',
+        'tracker.apply_changes(coc_ultisnips_dict["diff"]("ab", "b"))',
+        'tracker.apply_changes(coc_ultisnips_dict["diff"]("abc", "ac", 1))',
+        'res = [[w.valid, w.position.col] for w in wrappers]',
+      ])
+      let res = await nvim.call('pyxeval', 'res')
+      assert.deepStrictEqual(res, [[true, 0], [true, 1], [false, 1]])
+    })
+
+    it('should track positions of snip.buffer edits', async () => {
+      await nvim.setLine('foo bar')
+      await executePythonCode(nvim, [
+        'snip = coc_ultisnips_dict["PostExpandContext"]([0, 4, 0, 7])',
+        'snip.buffer[0] = "foo baz bar"',
+        'snip.buffer[0:0] = ["a", "b"]',
+        'del snip.buffer[0]',
+        'res = [snip.snippet_start.line, snip.snippet_start.col, snip.snippet_end.col]',
+      ])
+      let res = await nvim.call('pyxeval', 'res')
+      assert.deepStrictEqual(res, [1, 8, 11])
+    })
+  })
+
+  describe('CodeRegistry', () => {
+    it('should compile code once and run by id', async () => {
+      await executePythonCode(nvim, [
+        'registry = coc_ultisnips_dict["codes"].__class__()',
+        'registry.run("a", globals(), 1, "x = 1")',
+        'code = registry.get("a", "invalid code", 2)',
+        'registry.run("a", globals(), 2)',
+        'res = [x, len(registry), "a" in registry]',
+      ])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'res'), [1, 1, true])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'registry.release(1)'), [])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'registry.release(2)'), ['a'])
+      assert.strictEqual(await nvim.call('pyxeval', 'len(registry)'), 0)
+    })
+
+    it('should throw for unknown code', async () => {
+      let fn = async () => {
+        await executePythonCode(nvim, ['coc_ultisnips_dict["codes"].run("unknown", globals())'])
+      }
+      await assert.rejects(fn(), /Unknown code/)
+    })
+
+    it('should execute python block by id', async () => {
+      let code = 'block_value = snip_value + 1'
+      let id = getCodeId(code)
+      await executePythonBlock(nvim, ['snip_value = 1'], code, 1001)
+      assert.strictEqual(await nvim.call('pyxeval', 'block_value'), 2)
+      await executePythonBlock(nvim, ['snip_value = 2'], code, 1001)
+      assert.strictEqual(await nvim.call('pyxeval', 'block_value'), 3)
+      assert.strictEqual(await nvim.call('pyxeval', `"${id}" in coc_ultisnips_dict["codes"]`), true)
+      await releasePythonCodes(nvim, 1001)
+      assert.strictEqual(await nvim.call('pyxeval', `"${id}" in coc_ultisnips_dict["codes"]`), false)
+      // compiled again after evicted
+      await executePythonBlock(nvim, ['snip_value = 3'], code, 1001)
+      assert.strictEqual(await nvim.call('pyxeval', 'block_value'), 4)
+      await releasePythonCodes(nvim, 1001)
+    })
+
+    it('should release codes of snippets by ids', async () => {
+      const has = async (code: string) => await nvim.call('pyxeval', `"${getCodeId(code)}" in coc_ultisnips_dict["codes"]`)
+      await executePythonBlock(nvim, [], 'owned_value = 1', '1001-1')
+      await executePythonBlock(nvim, [], 'owned_value = 2', '1001-2')
+      await executePythonBlock(nvim, [], 'owned_value = 3', '0-7')
+      await executePythonBlock(nvim, [], 'owned_value = 3', '1001-2')
+      await executePythonCode(nvim, [getTabstopsCode({ id: '0-7', size: 1, deltas: { 0: 'a' }, reset: true })])
+      await releasePythonCodes(nvim, 1001, ['1001-1', '0-7'])
+      assert.strictEqual(await has('owned_value = 1'), false)
+      assert.strictEqual(await has('owned_value = 2'), true)
+      assert.strictEqual(await has('owned_value = 3'), true)
+      assert.strictEqual(await nvim.call('pyxeval', '"0-7" in coc_ultisnips_dict["tabstops"]'), false)
+      await releasePythonCodes(nvim, 1001)
+      assert.strictEqual(await has('owned_value = 2'), false)
+      assert.strictEqual(await has('owned_value = 3'), false)
+    })
+
+    it('should execute python block after runtime reloaded', async () => {
+      let code = 'reload_value = 1'
+      await executePythonBlock(nvim, [], code, 1002)
+      let pyfile = path.join(import.meta.dirname, '../../../bin/ultisnips.py')
+      await nvim.command(`execute 'pyxfile '.fnameescape('${pyfile}')`)
+      await executePythonBlock(nvim, ['reload_value = 0'], code, 1002)
+      assert.strictEqual(await nvim.call('pyxeval', 'reload_value'), 1)
+      await releasePythonCodes(nvim, 1002)
+    })
+
+    it('should include source on error', async () => {
+      let fn = async () => {
+        await executePythonBlock(nvim, [], 'raise ValueError("block error")', 1003)
+      }
+      await assert.rejects(fn(), (err: Error) => {
+        return err.stack.includes('raise ValueError')
+      })
+    })
+  })
+
+  describe('eval_contexts', () => {
+    it('should evaluate contexts with shared snip', async () => {
+      await nvim.setLine('  foo bar')
+      await nvim.call('cursor', [1, 6])
+      let res = await evalPythonContexts(nvim, [
+        { id: '900-1', context: 'snip.before' },
+        { id: '900-2', context: '{}["x"]' },
+        { id: '900-3', context: 'snip.after == " bar"' },
+        { id: '900-4', context: '(' },
+      ], 900)
+      assert.strictEqual(res[0].active, true)
+      assert.deepStrictEqual(res[2], { active: true })
+      assert.deepStrictEqual(res[1], { active: false, error: `KeyError: 'x'` })
+      assert.strictEqual(res[3].active, false)
+      assert.match(res[3].error, /SyntaxError/)
+      let saved = await nvim.call('pyxeval', `coc_ultisnips_dict["contexts"].get("900-1")[0]`)
+      assert.strictEqual(saved, '  foo')
+      let codes = getInitialPythonCode({ range: Range.create(0, 0, 0, 0), line: '', contextId: '900-1', context: 'False', id: '900-5' } as any)
+      await executePythonCode(nvim, codes)
+      assert.strictEqual(await nvim.call('pyxeval', 'context'), '  foo')
+      // compiled expressions are not sent again.
+      res = await evalPythonContexts(nvim, [{ id: '900-6', context: 'snip.before' }], 900)
+      assert.deepStrictEqual(res, [{ active: true }])
+      await releasePythonCodes(nvim, 900)
+    })
+  })
+
+  describe('TriggerMatcher', () => {
+    it('should match regex triggers at end of prefix', async () => {
+      let res = await matchPythonTriggers(nvim, '  foo bar12', ['(?P<w>\\w+)(\\d+)$', 'foo', 'r(\\d)?(x)?1\\d', '(', '\\bbar'])
+      assert.deepStrictEqual(res, [
+        { index: 0, start: 6, groups: ['bar1', '2'] },
+        { index: 2, start: 8, groups: [null, null] },
+      ])
+      assert.deepStrictEqual(await matchPythonTriggers(nvim, 'foo', []), [])
+    })
+
+    it('should compile patterns once', async () => {
+      await matchPythonTriggers(nvim, 'abc', ['c', 'b'])
+      let count = await nvim.call('pyxeval', 'len(coc_ultisnips_dict["triggers"])') as number
+      await matchPythonTriggers(nvim, 'abcd', ['c', 'b', 'd'])
+      assert.strictEqual(await nvim.call('pyxeval', 'len(coc_ultisnips_dict["triggers"])'), count + 1)
+      let codes = getInitialPythonCode({ range: Range.create(0, 0, 0, 3), line: 'abc', regex: 'c$', id: '1-1' } as any)
+      assert.ok(codes.includes('pattern = coc_ultisnips_dict["triggers"].compile("c$")'))
+    })
+  })
+
+  describe('Watchdog', () => {
+    it('should abort and disable code over time budget', async () => {
+      setPythonTimeBudget(50)
+      try {
+        let code = 'import time\nwhile True:\n    time.sleep(0.001)'
+        let profile = { trigger: 'loop', kind: 'block' }
+        for (let i = 0; i < 2; i++) {
+          let err
+          try {
+            await executePythonBlock(nvim, ['x = 1'], code, 1001, false, profile)
+          } catch (e) {
+            err = e
+          }
+          assert.ok(/of snippet "loop" exceeded time budget of 50ms and is disabled for the session: import time/.test(err.message), err.message)
+        }
+        await executePythonBlock(nvim, [], 'x = 2', 1001)
+        assert.strictEqual(await nvim.call('pyxeval', 'x'), 2)
+      } finally {
+        setPythonTimeBudget(0)
+        await releasePythonCodes(nvim, 1001)
+      }
+    })
+
+    it('should set error of time budget by try catch of vim', async () => {
+      let code = addPythonTryCatch([
+        'coc_ultisnips_dict["watchdog"].budget = 0.05',
+        'try:',
+        '    coc_ultisnips_dict["codes"].run("vim-loop", globals(), 1001, "while True: pass")',
+        'finally:',
+        '    coc_ultisnips_dict["watchdog"].budget = 0',
+      ].join('\n'), true)
+      await nvim.command(`pyx ${code}`)
+      assert.match(String(await nvim.getVar('errmsg')), /exceeded time budget of 50ms/)
+      assert.strictEqual(await nvim.call('pyxeval', '"vim-loop" in coc_ultisnips_dict["watchdog"]'), true)
+      await releasePythonCodes(nvim, 1001)
+      assert.strictEqual(await nvim.call('pyxeval', '"vim-loop" in coc_ultisnips_dict["watchdog"]'), false)
+    })
+  })
+
+  describe('EditorState', () => {
+    it('should read editor state once in each execution', async () => {
+      await nvim.setLine('foo')
+      await nvim.command('setl shiftwidth=2 expandtab')
+      await executePythonCode(nvim, ['state = coc_ultisnips_dict["state"]', 'res = [state.shiftwidth, state.expandtab, state.get("fn") is state.get("fn")]'])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'res'), [2, true, true])
+      await nvim.command('setl shiftwidth=4')
+      await executePythonCode(nvim, ['res = state.shiftwidth'])
+      assert.strictEqual(await nvim.call('pyxeval', 'res'), 4)
+    })
+
+    it('should read selected text on first access', async () => {
+      await nvim.setVar('coc_selected_text', 'foo\nbar')
+      await executePythonCode(nvim, ['state = coc_ultisnips_dict["state"]', 'res = [state.get("visualmode") is not None, state._selected_text]'])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'res'), [true, null])
+      await executePythonCode(nvim, ['res = [state.selected_text, state._selected_text]'])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'res'), ['foo\nbar', 'foo\nbar'])
+      await nvim.setVar('coc_selected_text', '')
+    })
+
+    it('should get visual content', async () => {
+      await nvim.call('setline', [1, ['foo', 'bar', 'baz']])
+      await nvim.command('exe "normal! ggvjl\\<Esc>"')
+      await executePythonCode(nvim, ['res = coc_ultisnips_dict["get_visual_content"]()'])
+      assert.strictEqual(await nvim.call('pyxeval', 'res'), 'foo\nba')
+      await nvim.command('exe "normal! ggVG\\<Esc>"')
+      await executePythonCode(nvim, ['res = coc_ultisnips_dict["get_visual_content"]()'])
+      assert.strictEqual(await nvim.call('pyxeval', 'res'), 'foo\nbar\nbaz\n')
+    })
+  })
+
+  describe('ContextStore', () => {
+    it('should keep contexts by buffer with limit', async () => {
+      const contexts = (bufnr: number, start: number, end: number): UltiSnippetContext[] => {
+        let res: UltiSnippetContext[] = []
+        for (let i = start; i < end; i++) {
+          res.push({ range: Range.create(0, 0, 0, 1), line: 'a', context: `"c${i}"`, regex: 'a', id: `${bufnr}-${i}` })
+        }
+        return res
+      }
+      for (let context of [...contexts(1002, 0, 3), ...contexts(1003, 0, 1)]) {
+        await executePythonCode(nvim, getInitialPythonCode(context, 2))
+      }
+      const has = async (id: string) => await nvim.call('pyxeval', `"${id}" in coc_ultisnips_dict["contexts"]`)
+      assert.strictEqual(await has('1002-0'), false)
+      assert.strictEqual(await has('1002-1'), true)
+      assert.strictEqual(await has('1003-0'), true)
+      await executePythonCode(nvim, [
+        ...getResetPythonCode(contexts(1002, 1, 2)[0]),
+        'res = [context, match.group(0)]'
+      ])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'res'), ['c1', 'a'])
+      // 1002-1 is recently used
+      await executePythonCode(nvim, getInitialPythonCode(contexts(1002, 3, 4)[0], 2))
+      assert.strictEqual(await has('1002-1'), true)
+      assert.strictEqual(await has('1002-2'), false)
+      await executePythonCode(nvim, [...getResetPythonCode(contexts(1002, 2, 3)[0]), 'res = [context, match]'])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'res'), [null, null])
+      await releasePythonCodes(nvim, 1002, ['1002-1'])
+      assert.strictEqual(await has('1002-1'), false)
+      assert.strictEqual(await has('1002-3'), true)
+      await releasePythonCodes(nvim, 1002)
+      await releasePythonCodes(nvim, 1003)
+      assert.strictEqual(await has('1002-3'), false)
+      assert.strictEqual(await has('1003-0'), false)
+    })
+  })
+
+  describe('TabStops', () => {
+    it('should apply changes of tabstop values', async () => {
+      const sync = async (changes: TabstopChanges) => {
+        await executePythonCode(nvim, [getTabstopsCode(changes)])
+        return await nvim.call('pyxeval', 't')
+      }
+      assert.deepStrictEqual(await sync({ id: '1001-1', size: 3, deltas: { 0: 'a', 2: 'c\n"' }, reset: true }), ['a', '', 'c\n"'])
+      assert.deepStrictEqual(await sync({ id: '1001-1', size: 3, deltas: { 1: 'b' }, reset: false }), ['a', 'b', 'c\n"'])
+      assert.deepStrictEqual(await sync({ id: '1001-1', size: 2, deltas: {}, reset: false }), ['a', 'b'])
+      assert.deepStrictEqual(await sync({ id: '1001-2', size: 1, deltas: { 0: 'x' }, reset: true }), ['x'])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'coc_ultisnips_dict["tabstops"].get("1001-1")'), ['a', 'b'])
+      await releasePythonCodes(nvim, 1001)
+      let fn = async () => {
+        await sync({ id: '1001-1', size: 2, deltas: {}, reset: false })
+      }
+      await assert.rejects(fn(), /Unknown tabstops/)
+    })
+
+    it('should send all values after runtime reloaded', async () => {
+      let snip = await createSnippet('${1:a} `!p snip.rv = t[1] * 2`', {})
+      let pyfile = path.join(import.meta.dirname, '../../../bin/ultisnips.py')
+      await nvim.command(`execute 'pyxfile '.fnameescape('${pyfile}')`)
+      let p = snip.tmSnippet.placeholders.find(o => o.index === 1)
+      p.replaceChildren([new Text('b')])
+      await snip.tmSnippet.update(nvim, p, CancellationToken.None)
+      assert.strictEqual(snip.tmSnippet.toString(), 'b bb')
+    })
+  })
+
+  describe('diff()', () => {
+    it('should diff texts to hunks', async () => {
+      // Single insertions and deletions keep the hunks of the previous
+      // implementation, replacements delete before they insert, see
+      // src/__tests__/python/test_diff.py for the randomized comparison.
+      let cases: [string, string, Hunk[]][] = [
+        ['foo', 'foobar', [['I', 0, 3, 'bar']]],
+        ['foobar', 'foo', [['D', 0, 3, 'bar']]],
+        ['aa', 'aaa', [['I', 0, 0, 'a']]],
+        ['aaa', 'aa', [['D', 0, 0, 'a']]],
+        ['abcabc', 'abc', [['D', 0, 0, 'abc']]],
+        ['hello\n\n', 'hello\n\n\n', [['I', 0, 5, '\n']]],
+        ['a\nb', 'a\nx\nb', [['I', 0, 1, '\n'], ['I', 1, 0, 'x']]],
+        ['ab\ncd', 'x', [['D', 0, 0, 'ab'], ['D', 0, 0, '\n'], ['D', 0, 0, 'cd'], ['I', 0, 0, 'x']]],
+        ['foo(bar)', 'foo(baz, bar)', [['I', 0, 4, 'baz, ']]],
+        ['abc', 'xabcx', [['I', 0, 0, 'x'], ['I', 0, 4, 'x']]],
+        ['', 'abc', [['I', 0, 0, 'abc']]],
+        ['abc', '', [['D', 0, 0, 'abc']]],
+        ['a b c', 'a c', [['D', 0, 1, ' b']]],
+        ['foo bar baz', 'foo baz', [['D', 0, 3, ' bar']]],
+        ['def foo(self):', 'def foo(self, bar):', [['I', 0, 12, ', bar']]],
+        ['snip.rv = t[1]', 'snip.rv = t[2]', [['D', 0, 12, '1'], ['I', 0, 12, '2']]],
+        ['    return value', '        return value', [['I', 0, 0, '    ']]],
+        ['b', '  ', [['D', 0, 0, 'b'], ['I', 0, 0, '  ']]],
+        ['hello world', 'hello there', [['D', 0, 6, 'world'], ['I', 0, 6, 'there']]],
+      ]
+      for (let [a, b, expected] of cases) {
+        assert.deepStrictEqual(await pyDiff(a, b), expected)
+      }
+    })
+
+    it('should merge short equalities into edits of long texts', async () => {
+      let prefix = 'x'.repeat(6000)
+      assert.deepStrictEqual(await pyDiff(prefix + ' hello world', prefix + ' hello there'), [['D', 0, 6007, 'world'], ['I', 0, 6007, 'there']])
+    })
+
+    it('should replace texts with too many edits', async () => {
+      let a = 'x'.repeat(5000)
+      let b = 'y'.repeat(5000)
+      assert.deepStrictEqual(await pyDiff(a, b), [['D', 0, 0, a], ['I', 0, 0, b]])
+    })
+
+    it('should produce hunks that turn a into b', async () => {
+      let chars = ['a', 'b', ' ', '\n']
+      let seed = 1
+      const random = (n: number) => {
+        seed = (seed * 16807) % 2147483647
+        return seed % n
+      }
+      const randomText = () => {
+        let len = random(16)
+        let s = ''
+        for (let i = 0; i < len; i++) s += chars[random(chars.length)]
+        return s
+      }
+      for (let i = 0; i < 100; i++) {
+        let a = randomText()
+        let b = randomText()
+        let hunks = await pyDiff(a, b)
+        assert.strictEqual(applyHunks(a, hunks), b)
+        for (let [, , , value] of hunks) {
+          assert.ok(value == '\n' || !value.includes('\n'))
+        }
+      }
+    })
+
+    it('should diff long lines', async () => {
+      let a = '{"key": "value", "list": [1, 2, 3]}, '.repeat(500)
+      let b = a.slice(0, 9000) + a.slice(9000, 9200).replace(/value/g, 'other') + a.slice(9200)
+      let hunks = await pyDiff(a, b)
+      // 'value' -> 'other' is D valu, I oth, I r like the previous implementation
+      assert.strictEqual(hunks.length, 18)
+      assert.strictEqual(applyHunks(a, hunks), b)
+    })
+  })
+
+  describe('VimHooks', () => {
+    it('should restore vim functions after hooks removed in any order', async () => {
+      await executePythonCode(nvim, [
+        'import vim',
+        'origin = (vim.eval, vim.command)',
+        'hooks = coc_ultisnips_dict["hooks"]',
+        'calls = []',
+        'first, second = lambda: calls.append(1), lambda: calls.append(2)',
+        'hooks.add(first)',
+        'hooks.add(second)',
+        'vim.eval("1")',
+        'hooks.remove(first)',
+        'vim.command("let g:coc_hooks_test = 1")',
+        'hooks.remove(second)',
+        'vim.eval("1")',
+        'res = [calls, (vim.eval, vim.command) == origin, len(hooks)]',
+      ])
+      assert.deepStrictEqual(await nvim.call('pyxeval', 'res'), [[1, 2, 2], true, 0])
+    })
+  })
+
+  describe('Profiler', () => {
+    afterEach(async () => {
+      await setPythonProfiling(nvim, false)
+      await getPythonProfile(nvim, true)
+    })
+
+    it('should not profile when disabled', async () => {
+      await createSnippet('`!p snip.rv = "x"`', { context: 'True' }, Range.create(0, 0, 0, 3), 'foo')
+      assert.deepStrictEqual(await getPythonProfile(nvim), [])
+      assert.strictEqual(formatProfile([]).includes('snippets.toggleProfiling'), true)
+    })
+
+    it('should profile context and blocks by trigger', async () => {
+      await setPythonProfiling(nvim, true)
+      let snip = await createSnippet('${1:a} `!p snip.rv = t[1] + snip.fn`', { context: 'snip.before != "x"' }, Range.create(0, 0, 0, 3), 'foo')
+      let p = snip.tmSnippet.placeholders.find(o => o.index === 1)
+      p.replaceChildren([new Text('b')])
+      await snip.tmSnippet.update(nvim, p, CancellationToken.None)
+      let records = await getPythonProfile(nvim)
+      let context = records.find(o => o.kind === 'context')
+      assert.strictEqual(context.trigger, 'foo')
+      assert.strictEqual(context.count, 1)
+      assert.strictEqual(context.code, 'snip.before != "x"')
+      let block = records.find(o => o.kind === 'block')
+      assert.strictEqual(block.trigger, 'foo')
+      assert.strictEqual(block.count, 2)
+      assert.strictEqual(block.id, getCodeId('snip.rv = t[1] + snip.fn'))
+      assert.ok(block.vimCalls >= 2)
+      assert.ok(formatProfile(records).includes('foo / block / '))
+      await setPythonProfiling(nvim, false)
+      assert.strictEqual(await nvim.call('pyxeval', 'coc_ultisnips_dict["profiler"].enabled'), false)
+      assert.strictEqual((await getPythonProfile(nvim, true)).length, 2)
+      assert.deepStrictEqual(await getPythonProfile(nvim), [])
+    })
+  })
+
+  describe('python worker', () => {
+    const command = ['python3', path.join(import.meta.dirname, '../../../bin/ultisnips_worker.py')]
+
+    afterEach(() => {
+      setPythonWorker(nvim, undefined)
+    })
+
+    it('should evaluate python blocks by worker', async () => {
+      let context: UltiSnippetContext = { range: Range.create(0, 0, 0, 0), line: '', id: generateContextId(workspace.bufnr) }
+      assert.strictEqual(isWorkerContext(context), false)
+      setPythonWorker(nvim, command)
+      assert.strictEqual(isWorkerContext(context), true)
+      assert.strictEqual(isWorkerContext({ ...context, context: 'True' }), false)
+      context.worker = true
+      let codes = getInitialPythonCode(context)
+      await executePythonCode(nvim, codes, codes, true)
+      let resolver = new SnippetVariableResolver(nvim, workspace.workspaceFolderControl)
+      let snip = new CocSnippet('${1:a} `!p snip.rv = t[1] * 2`', Position.create(0, 0), nvim, resolver)
+      await snip.init(context)
+      assert.strictEqual(snip.tmSnippet.toString(), 'a aa')
+      let p = snip.tmSnippet.placeholders.find(o => o.index === 1)
+      p.replaceChildren([new Text('b')])
+      await snip.tmSnippet.update(nvim, p, CancellationToken.None)
+      assert.strictEqual(snip.tmSnippet.toString(), 'b bb')
+      // not evaluated by python of vim
+      assert.strictEqual(await nvim.call('pyxeval', `'${context.id}' in coc_ultisnips_dict["contexts"]`), false)
+      await releasePythonCodes(nvim, parseInt(context.id, 10), [context.id])
+      assert.strictEqual(await evalPythonExpr(nvim, `'${context.id}' in coc_ultisnips_dict["contexts"]`, true), false)
+    })
+
+    it('should use snapshot and apply changes of worker', async () => {
+      setPythonWorker(nvim, command)
+      await nvim.setLine('bar')
+      await executePythonCode(nvim, [
+        'import vim',
+        'vim.vars["coc_worker_test"] = vim.eval("&tabstop") + vim.eval("&shiftwidth")',
+        'vim.current.buffer[0] = "foo"',
+        'vim.command("let g:coc_worker_cmd = 1")',
+      ], undefined, true)
+      // numbers like vim.eval() of neovim
+      assert.strictEqual(await nvim.getVar('coc_worker_test'), 16)
+      assert.strictEqual(await nvim.getVar('coc_worker_cmd'), 1)
+      assert.strictEqual(await nvim.line, 'foo')
+      assert.strictEqual(await evalPythonExpr(nvim, 'vim.current.buffer[0]', true), 'foo')
+    })
+
+    it('should read and write variables, options and buffers of vim by worker', async () => {
+      setPythonWorker(nvim, command)
+      await nvim.setVar('coc_worker_var', 'x')
+      await nvim.command('set textwidth=0')
+      let buf = await nvim.createNewBuffer(false)
+      await buf.setLines(['a', 'b'], { start: 0, end: -1 })
+      await executePythonCode(nvim, [
+        'import vim',
+        'res = [vim.vars["coc_worker_var"], "coc_worker_none" in vim.vars, vim.options["textwidth"]]',
+        'del vim.vars["coc_worker_var"]',
+        'vim.options["textwidth"] = 79',
+        `vim.buffers[${buf.id}][1] = "c"`,
+        `res.append(${buf.id} in [b.number for b in vim.buffers])`,
+      ], undefined, true)
+      assert.deepStrictEqual(await evalPythonExpr(nvim, 'res', true), ['x', false, 0, true])
+      assert.strictEqual(await nvim.call('exists', ['g:coc_worker_var']), 0)
+      assert.strictEqual(await nvim.getOption('textwidth'), 79)
+      assert.deepStrictEqual(await buf.lines, ['a', 'c'])
+      await nvim.command('set textwidth=0')
+    })
+
+    it('should evaluate expressions of runtime for snapshot', async () => {
+      setPythonWorker(nvim, command)
+      await nvim.command('setl shiftwidth=3')
+      await nvim.setVar('coc_selected_text', 'selected')
+      let exprs: string[] = []
+      let fn = nvim.eval
+      nvim.eval = (expr: string) => {
+        exprs.push(expr)
+        return fn.call(nvim, expr)
+      }
+      try {
+        await executePythonCode(nvim, [
+          'state = coc_ultisnips_dict["state"]',
+          'res = [state.shiftwidth, state.changedtick > 0]',
+        ], undefined, true)
+        // one snapshot, values of the runtime are not requested by eval
+        assert.strictEqual(exprs.length, 1)
+        assert.ok(!exprs[0].includes('coc_selected_text'))
+        await executePythonCode(nvim, ['res.append(state.selected_text)'], undefined, true)
+      } finally {
+        nvim.eval = fn
+        await nvim.command('unlet g:coc_selected_text')
+      }
+      assert.deepStrictEqual(await evalPythonExpr(nvim, 'res', true), [3, true, 'selected'])
+      let expression = await evalPythonExpr(nvim, 'state.expression', true)
+      assert.ok(exprs[0].includes(expression))
+      // the selected text is requested on use only
+      assert.strictEqual(exprs.length, 3)
+      assert.strictEqual(exprs[2], await evalPythonExpr(nvim, 'state.selection', true))
+    })
+
+    it('should throw error of worker', async () => {
+      setPythonWorker(nvim, command)
+      await assert.rejects(executePythonCode(nvim, ['raise Exception("bad code")'], undefined, true), /bad code/)
+      setPythonWorker(nvim, ['python3', '-c', 'import sys; sys.exit(3)'])
+      await assert.rejects(evalPythonExpr(nvim, '1', true), /exited with code 3/)
+      setPythonWorker(nvim, ['python3', '-c', 'import sys; sys.stderr.write("requires the msgpack package"); sys.exit(2)'])
+      await assert.rejects(evalPythonExpr(nvim, '1', true), /exited with code 2: requires the msgpack package/)
+    })
+  })
+})
@@ -414,8 +414,8 @@ describe('SnippetParser', () => {
     assert.deepEqual(s.values, { '0': '', '1': '_foo', '2': 'bar', '3': '' })
     arr[1].index = 1.1
     assert.deepEqual(s.values, { '0': '', '1': '_foo', '2': 'bar', '3': '' })
-    s = c('${1:`!p snip.rv = t[2]`} ${2:`!p snip.rv = t[1]`}')
-    assert.deepEqual(s.orderedPyIndexBlocks, [])
+    s = c('${1:`!p snip.rv = t[2]`} ${2:`!p snip.rv = t[1]`} ${3:`!p snip.rv = ""`}')
+    assert.deepEqual(s.pyIndexBlocks.map(o => o.index), [1, 2])
   })
 
   test('Parser, python CodeBlock with related', () => {
@@ -1120,6 +1120,29 @@ describe('SnippetParser', () => {
 })
 
 describe('TextmateSnippet', () => {
+  test('SnippetParser#parseCached', () => {
+    SnippetParser.clearTemplates()
+    let parser = new SnippetParser(true)
+    let text = 'for ${1:i} in ${2|a,b|}: `!p snip.rv = t[1]`$0'
+    let first = parser.parseCached(text, true)
+    let second = parser.parseCached(text, true)
+    assert.notStrictEqual(first, second)
+    assert.notStrictEqual(first.id, second.id)
+    assert.strictEqual(second.toTextmateString(), parser.parse(text, true).toTextmateString())
+    assert.deepEqual(second.pyBlocks[0].related, [1])
+    // clones are independent
+    first.placeholders[0].setOnlyChild(new Text('j'))
+    assert.strictEqual(second.placeholders[0].toString(), 'i')
+    let choice = second.placeholders.find(p => p.choice).choice
+    assert.strictEqual(choice.options[0].parent, choice)
+    assert.notStrictEqual(first.placeholders.find(p => p.choice).choice.options[0], choice.options[0])
+    new SnippetParser(false).parseCached(text, true)
+    parser.parseCached(text, false)
+    assert.deepEqual(SnippetParser.templateStats, { hits: 1, misses: 3, size: 3 })
+    SnippetParser.clearTemplates()
+    assert.deepEqual(SnippetParser.templateStats, { hits: 0, misses: 0, size: 0 })
+  })
+
   test('TextmateSnippet#enclosingPlaceholders', () => {
     let snippet = new SnippetParser().parse('This ${1:is ${2:nested}}$0', true)
     let [first, second] = snippet.placeholders
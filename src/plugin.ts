@@ -17,6 +17,7 @@ import mcp from './mcp'
 import { Neovim } from '@chemzqm/neovim'
 import services from './services'
 import snippetManager from './snippets/manager'
+import { AnonymousSnippet } from './snippets/util'
 import { HoverTarget, UltiSnippetOption } from './types'
 import { Disposable, disposeAll } from './util'
 import window, { Window } from './window'
@@ -69,6 +70,7 @@ export default class Plugin {
     this.addAction('registerExtensions', (...folders: string[]) => extensions.manager.loadExtension(folders), 'registExtensions')
     this.addAction('snippetCheck', (checkExpand: boolean, checkJump: boolean) => this.handler.workspace.snippetCheck(checkExpand, checkJump))
     this.addAction('snippetInsert', (range: Range, newText: string, mode?: InsertTextMode, ultisnip?: UltiSnippetOption) => snippetManager.insertSnippet(newText, true, range, mode, ultisnip))
+    this.addAction('snippetInsertBatch', (snippets: AnonymousSnippet[]) => snippetManager.insertAnonymousSnippets(snippets))
     this.addAction('snippetNext', () => snippetManager.nextPlaceholder())
     this.addAction('snippetPrev', () => snippetManager.previousPlaceholder())
     this.addAction('snippetCancel', () => snippetManager.cancel())
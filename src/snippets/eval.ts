@@ -3,13 +3,110 @@ import { Neovim } from '@chemzqm/neovim'
 import { Range } from 'vscode-languageserver-types'
 import events from '../events'
 import { UltiSnippetOption } from '../types'
+import { sha256 } from '../util'
 import { isVim } from '../util/constants'
 import { UltiSnippetContext } from './util'
+import { PythonWorker } from './worker'
 export type EvalKind = 'vim' | 'python' | 'shell'
 
-const contexts_var = '__coc_ultisnip_contexts'
+/**
+ * Changed tabstop values of snippet, see TabStops.sync of the runtime.
+ */
+export interface TabstopChanges {
+  id: string
+  size: number
+  deltas: { [index: number]: string }
+  reset: boolean
+}
+
+/**
+ * Python blocks with the tabstop values they depend on, see eval_blocks of
+ * the runtime.
+ */
+export interface PythonBlockArgs {
+  codes: string[]
+  current: string[]
+  related: number[][]
+  // results could be memoized by values of related tabstops
+  memo: boolean[]
+  order: number[]
+  schedule: number[]
+  after: number[]
+  limit: number
+  tabstops: TabstopChanges
+  templates: { [index: number]: (string | number | [number])[] }
+  trigger?: string
+}
+
+/**
+ * Regex trigger matched by python, see TriggerMatcher of the runtime.
+ */
+export interface RegexTriggerMatch {
+  // index of the trigger
+  index: number
+  // character index of the matched text in the prefix
+  start: number
+  groups: (string | null)[]
+}
+
+/**
+ * Snippet candidate with context expression, the context is saved by id when
+ * active.
+ */
+export interface ContextCandidate {
+  id: string
+  context: string
+  // trigger for profile
+  trigger?: string
+}
+
+export interface ContextResult {
+  active: boolean
+  // message of exception raised by the expression
+  error?: string
+}
+
+export interface PythonBlockResults {
+  blocks: { [pos: string]: string }
+  values: { [index: string]: string }
+  cycles: number[]
+  truncated: boolean
+}
+
+/**
+ * Profile of snippet code, see Profiler of the runtime.
+ */
+export interface ProfileRecord {
+  trigger: string
+  kind: string
+  id: string
+  count: number
+  // milliseconds
+  time: number
+  vimCalls: number
+  code?: string
+}
+
+const contexts_var = 'coc_ultisnips_dict["contexts"]'
+// default max count of ultisnips contexts kept for each buffer
+export const CONTEXT_LIMIT = 20
+const codes_var = 'coc_ultisnips_dict["codes"]'
+const tabstops_var = 'coc_ultisnips_dict["tabstops"]'
+const results_var = '__coc_block_results'
+const profiler_var = 'coc_ultisnips_dict["profiler"]'
+const triggers_var = 'coc_ultisnips_dict["triggers"]'
+const state_var = 'coc_ultisnips_dict["state"]'
+const watchdog_var = 'coc_ultisnips_dict["watchdog"]'
 
 let context_id = 1
+// ids of code compiled by the python runtime
+const compiledCodes: Set<string> = new Set()
+let pythonWorker: PythonWorker | undefined
+let profiling = false
+// time budget in milliseconds of each execution of snippet code, 0 to disable
+let timeBudget = 0
+// first line of profiled codes by id
+const profiledCodes: Map<string, string> = new Map()
 
 export function generateContextId(bufnr: number): string {
   return `${bufnr}-${context_id++}`
@@ -22,19 +119,66 @@ export function hasPython(snip?: UltiSnippetContext | UltiSnippetOption): boolea
   return false
 }
 
+/**
+ * Start python worker by command on demand, the worker is disposed when
+ * command is empty.
+ */
+export function setPythonWorker(nvim: Neovim, command: string[] | undefined): void {
+  if (pythonWorker && command && pythonWorker.command.join(' ') === command.join(' ')) return
+  pythonWorker?.dispose()
+  pythonWorker = command && command.length > 0 ? new PythonWorker(nvim, command) : undefined
+}
+
+/**
+ * Python code of the context could be evaluated by the python worker, context
+ * expression and actions requires the python of vim.
+ */
+export function isWorkerContext(context: UltiSnippetContext): boolean {
+  return pythonWorker != null && !hasPython(context)
+}
+
+export function isPythonProfiling(): boolean {
+  return profiling
+}
+
+/**
+ * Set time budget in milliseconds of each execution of snippet python code,
+ * code over the budget is aborted and disabled for the session, 0 to disable.
+ */
+export function setPythonTimeBudget(budget: number): void {
+  timeBudget = Math.max(0, budget)
+}
+
+/**
+ * Trigger of the snippet, empty string when context not exists.
+ */
+export function getSnippetTrigger(context: UltiSnippetContext | undefined): string {
+  if (!context) return ''
+  let { line, range } = context
+  return line.slice(range.start.character, range.end.character)
+}
+
+/**
+ * Trigger of the snippet for profile, undefined when not profiling.
+ */
+export function getProfileTrigger(context: UltiSnippetContext | undefined): string | undefined {
+  if (!profiling) return undefined
+  return getSnippetTrigger(context)
+}
+
+function addProfiledCode(id: string, code: string): void {
+  profiledCodes.set(id, code.trim().split(/\r?\n/)[0])
+}
+
 export function getResetPythonCode(context: UltiSnippetContext): string[] {
-  const pyCodes: string[] = []
-  pyCodes.push(`${contexts_var} = ${contexts_var} if '${contexts_var}' in locals() else {}`)
-  pyCodes.push(`context = ${contexts_var}.get('${context.id}', {}).get('context', None)`)
-  pyCodes.push(`match = ${contexts_var}.get('${context.id}', {}).get('match', None)`)
-  return pyCodes
+  return [`context, match = ${contexts_var}.get('${context.id}')`]
 }
 
 export function getPyBlockCode(snip: UltiSnippetContext): string[] {
   let { range, line } = snip
   let pyCodes: string[] = [
     'import re, os, vim, string, random',
-    `path = vim.eval('coc#util#get_fullpath()') or ""`,
+    `path = ${state_var}.get("path") or ""`,
     `fn = os.path.basename(path)`,
   ]
   let start = `(${range.start.line},${range.start.character})`
@@ -45,62 +189,275 @@ export function getPyBlockCode(snip: UltiSnippetContext): string[] {
   return pyCodes
 }
 
-export function getInitialPythonCode(context: UltiSnippetContext): string[] {
+export function getInitialPythonCode(context: UltiSnippetContext, limit = CONTEXT_LIMIT): string[] {
   let pyCodes: string[] = [
     'import re, os, vim, string, random',
-    `path = vim.eval('coc#util#get_fullpath()') or ""`,
+    `path = ${state_var}.get("path") or ""`,
     `fn = os.path.basename(path)`,
   ]
-  let { range, regex, line, id } = context
-  if (context.context) {
+  let { range, regex, line } = context
+  if (context.contextId) {
+    pyCodes.push(`context, _ = ${contexts_var}.get('${context.contextId}')`)
+  } else if (context.context) {
     pyCodes.push(`snip = ContextSnippet()`)
-    pyCodes.push(`context = ${context.context}`)
+    let trigger = getProfileTrigger(context)
+    if (trigger === undefined) {
+      pyCodes.push(`context = ${context.context}`)
+    } else {
+      let id = getCodeId(context.context)
+      addProfiledCode(id, context.context)
+      pyCodes.push(`context = ${profiler_var}.measure("${escapeString(trigger)}", "context", "${id}", lambda: (${context.context}))`)
+    }
   } else {
     pyCodes.push(`context = None`)
   }
   if (regex && Range.is(range)) {
     let trigger = line.slice(range.start.character, range.end.character)
-    pyCodes.push(`pattern = re.compile("${escapeString(regex)}")`)
+    pyCodes.push(`pattern = ${triggers_var}.compile("${escapeString(regex)}")`)
     pyCodes.push(`match = pattern.search("${escapeString(trigger)}")`)
   } else {
     pyCodes.push(`match = None`)
   }
   // save 'context and 'match' for synchronize and actions.
-  pyCodes.push(`${contexts_var} = ${contexts_var} if '${contexts_var}' in locals() else {}`)
-  let prefix = id.match(/^\w+-/)[0]
-  // keep context of current buffer only.
-  pyCodes.push(`${contexts_var} = {k: v for k, v in ${contexts_var}.items() if k.startswith('${prefix}')}`)
-  pyCodes.push(`${contexts_var}['${context.id}'] = {'context': context, 'match': match}`)
+  pyCodes.push(`${contexts_var}.set('${context.id}', context, match, ${limit})`)
   return pyCodes
 }
 
-export async function executePythonCode(nvim: Neovim, codes: string[]) {
+/**
+ * Execute python code by :pyx, or by the python worker when worker is true.
+ */
+export async function executePythonCode(nvim: Neovim, codes: string[], source = codes, worker = false) {
   if (codes.length == 0) return
   let lines = [...codes]
-  lines.unshift(`__requesting = ${events.requesting ? 'True' : 'False'}`)
+  // new evaluation cycle, editor state of the runtime is read again.
+  lines.unshift(`__requesting = ${events.requesting ? 'True' : 'False'}`, `if "coc_ultisnips_dict" in globals(): ${state_var}.invalidate(); ${watchdog_var}.budget = ${timeBudget / 1000}`)
   try {
-    await nvim.command(`pyx ${addPythonTryCatch(lines.join('\n'))}`)
+    if (worker) {
+      await getWorker().execute(lines.join('\n'))
+    } else {
+      await nvim.command(`pyx ${addPythonTryCatch(lines.join('\n'))}`)
+    }
   } catch (e: any) {
     let err = new Error(e.message)
-    err.stack = `Error on execute python code:\n${codes.join('\n')}\n` + e.stack
+    err.stack = `Error on execute python code:\n${source.join('\n')}\n` + e.stack
     throw err
   }
 }
 
-export function getVariablesCode(values: { [index: number]: string }): string {
-  let keys = Object.keys(values)
-  if (keys.length == 0) return `t = ()`
-  let maxIndex = Math.max.apply(null, keys.map(v => Number(v)))
-  let vals = (new Array(maxIndex)).fill('""')
-  for (let [idx, val] of Object.entries(values)) {
-    vals[idx] = `"${escapeString(val)}"`
+/**
+ * Evaluate python expression by pyxeval(), or by the python worker when worker
+ * is true.
+ */
+export async function evalPythonExpr(nvim: Neovim, expr: string, worker = false): Promise<any> {
+  if (worker) return await getWorker().eval(expr)
+  return await nvim.call('pyxeval', expr)
+}
+
+function getWorker(): PythonWorker {
+  if (!pythonWorker) throw new Error('Python worker not configured')
+  return pythonWorker
+}
+
+export function getCodeId(code: string): string {
+  return sha256(code).slice(0, 16)
+}
+
+/**
+ * Id of python expression compiled by the runtime, differs from id of the same
+ * code compiled as statements.
+ */
+export function getExprId(expr: string): string {
+  return getCodeId(`eval:${expr}`)
+}
+
+/**
+ * Error of code over the time budget with trigger of the snippet and first
+ * line of the code, undefined when error is not caused by time budget.
+ */
+function getTimeBudgetError(e: Error, codes: string[], ids: string[], trigger?: string): Error | undefined {
+  let ms = /Snippet code (\w+) exceeded time budget of (\d+)ms/.exec(e.message)
+  let idx = ms ? ids.indexOf(ms[1]) : -1
+  if (idx == -1) return undefined
+  let snippet = trigger ? ` of snippet "${trigger}"` : ''
+  let err = new Error(`Python code${snippet} exceeded time budget of ${ms[2]}ms and is disabled for the session: ${codes[idx].trim().split(/\r?\n/)[0]}`)
+  err.stack = e.stack
+  return err
+}
+
+/**
+ * Execute python code created by getCodes with sources of compiled codes, the
+ * source is null when the code is compiled by the runtime already.
+ */
+async function executeCompiledCode(nvim: Neovim, codes: string[], getCodes: (sources: (string | null)[]) => string[], source: string[], worker: boolean, ids = codes.map(code => getCodeId(code)), trigger?: string): Promise<void> {
+  const compiledIds = worker ? getWorker().compiled : compiledCodes
+  if (profiling) codes.forEach((code, i) => addProfiledCode(ids[i], code))
+  const compiled = ids.map(id => compiledIds.has(id))
+  ids.forEach(id => compiledIds.add(id))
+  try {
+    await executePythonCode(nvim, getCodes(codes.map((code, i) => compiled[i] ? null : code)), source, worker)
+  } catch (e: any) {
+    let err = e
+    // the runtime could be reloaded, send all sources.
+    if (compiled.some(Boolean) && /Unknown code/.test(e.message)) {
+      try {
+        await executePythonCode(nvim, getCodes(codes), source, worker)
+        return
+      } catch (e) {
+        err = e
+      }
+    }
+    ids.forEach(id => compiledIds.delete(id))
+    throw getTimeBudgetError(err, codes, ids, trigger) ?? err
+  }
+}
+
+/**
+ * Execute python code after codes, the code is compiled once by the runtime
+ * and executed by id afterwards, profiled with trigger when profiling, the
+ * trigger is also used by error of time budget. The compiled code is owned by
+ * id of the snippet, or the buffer number for code of no snippet.
+ */
+export async function executePythonBlock(nvim: Neovim, codes: string[], code: string, owner: number | string, worker = false, profile?: { trigger: string, kind: string }): Promise<void> {
+  const id = getCodeId(code)
+  await executeCompiledCode(nvim, [code], sources => {
+    let args = sources[0] == null ? '' : `, source="${escapeString(sources[0])}"`
+    if (profiling && profile) args += `, trigger="${escapeString(profile.trigger)}", kind="${profile.kind}"`
+    return [...codes, `${codes_var}.run("${id}", globals(), ${JSON.stringify(owner)}${args})`]
+  }, [...codes, code], worker, [id], profile?.trigger)
+}
+
+/**
+ * Evaluate python blocks in one call after codes, see eval_blocks of the
+ * runtime for the arguments and results, trigger of the snippet is used by
+ * error of time budget.
+ */
+export async function evalPythonBlocks(nvim: Neovim, codes: string[], blocks: PythonBlockArgs, owner: string, worker = false, trigger?: string): Promise<PythonBlockResults> {
+  let { codes: sources, current, related, memo, ...rest } = blocks
+  await executeCompiledCode(nvim, sources, arr => {
+    let args = {
+      owner,
+      blocks: sources.map((code, i) => [getCodeId(code), arr[i], current[i], related[i], memo[i]]),
+      ...rest
+    }
+    return [...codes, `${results_var} = coc_ultisnips_dict["eval_blocks"](globals(), "${escapeString(JSON.stringify(args))}")`]
+  }, [...codes, ...sources], worker, undefined, trigger)
+  return await evalPythonExpr(nvim, results_var, worker) as PythonBlockResults
+}
+
+/**
+ * Evaluate context expressions of snippet candidates in one call against a
+ * shared ContextSnippet, see eval_contexts of the runtime. Exceptions are
+ * reported by candidate.
+ */
+export async function evalPythonContexts(nvim: Neovim, candidates: ContextCandidate[], owner: number, limit = CONTEXT_LIMIT): Promise<ContextResult[]> {
+  if (candidates.length == 0) return []
+  let exprs = candidates.map(o => o.context)
+  let ids = exprs.map(expr => getExprId(expr))
+  await executeCompiledCode(nvim, exprs, arr => {
+    let args = {
+      owner,
+      limit,
+      candidates: candidates.map((o, i) => [o.id, ids[i], arr[i], profiling ? o.trigger ?? '' : null])
+    }
+    return ['import re, os, vim, string, random', `${results_var} = coc_ultisnips_dict["eval_contexts"](globals(), "${escapeString(JSON.stringify(args))}")`]
+  }, exprs, false, ids)
+  let res = await evalPythonExpr(nvim, results_var) as [boolean, string | null][]
+  return res.map(([active, error]) => error == null ? { active } : { active, error })
+}
+
+/**
+ * Evaluate vim expressions of `!v` blocks atomically by nvim_call_atomic,
+ * returns [value, error] of each expression. The calls stop at the first
+ * failed expression, the rest are sent again, so it's one request when no
+ * expression fails.
+ */
+export async function evalVimExprs(nvim: Neovim, exprs: string[]): Promise<[string, string | null][]> {
+  let results: [string, string | null][] = []
+  while (results.length < exprs.length) {
+    let [values, err] = await nvim.callAtomic(exprs.slice(results.length).map(expr => ['nvim_eval', [expr]]))
+    for (let value of values) {
+      results.push([value == null ? '' : value.toString(), null])
+    }
+    if (err) results.push(['', String(err[2])])
+  }
+  return results
+}
+
+/**
+ * Match regex triggers of snippets with python against the text before cursor
+ * in one call, by the python worker when configured, the match should end at
+ * the end of prefix. Invalid patterns never match.
+ */
+export async function matchPythonTriggers(nvim: Neovim, prefix: string, triggers: string[]): Promise<RegexTriggerMatch[]> {
+  if (triggers.length == 0) return []
+  let expr = `${triggers_var}.match("${escapeString(prefix)}", "${escapeString(JSON.stringify(triggers))}")`
+  let res = await evalPythonExpr(nvim, expr, pythonWorker != null) as [number, number, (string | null)[]][]
+  return res.map(([index, start, groups]) => ({ index, start, groups }))
+}
+
+/**
+ * Release compiled codes, tabstop values and contexts of the snippet ids of
+ * buffer owner, or all of owner when ids not provided. Compiled codes no
+ * longer used by other snippets are evicted.
+ */
+export async function releasePythonCodes(nvim: Neovim, owner: number, snippetIds?: string[]): Promise<void> {
+  let args = snippetIds ? `${owner}, ${JSON.stringify(snippetIds)}` : `${owner}`
+  const release = async (worker: boolean) => {
+    let ids = await evalPythonExpr(nvim, `${codes_var}.release(${args})`, worker) as string[]
+    let compiledIds = worker ? getWorker().compiled : compiledCodes
+    for (let id of ids) {
+      compiledIds.delete(id)
+    }
+    await evalPythonExpr(nvim, `[${tabstops_var}.release(${args}), ${contexts_var}.release(${args})]`, worker)
   }
-  return `t = (${vals.join(',')},)`
+  await release(false)
+  if (pythonWorker?.running) await release(true)
+}
+
+/**
+ * Enable or disable profiling of python code, records are kept on disable.
+ */
+export async function setPythonProfiling(nvim: Neovim, enable: boolean): Promise<void> {
+  profiling = enable
+  if (enable) return
+  await evalPythonExpr(nvim, `${profiler_var}.disable()`)
+  if (pythonWorker?.running) await evalPythonExpr(nvim, `${profiler_var}.disable()`, true)
+}
+
+/**
+ * Profile records of python runtime and worker, sorted by time.
+ */
+export async function getPythonProfile(nvim: Neovim, clear = false): Promise<ProfileRecord[]> {
+  let expr = `${profiler_var}.report(${clear ? 'True' : 'False'})`
+  let items = await evalPythonExpr(nvim, expr) as [string, string, string, number, number, number][]
+  if (pythonWorker?.running) items = items.concat(await evalPythonExpr(nvim, expr, true))
+  let records: Map<string, ProfileRecord> = new Map()
+  for (let [trigger, kind, id, count, time, vimCalls] of items) {
+    let key = `${trigger}\n${kind}\n${id}`
+    let record = records.get(key)
+    if (record) {
+      record.count += count
+      record.time += time
+      record.vimCalls += vimCalls
+    } else {
+      records.set(key, { trigger, kind, id, count, time, vimCalls, code: profiledCodes.get(id) })
+    }
+  }
+  if (clear) profiledCodes.clear()
+  return Array.from(records.values()).sort((a, b) => b.time - a.time)
+}
+
+/**
+ * Code to apply changes of tabstop values and set `t`.
+ */
+export function getTabstopsCode(changes: TabstopChanges): string {
+  return `${tabstops_var}.sync("${escapeString(JSON.stringify(changes))}", globals())`
 }
 
 /**
  * vim8 doesn't throw any python error with :py command
  * we have to use g:errmsg since v:errmsg can't be changed in python script.
+ * BaseException is caught for TimeBudgetExceeded of the runtime.
  */
 export function addPythonTryCatch(code: string, force = false): string {
   if (!isVim && force === false) return code
@@ -110,7 +467,7 @@ export function addPythonTryCatch(code: string, force = false): string {
     'try:',
   ]
   lines.push(...code.split('\n').map(line => '    ' + line))
-  lines.push('except Exception as e:')
+  lines.push('except BaseException as e:')
   lines.push(`    vim.vars['errmsg'] = traceback.format_exc()`)
   return lines.join('\n')
 }
@@ -7,21 +7,26 @@ import BufferSync from '../model/bufferSync'
 import { StatusBarItem } from '../model/status'
 import { UltiSnippetOption } from '../types'
 import { defaultValue, disposeAll } from '../util'
+import { onUnexpectedError } from '../util/errors'
 import { deepClone } from '../util/object'
 import { emptyRange, toValidRange } from '../util/position'
 import { Disposable } from '../util/protocol'
 import window from '../window'
 import workspace from '../workspace'
-import { executePythonCode, generateContextId, getInitialPythonCode, hasPython } from './eval'
-import { SnippetConfig, SnippetEdit, SnippetSession } from './session'
+import { CONTEXT_LIMIT, evalPythonContexts, executePythonBlock, executePythonCode, generateContextId, getInitialPythonCode, getPythonProfile, getSnippetTrigger, hasPython, isPythonProfiling, isWorkerContext, matchPythonTriggers, ProfileRecord, RegexTriggerMatch, releasePythonCodes, setPythonProfiling, setPythonTimeBudget, setPythonWorker } from './eval'
+import { SnippetParser } from './parser'
+import { SnippetConfig, SnippetEdit, SnippetInsert, SnippetSession } from './session'
+import { disposeShell, setShellOptions } from './shell'
 import { SnippetString } from './string'
-import { getAction, normalizeSnippetString, shouldFormat, SnippetFormatOptions, toSnippetString, UltiSnippetContext } from './util'
+import { AnonymousSnippet, getAction, normalizeSnippetString, shouldFormat, SnippetFormatOptions, toSnippetString, UltiSnippetContext } from './util'
 
 export class SnippetManager {
   private disposables: Disposable[] = []
   private _statusItem: StatusBarItem
   private bufferSync: BufferSync<SnippetSession>
   private config: SnippetConfig
+  // buffers with ultisnips contexts in the python runtime
+  private pythonBuffers: Set<number> = new Set()
   /**
    * @internal
    */
@@ -49,6 +54,9 @@ export class SnippetManager {
       let session = this.bufferSync.getItem(bufnr)
       if (session) await session.checkPosition()
     }, null, this.disposables)
+    events.on('BufUnload', bufnr => {
+      if (this.pythonBuffers.delete(bufnr)) releasePythonCodes(this.nvim, bufnr).catch(onUnexpectedError)
+    }, null, this.disposables)
 
     this.bufferSync = workspace.registerBufferSync(doc => {
       let session = new SnippetSession(this.nvim, doc, this.config)
@@ -85,6 +93,28 @@ export class SnippetManager {
         return await this.insertBufferSnippets(bufnr, edits, select)
       }
     }, true)
+    commands.register({
+      id: 'snippets.toggleProfiling',
+      execute: async () => {
+        let enable = !isPythonProfiling()
+        await setPythonProfiling(this.nvim, enable)
+        void window.showInformationMessage(`Profiling of snippet python code ${enable ? 'enabled' : 'disabled'}.`)
+        return enable
+      }
+    }, false, 'Toggle profiling of python code in UltiSnips snippets.')
+    commands.register({
+      id: 'snippets.showProfile',
+      execute: async (clear?: boolean) => {
+        let records = await getPythonProfile(this.nvim, clear === true)
+        let { size, hits, misses } = SnippetParser.templateStats
+        let channel = window.createOutputChannel('snippets')
+        channel.clear()
+        channel.appendLine(formatProfile(records))
+        channel.appendLine(`\nParsed snippet templates: ${size} cached, ${hits} hits, ${misses} misses`)
+        channel.show(true)
+        return records
+      }
+    }, false, 'Show profile of python code in UltiSnips snippets, sorted by time.')
   }
 
   private get nvim(): Neovim {
@@ -105,8 +135,16 @@ export class SnippetManager {
     let obj = {
       highlight: defaultValue(snippetConfig.inspect('highlight').globalValue, false) as boolean,
       nextOnDelete: defaultValue(snippetConfig.inspect('nextPlaceholderOnDelete').globalValue, false) as boolean,
-      preferComplete: suggest.get<boolean>('preferCompleteThanJumpPlaceholder', false)
+      preferComplete: suggest.get<boolean>('preferCompleteThanJumpPlaceholder', false),
+      contextLimit: snippetConfig.get<number>('ultisnipsContextLimit', CONTEXT_LIMIT),
+      updateDelay: snippetConfig.get<number>('ultisnipsUpdateDelay', 0)
     }
+    setPythonWorker(this.nvim, snippetConfig.get<string[]>('ultisnipsWorkerCommand', []))
+    setPythonTimeBudget(snippetConfig.get<number>('ultisnipsTimeBudget', 0))
+    setShellOptions({
+      cacheTTL: snippetConfig.get<number>('shellCacheTTL', 0),
+      persistent: snippetConfig.get<boolean>('shellPersistent', false)
+    })
     if (this.config) {
       Object.assign(this.config, obj)
     } else {
@@ -167,26 +205,14 @@ export class SnippetManager {
     const snippetStr = toSnippetString(snippet)
     const inserted = await this.normalizeInsertText(document.bufnr, snippetStr, currentLine, insertTextMode, ultisnip)
     if (ultisnip != null) {
-      const usePy = hasPython(ultisnip) || inserted.includes('`!p')
-      const bufnr = document.bufnr
-      context = Object.assign({ range: deepClone(range), line: currentLine }, ultisnip, { id: generateContextId(bufnr) })
-      if (usePy) {
-        if (session.placeholder) {
-          let { start, end } = session.placeholder.range
-          let last = {
-            current_text: session.placeholder.value,
-            start: { line: start.line, col: start.character },
-            end: { line: end.line, col: end.character }
-          }
-          this.nvim.setVar('coc_last_placeholder', last, true)
-        } else {
-          this.nvim.call('coc#compat#del_var', ['coc_last_placeholder'], true)
-        }
-        const codes = getInitialPythonCode(context)
+      const [ultiContext, codes] = this.createUltiSnipContext(session, document.bufnr, inserted, range, currentLine, ultisnip)
+      context = ultiContext
+      if (codes) {
         let preExpand = getAction(ultisnip, 'preExpand')
         if (preExpand) {
           nvim.call('coc#cursor#move_to', [range.end.line, range.end.character], true)
-          await executePythonCode(nvim, codes.concat(['snip = coc_ultisnips_dict["PreExpandContext"]()', preExpand]))
+          let profile = { trigger: getSnippetTrigger(context), kind: 'preExpand' }
+          await executePythonBlock(nvim, codes.concat(['snip = coc_ultisnips_dict["PreExpandContext"]()']), preExpand, context.id, false, profile)
           const [valid, pos] = await nvim.call('pyxeval', 'snip.getResult()') as [boolean, [number, number]]
           // need remove the trigger
           if (valid) {
@@ -197,7 +223,7 @@ export class SnippetManager {
             range = Range.create(pos[0], pos[1], pos[0], pos[1])
           }
         } else {
-          await executePythonCode(nvim, codes)
+          await executePythonCode(nvim, codes, codes, context.worker)
         }
       }
     }
@@ -222,6 +248,54 @@ export class SnippetManager {
     await session.start(inserted, range, select, context)
     return session.isActive
   }
+
+  /**
+   * Insert anonymous snippets expanded by python code of UltiSnips in order
+   * by one edit, only the placeholder of the last snippet is selected.
+   */
+  public async insertAnonymousSnippets(snippets: AnonymousSnippet[]): Promise<boolean> {
+    let { nvim } = workspace
+    let document = workspace.getAttachedDocument(workspace.bufnr)
+    const session = this.bufferSync.getItem(document.bufnr)
+    const items: SnippetInsert[] = []
+    await session.forceSynchronize()
+    session.cancel(true)
+    for (let snippet of snippets) {
+      const range = toValidRange(snippet.range)
+      const currentLine = document.getline(range.start.line)
+      const inserted = await this.normalizeInsertText(document.bufnr, toSnippetString(snippet.text), currentLine, undefined, {})
+      const [context, codes] = this.createUltiSnipContext(session, document.bufnr, inserted, range, currentLine, {})
+      if (codes) await executePythonCode(nvim, codes, codes, context.worker)
+      items.push({ inserted, range, context })
+    }
+    return await session.startBatch(items)
+  }
+
+  /**
+   * Create context of UltiSnips snippet, with initial python code when python
+   * is used by the snippet.
+   */
+  private createUltiSnipContext(session: SnippetSession, bufnr: number, inserted: string, range: Range, line: string, ultisnip: UltiSnippetOption): [UltiSnippetContext, string[] | undefined] {
+    const usePy = hasPython(ultisnip) || inserted.includes('`!p')
+    const context: UltiSnippetContext = Object.assign({ range: deepClone(range), line }, ultisnip, { id: generateContextId(bufnr) })
+    if (!usePy) return [context, undefined]
+    if (session.placeholder) {
+      let { start, end } = session.placeholder.range
+      let last = {
+        current_text: session.placeholder.value,
+        start: { line: start.line, col: start.character },
+        end: { line: end.line, col: end.character }
+      }
+      this.nvim.setVar('coc_last_placeholder', last, true)
+    } else {
+      this.nvim.call('coc#compat#del_var', ['coc_last_placeholder'], true)
+    }
+    const codes = getInitialPythonCode(context, this.config.contextLimit)
+    context.worker = isWorkerContext(context)
+    this.pythonBuffers.add(bufnr)
+    return [context, codes]
+  }
+
   /**
    * @internal
    */
@@ -287,6 +361,26 @@ export class SnippetManager {
     return session.placeholder != null && session.placeholder.index != 0
   }
 
+  /**
+   * Evaluate context expressions of UltiSnips snippets in one call for
+   * current buffer, active contexts are saved with contextId for expansion.
+   */
+  public async evaluateContexts(contexts: { context: string, trigger?: string }[]): Promise<{ active: boolean, contextId?: string, error?: string }[]> {
+    let bufnr = workspace.bufnr
+    let candidates = contexts.map(o => ({ id: generateContextId(bufnr), context: o.context, trigger: o.trigger }))
+    this.pythonBuffers.add(bufnr)
+    let results = await evalPythonContexts(this.nvim, candidates, bufnr, this.config.contextLimit)
+    return results.map((res, i) => res.active ? Object.assign({ contextId: candidates[i].id }, res) : res)
+  }
+
+  /**
+   * Match regex triggers of UltiSnips snippets with python against the text
+   * before cursor in one call, requires the UltiSnips python runtime.
+   */
+  public async matchRegexTriggers(prefix: string, triggers: string[]): Promise<RegexTriggerMatch[]> {
+    return await matchPythonTriggers(this.nvim, prefix, triggers)
+  }
+
   /**
    * Exposed for snippet preview
    */
@@ -320,8 +414,23 @@ export class SnippetManager {
 
   public dispose(): void {
     this.cancel()
+    setPythonWorker(this.nvim, undefined)
+    disposeShell()
     disposeAll(this.disposables)
   }
 }
 
+/**
+ * Report of profile records for output channel.
+ */
+export function formatProfile(records: ProfileRecord[]): string {
+  if (records.length === 0) return 'No profile of snippet python code, run snippets.toggleProfiling first.'
+  let lines = ['time(ms)    count  vim calls  trigger / kind / id / code']
+  for (let record of records) {
+    let { time, count, vimCalls, trigger, kind, id, code } = record
+    lines.push(`${time.toFixed(3).padStart(8)} ${String(count).padStart(8)} ${String(vimCalls).padStart(10)}  ${trigger} / ${kind} / ${id} / ${code ?? ''}`)
+  }
+  return lines.join('\n')
+}
+
 export default new SnippetManager()
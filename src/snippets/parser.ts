@@ -1,20 +1,24 @@
 'use strict'
 import { Neovim } from '@chemzqm/neovim'
-import { exec, ExecOptions } from 'child_process'
 import { CancellationToken } from 'vscode-languageserver-protocol'
 import { createLogger } from '../logger'
 import { groupBy } from '../util/array'
-import { runSequence } from '../util/async'
 import { CharCode } from '../util/charCode'
 import { onUnexpectedError } from '../util/errors'
-import { promisify, unidecode } from '../util/node'
+import { LRUCache } from '../util/map'
+import { unidecode } from '../util/node'
 import { iterateCharacter, toText } from '../util/string'
-import { escapeString, EvalKind, executePythonCode, getVariablesCode } from './eval'
+import { escapeString, EvalKind, evalPythonBlocks, evalPythonExpr, evalVimExprs, executePythonBlock, getProfileTrigger, getSnippetTrigger, PythonBlockArgs, TabstopChanges } from './eval'
+import { evalShellCommand } from './shell'
 import { convertRegex, UltiSnippetContext } from './util'
 const logger = createLogger('snippets-parser')
 const ULTISNIP_VARIABLES = ['VISUAL', 'YANK', 'UUID']
 let id = 0
 let snippet_id = 0
+// max evaluations of python block when tabstops changed
+const MAX_PY_ITERATIONS = 10
+// max count of parsed snippets cached by SnippetParser.parseCached()
+const TEMPLATE_CACHE_SIZE = 500
 
 const knownRegexOptions = ['d', 'g', 'i', 'm', 's', 'u', 'y']
 const ultisnipSpecialEscape = ['u', 'l', 'U', 'L', 'E', 'n', 't']
@@ -281,6 +285,16 @@ export class CodeBlock extends Marker {
     if (typeof value === 'string') this._value = value
   }
 
+  /**
+   * Result of python block only depends on the values of related tabstops
+   * and the current text, when `t` is only indexed by numbers and the code
+   * has no `# impure` comment, the runtime checks the names used by the code.
+   */
+  public get memoizable(): boolean {
+    if (this.kind !== 'python') return false
+    return !/\bt\b(?!\[\d+\])/.test(this.code) && !/^\s*#\s*impure\s*$/m.test(this.code)
+  }
+
   public static parseRelated(code: string): number[] {
     let list: number[] = []
     let arr
@@ -321,10 +335,7 @@ export class CodeBlock extends Marker {
   }
 
   public async evalShell(): Promise<string> {
-    let opts: ExecOptions = { windowsHide: true }
-    Object.assign(opts, { shell: process.env.SHELL })
-    let res = await promisify(exec)(this.code, opts)
-    return res.stdout.toString().replace(/\s*$/, '')
+    return await evalShellCommand(this.code)
   }
 
   public async evalVim(nvim: Neovim): Promise<string> {
@@ -334,11 +345,18 @@ export class CodeBlock extends Marker {
 
   public async evalPython(nvim: Neovim, token?: CancellationToken): Promise<string> {
     let curr = toText(this._value)
-    let lines = [`snip._reset("${escapeString(curr)}")`]
-    lines.push(...this.code.split(/\r?\n/).map(line => line.replace(/\t/g, '    ')))
-    await executePythonCode(nvim, lines)
+    let context = this.snippet?.related.context
+    let profile = { trigger: getSnippetTrigger(context), kind: 'block' }
+    await executePythonBlock(nvim, [`snip._reset("${escapeString(curr)}")`], this.pythonCode, this.snippet?.pythonId ?? 0, context?.worker, profile)
     if (token?.isCancellationRequested) return
-    return await nvim.call(`pyxeval`, 'str(snip.rv)') as string
+    return await evalPythonExpr(nvim, 'str(snip.rv)', context?.worker) as string
+  }
+
+  /**
+   * Python code with tabs replaced.
+   */
+  public get pythonCode(): string {
+    return this.code.split(/\r?\n/).map(line => line.replace(/\t/g, '    ')).join('\n')
   }
 
   public len(): number {
@@ -353,6 +371,10 @@ export class CodeBlock extends Marker {
     return this._value
   }
 
+  public set value(val: string) {
+    this._value = val
+  }
+
   public toTextmateString(): string {
     let t = ''
     if (this.kind == 'python') {
@@ -468,7 +490,7 @@ export class Choice extends Marker {
   public clone(): Choice {
     let ret = new Choice(this._index)
     for (let opt of this.options) {
-      ret.appendChild(opt)
+      ret.appendChild(opt.clone())
     }
     return ret
   }
@@ -774,12 +796,22 @@ export class TextmateSnippet extends Marker {
   public readonly ultisnip: boolean
   public readonly id: number
   public readonly related: { codes?: string[], context?: UltiSnippetContext } = {}
+  // tabstop values synchronized to the python runtime
+  private _tabstops: string[] | undefined
   constructor(ultisnip?: boolean, id?: number) {
     super()
     this.ultisnip = ultisnip === true
     this.id = id ?? snippet_id++
   }
 
+  /**
+   * Id of the snippet by the python runtime, which owns tabstop values and
+   * compiled codes of the snippet, 0-id for snippet without context.
+   */
+  public get pythonId(): string {
+    return this.related.context?.id ?? `0-${this.id}`
+  }
+
   public get hasPythonBlock(): boolean {
     if (!this.ultisnip) return false
     return this.pyBlocks.length > 0
@@ -809,72 +841,131 @@ export class TextmateSnippet extends Marker {
     return values
   }
 
-  public get orderedPyIndexBlocks(): CodeBlock[] {
-    let res: CodeBlock[] = []
-    let filtered = this.pyBlocks.filter(o => typeof o.index === 'number')
-    if (filtered.length === 0) return res
-    let allIndexes = filtered.map(o => o.index)
-    let usedIndexes: number[] = []
-    const checkBlock = (b: CodeBlock): boolean => {
-      let { related } = b
-      if (related.length == 0
-        || related.every(idx => !allIndexes.includes(idx) || usedIndexes.includes(idx))) {
-        usedIndexes.push(b.index)
-        res.push(b)
-        return true
-      }
-      return false
-    }
-    while (filtered.length > 0) {
-      let c = false
-      for (let b of filtered) {
-        if (checkBlock(b)) {
-          c = true
-        }
-      }
-      if (!c) {
-        // recursive dependencies detected
-        break
-      }
-      filtered = filtered.filter(o => !usedIndexes.includes(o.index))
-    }
-    return res
+  /**
+   * Python blocks of placeholders which use values of tabstops.
+   */
+  public get pyIndexBlocks(): CodeBlock[] {
+    return this.pyBlocks.filter(o => typeof o.index === 'number' && o.related.length > 0)
   }
 
   public async evalCodeBlocks(nvim: Neovim, pyCodes: string[]): Promise<void> {
     const { pyBlocks, otherBlocks } = this.placeholderInfo
-    // update none python blocks
-    await Promise.all(otherBlocks.map(block => {
-      let pre = block.value
-      return block.resolve(nvim).then(() => {
-        if (block.parent instanceof Placeholder && pre !== block.value) {
-          // update placeholder with same index
-          this.onPlaceholderUpdate(block.parent)
-        }
-      })
-    }))
+    const update = (block: CodeBlock, pre: string) => {
+      if (block.parent instanceof Placeholder && pre !== block.value) {
+        // update placeholder with same index
+        this.onPlaceholderUpdate(block.parent)
+      }
+    }
+    let vimBlocks = otherBlocks.filter(block => block.kind == 'vim' && block.code.length > 0)
+    // update none python blocks, vim blocks are evaluated in one call.
+    await Promise.all([
+      ...otherBlocks.filter(block => !vimBlocks.includes(block)).map(block => {
+        let pre = block.value
+        return block.resolve(nvim).then(() => update(block, pre))
+      }),
+      this.evalVimBlocks(nvim, vimBlocks, update)
+    ])
     if (pyCodes.length === 0) return
     // update normal python block with related.
     let relatedBlocks = pyBlocks.filter(o => o.index === undefined && o.related.length > 0)
-    // run all python code by sequence
-    const variableCode = getVariablesCode(this.values)
-    await executePythonCode(nvim, [...pyCodes, variableCode])
-    for (let block of pyBlocks) {
+    await this.evalPythonBlocks(nvim, pyCodes, {
+      order: pyBlocks.filter(o => !relatedBlocks.includes(o)),
+      schedule: this.pyIndexBlocks,
+      after: relatedBlocks
+    })
+  }
+
+  /**
+   * Evaluate vim blocks by one request, the first error is thrown after
+   * values of other blocks updated.
+   */
+  private async evalVimBlocks(nvim: Neovim, blocks: CodeBlock[], update: (block: CodeBlock, pre: string) => void): Promise<void> {
+    if (blocks.length == 0) return
+    let results = await evalVimExprs(nvim, blocks.map(block => block.code))
+    let errors: string[] = []
+    results.forEach(([value, error], i) => {
+      let block = blocks[i]
+      if (error != null) {
+        errors.push(`Error on eval vim block \`!v ${block.code}\`: ${error}`)
+        return
+      }
       let pre = block.value
-      if (relatedBlocks.includes(block)) continue
-      await block.resolve(nvim)
-      if (pre === block.value) continue
+      block.value = value
+      update(block, pre)
+    })
+    if (errors.length > 0) throw new Error(errors[0])
+  }
+
+  /**
+   * Evaluate python blocks in one call, values of placeholders are updated by
+   * the runtime when a block changed. Blocks of schedule are evaluated by
+   * dependencies when tabstops of related changed.
+   */
+  private async evalPythonBlocks(nvim: Neovim, codes: string[], groups: { order?: CodeBlock[], schedule?: CodeBlock[], after?: CodeBlock[] }, token?: CancellationToken): Promise<void> {
+    const filter = (arr: CodeBlock[] | undefined) => (arr ?? []).filter(block => block.code.length > 0)
+    let order = filter(groups.order)
+    let schedule = filter(groups.schedule)
+    let after = filter(groups.after)
+    let blocks = Array.from(new Set([...order, ...schedule, ...after]))
+    let placeholders = this.placeholders
+    let templates: PythonBlockArgs['templates'] = {}
+    const addTemplate = (p: Placeholder) => {
+      templates[p.index] = p.children.map(child => {
+        if (child instanceof CodeBlock && blocks.includes(child)) return blocks.indexOf(child)
+        if (child instanceof Placeholder && !child.transform) return [child.index] as [number]
+        return child.toString()
+      })
+    }
+    let indexes = new Set<number>()
+    for (let block of blocks) {
       if (block.parent instanceof Placeholder) {
-        // update placeholder with same index
-        this.onPlaceholderUpdate(block.parent)
-        await executePythonCode(nvim, [getVariablesCode(this.values)])
+        addTemplate(block.parent)
+        indexes.add(block.index)
+      }
+    }
+    // parents of placeholders with blocks.
+    for (let index of indexes) {
+      for (let p of placeholders) {
+        if (p.index !== index || !(p.parent instanceof Placeholder) || indexes.has(p.parent.index)) continue
+        addTemplate(p.parent)
+        indexes.add(p.parent.index)
       }
     }
-    for (let block of this.orderedPyIndexBlocks) {
-      await this.updatePyIndexBlock(nvim, block)
+    const positions = (arr: CodeBlock[]) => arr.map(block => blocks.indexOf(block))
+    let results = await this.syncTabstops(tabstops => {
+      let args: PythonBlockArgs = {
+        codes: blocks.map(block => block.pythonCode),
+        current: blocks.map(block => block.value),
+        related: blocks.map(block => block.related),
+        memo: blocks.map(block => block.memoizable),
+        order: positions(order),
+        schedule: positions(schedule),
+        after: positions(after),
+        limit: MAX_PY_ITERATIONS,
+        tabstops,
+        templates,
+        trigger: getProfileTrigger(this.related.context),
+      }
+      let { context } = this.related
+      return evalPythonBlocks(nvim, codes, args, this.pythonId, context?.worker, getSnippetTrigger(context))
+    })
+    for (let [index, value] of Object.entries(results.values)) {
+      this._tabstops[Number(index)] = value
     }
-    for (let block of relatedBlocks) {
-      await block.resolve(nvim)
+    if (results.truncated) {
+      let cycles = results.cycles.map(pos => blocks[pos].code)
+      logger.warn(`Python blocks not stable after evaluated ${MAX_PY_ITERATIONS} times:`, cycles)
+    }
+    if (token?.isCancellationRequested) return
+    let changed: Set<Placeholder> = new Set()
+    for (let [pos, rv] of Object.entries(results.blocks)) {
+      let block = blocks[Number(pos)]
+      block.value = rv
+      if (block.parent instanceof Placeholder) changed.add(block.parent)
+    }
+    for (let p of changed) {
+      // update placeholder with same index
+      this.onPlaceholderUpdate(p)
     }
   }
 
@@ -882,52 +973,41 @@ export class TextmateSnippet extends Marker {
    * Update python blocks after user change Placeholder with index
    */
   public async updatePythonCodes(nvim: Neovim, marker: Placeholder, codes: string[], token: CancellationToken): Promise<void> {
-    let index = marker.index
-    // update related placeholders
-    let blocks = this.getDependentPyIndexBlocks(index)
-    await runSequence([async () => {
-      await executePythonCode(nvim, [...codes, getVariablesCode(this.values)])
-    }, async () => {
-      for (let block of blocks) {
-        await this.updatePyIndexBlock(nvim, block, token)
-      }
-    }, async () => {
+    if (token.isCancellationRequested) return
+    // blocks related to changed tabstops are evaluated by dependencies.
+    await this.evalPythonBlocks(nvim, codes, {
+      schedule: this.pyIndexBlocks,
       // update normal pyBlocks.
-      let filtered = this.pyBlocks.filter(o => o.index === undefined && o.related.length > 0)
-      for (let block of filtered) {
-        await block.resolve(nvim, token)
-      }
-    }], token)
-  }
-
-  private getDependentPyIndexBlocks(index: number): CodeBlock[] {
-    const res: CodeBlock[] = []
-    const taken: number[] = []
-    let filtered = this.pyBlocks.filter(o => typeof o.index === 'number')
-    const search = (idx: number) => {
-      let blocks = filtered.filter(o => !taken.includes(o.index) && o.related.includes(idx))
-      if (blocks.length > 0) {
-        res.push(...blocks)
-        blocks.forEach(b => {
-          search(b.index)
-        })
-      }
-    }
-    search(index)
-    return res
+      after: this.pyBlocks.filter(o => o.index === undefined && o.related.length > 0)
+    }, token)
   }
 
   /**
-   * Update single index block
+   * Run fn with changes of tabstop values since last synchronized, all values
+   * are sent when the runtime doesn't have values of the snippet.
    */
-  private async updatePyIndexBlock(nvim: Neovim, block: CodeBlock, token?: CancellationToken): Promise<void> {
-    let pre = block.value
-    await block.resolve(nvim, token)
-    if (pre === block.value || token?.isCancellationRequested) return
-    if (block.parent instanceof Placeholder) {
-      this.onPlaceholderUpdate(block.parent)
+  private async syncTabstops<T>(fn: (changes: TabstopChanges) => Promise<T>): Promise<T> {
+    let values = Object.values(this.values)
+    let id = this.pythonId
+    const run = async (): Promise<T> => {
+      let prev = this._tabstops
+      let deltas: { [index: number]: string } = {}
+      values.forEach((val, i) => {
+        if (prev?.[i] !== val) deltas[i] = val
+      })
+      // values of the runtime are unknown on error
+      this._tabstops = undefined
+      let res = await fn({ id, size: values.length, deltas, reset: prev === undefined })
+      this._tabstops = values
+      return res
+    }
+    try {
+      return await run()
+    } catch (e: any) {
+      // the runtime could be reloaded.
+      if (!/Unknown tabstops/.test(e.message)) throw e
+      return await run()
     }
-    await executePythonCode(nvim, [getVariablesCode(this.values)])
   }
 
   public get placeholderInfo(): PlaceholderInfo {
@@ -1153,8 +1233,11 @@ export class TextmateSnippet extends Marker {
     return this.children.reduce((prev, cur) => prev + cur.toTextmateString(), '')
   }
 
-  public clone(): TextmateSnippet {
-    let ret = new TextmateSnippet(this.ultisnip, this.id)
+  /**
+   * Clone the snippet, with new id when keepId is false.
+   */
+  public clone(keepId = true): TextmateSnippet {
+    let ret = new TextmateSnippet(this.ultisnip, keepId ? this.id : undefined)
     ret.related.codes = this.related.codes
     ret.related.context = this.related.context
     ret._children = this.children.map(child => {
@@ -1170,10 +1253,30 @@ export class TextmateSnippet extends Marker {
   }
 }
 
+export interface TemplateCacheStats {
+  hits: number
+  misses: number
+  size: number
+}
+
 export class SnippetParser {
+  // parsed snippets by options and text, never modified
+  private static templates: LRUCache<string, TextmateSnippet> = new LRUCache(TEMPLATE_CACHE_SIZE)
+  private static hits = 0
+  private static misses = 0
+
   constructor(private ultisnip?: boolean) {
   }
 
+  public static get templateStats(): TemplateCacheStats {
+    return { hits: SnippetParser.hits, misses: SnippetParser.misses, size: SnippetParser.templates.size }
+  }
+
+  public static clearTemplates(): void {
+    SnippetParser.templates.clear()
+    SnippetParser.hits = SnippetParser.misses = 0
+  }
+
   public static escape(value: string): string {
     return value.replace(/\$|}|\\/g, '\\$&')
   }
@@ -1190,6 +1293,23 @@ export class SnippetParser {
     return this.parse(value, false).toString()
   }
 
+  /**
+   * Parse snippet like parse(), the parsed snippet is cached as template by
+   * text and options, returns a clone of the template with new id.
+   */
+  public parseCached(value: string, insertFinalTabstop?: boolean): TextmateSnippet {
+    let key = `${this.ultisnip ? 1 : 0}${insertFinalTabstop ? 1 : 0}${value}`
+    let template = SnippetParser.templates.get(key)
+    if (template) {
+      SnippetParser.hits++
+    } else {
+      SnippetParser.misses++
+      template = this.parse(value, insertFinalTabstop)
+      SnippetParser.templates.set(key, template)
+    }
+    return template.clone(false)
+  }
+
   public parse(value: string, insertFinalTabstop?: boolean): TextmateSnippet {
 
     this._scanner.text(value)
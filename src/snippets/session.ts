@@ -6,7 +6,7 @@ import { createLogger } from '../logger'
 import Document from '../model/document'
 import { LinesTextDocument } from '../model/textdocument'
 import { DidChangeTextDocumentParams, JumpInfo, TextDocumentContentChange, UltiSnippetOption } from '../types'
-import { defaultValue, waitNextTick } from '../util'
+import { defaultValue, wait, waitNextTick } from '../util'
 import { getTextEdit } from '../util/diff'
 import { onUnexpectedError } from '../util/errors'
 import { omit } from '../util/lodash'
@@ -15,10 +15,10 @@ import { equals } from '../util/object'
 import { comparePosition, emptyRange, getEnd, positionInRange, rangeInRange } from '../util/position'
 import { CancellationTokenSource, Emitter, Event } from '../util/protocol'
 import { byteIndex } from '../util/string'
-import { filterSortEdits, reduceTextEdit } from '../util/textedit'
+import { applyEdits, filterSortEdits, getPositionFromEdits, reduceTextEdit } from '../util/textedit'
 import window from '../window'
 import workspace from '../workspace'
-import { executePythonCode, generateContextId, getInitialPythonCode } from './eval'
+import { executePythonBlock, executePythonCode, generateContextId, getInitialPythonCode, getSnippetTrigger, isWorkerContext, releasePythonCodes } from './eval'
 import { getPlaceholderId, Placeholder, SnippetParser, Text, TextmateSnippet } from './parser'
 import { CocSnippet, CocSnippetPlaceholder, getNextPlaceholder, getUltiSnipActionCodes } from "./snippet"
 import { SnippetString } from './string'
@@ -37,10 +37,19 @@ export interface SnippetEdit {
   snippet: string | SnippetString | StringValue
 }
 
+export interface SnippetInsert {
+  inserted: string
+  range: Range
+  context?: UltiSnippetContext
+}
+
 export interface SnippetConfig {
   readonly highlight: boolean
   readonly nextOnDelete: boolean
   readonly preferComplete: boolean
+  readonly contextLimit: number
+  // milliseconds to wait before synchronize changes of snippets with python code
+  readonly updateDelay: number
 }
 
 export class SnippetSession {
@@ -48,11 +57,16 @@ export class SnippetSession {
   private current: Placeholder
   private textDocument: LinesTextDocument
   private tokenSource: CancellationTokenSource
+  // synchronize waiting to run, later changes are merged into it
+  private _pendingSync: Promise<void> | undefined
+  private _pendingChange: DocumentChange | undefined
   private _applying = false
   private _paused = false
   public snippet: CocSnippet = null
   private _onActiveChange = new Emitter<boolean>()
   private _selected = false
+  // post jump action in progress
+  private _postJump: Promise<void> | undefined
   public readonly onActiveChange: Event<boolean> = this._onActiveChange.event
 
   constructor(
@@ -188,40 +202,11 @@ export class SnippetSession {
   }
 
   public async start(inserted: string, range: Range, select = true, context?: UltiSnippetContext): Promise<boolean> {
-    let { document, snippet } = this
     this._paused = false
-    const edits: TextEdit[] = []
-    let textmateSnippet: TextmateSnippet
     if (inserted.length === 0) return this.isActive
-    if (snippet && this.canNestSnippet(range, snippet)) {
-      // update all snippet.
-      let oldRange = snippet.range
-      let previous = snippet.text
-      textmateSnippet = await this.snippet.replaceWithSnippet(range, inserted, this.current, context)
-      let edit = reduceTextEdit({
-        range: oldRange,
-        newText: this.snippet.text
-      }, previous)
-      edits.push(edit)
-    } else {
-      this.deactivate()
-      const resolver = new SnippetVariableResolver(this.nvim, workspace.workspaceFolderControl)
-      snippet = new CocSnippet(inserted, range.start, this.nvim, resolver)
-      await snippet.init(context)
-      textmateSnippet = snippet.tmSnippet
-      edits.push(TextEdit.replace(range, snippet.text))
-      // try fix indent of text after snippet when insert new line
-      if (inserted.replace(/\$0$/, '').endsWith('\n')) {
-        const currentLine = document.getline(range.start.line)
-        const remain = currentLine.slice(range.end.character)
-        if (remain.length) {
-          let s = range.end.character
-          let l = remain.match(/^\s*/)[0].length
-          let r = Range.create(range.end.line, s, range.end.line, s + l)
-          edits.push(TextEdit.replace(r, currentLine.match(/^\s*/)[0]))
-        }
-      }
-    }
+    if (this.snippet && !this.canNestSnippet(range, this.snippet, this.current)) this.deactivate()
+    let lines = this.document.textDocument.lines
+    let [snippet, textmateSnippet, edits] = await this.prepareInsert(lines, inserted, range, this.snippet, this.current, context)
     this.current = textmateSnippet.first
     this.nvim.call('coc#compat#del_var', ['coc_selected_text'], true)
     await this.applyEdits(edits)
@@ -233,8 +218,83 @@ export class SnippetSession {
     return this.isActive
   }
 
-  private canNestSnippet(range: Range, snippet: CocSnippet): boolean {
-    let placeholder = this.placeholder
+  /**
+   * Insert snippets in order by one edit, the range of each snippet is
+   * relative to the original text, it's shifted by the edits of previous
+   * snippets before insert.
+   */
+  public async startBatch(items: SnippetInsert[], select = true): Promise<boolean> {
+    const textDocument = this.document.textDocument
+    const { uri, languageId, version, bufnr, eol } = textDocument
+    let lines = textDocument.lines
+    let snippet = this.snippet
+    let current = this.current
+    let expanded: TextmateSnippet[] = []
+    let changes: TextEdit[][] = []
+    for (let item of items) {
+      if (item.inserted.length === 0) continue
+      let range = changes.reduce((r, edits) => shiftRange(r, edits), item.range)
+      let [next, textmateSnippet, edits] = await this.prepareInsert(lines, item.inserted, range, snippet, current, item.context)
+      changes.push(edits)
+      if (next !== snippet && snippet && snippet !== this.snippet) this.releaseSnippet(snippet)
+      let doc = new LinesTextDocument(uri, languageId, version, lines, bufnr, eol)
+      lines = applyEdits(doc, edits) ?? lines
+      snippet = next
+      current = textmateSnippet.first
+      if (item.context) expanded.push(textmateSnippet)
+    }
+    this._paused = false
+    if (snippet === this.snippet && current === this.current) return this.isActive
+    if (snippet !== this.snippet) this.deactivate()
+    this.current = current
+    this.nvim.call('coc#compat#del_var', ['coc_selected_text'], true)
+    let edit = getTextEdit(textDocument.lines, lines)
+    if (edit) await this.applyEdits([edit])
+    this.activate(snippet)
+    for (let textmateSnippet of expanded) {
+      await this.tryPostExpand(textmateSnippet)
+    }
+    let { placeholder } = this
+    if (select && placeholder) await this.selectPlaceholder(placeholder, true)
+    return this.isActive
+  }
+
+  /**
+   * Create the snippet and the edits to insert text of snippet to range of
+   * lines, the snippet is nested when range is inside current placeholder.
+   */
+  private async prepareInsert(lines: ReadonlyArray<string>, inserted: string, range: Range, snippet: CocSnippet | null, current: Placeholder | null, context?: UltiSnippetContext): Promise<[CocSnippet, TextmateSnippet, TextEdit[]]> {
+    if (snippet && this.canNestSnippet(range, snippet, current)) {
+      // update all snippet.
+      let oldRange = snippet.range
+      let previous = snippet.text
+      let textmateSnippet = await snippet.replaceWithSnippet(range, inserted, current, context)
+      let edit = reduceTextEdit({
+        range: oldRange,
+        newText: snippet.text
+      }, previous)
+      return [snippet, textmateSnippet, [edit]]
+    }
+    const resolver = new SnippetVariableResolver(this.nvim, workspace.workspaceFolderControl)
+    snippet = new CocSnippet(inserted, range.start, this.nvim, resolver)
+    await snippet.init(context)
+    const edits: TextEdit[] = [TextEdit.replace(range, snippet.text)]
+    // try fix indent of text after snippet when insert new line
+    if (inserted.replace(/\$0$/, '').endsWith('\n')) {
+      const currentLine = lines[range.start.line] ?? ''
+      const remain = currentLine.slice(range.end.character)
+      if (remain.length) {
+        let s = range.end.character
+        let l = remain.match(/^\s*/)[0].length
+        let r = Range.create(range.end.line, s, range.end.line, s + l)
+        edits.push(TextEdit.replace(r, currentLine.match(/^\s*/)[0]))
+      }
+    }
+    return [snippet, snippet.tmSnippet, edits]
+  }
+
+  private canNestSnippet(range: Range, snippet: CocSnippet, current: Placeholder | null): boolean {
+    let placeholder = current ? snippet.getPlaceholderByMarker(current) : undefined
     return !!placeholder && rangeInRange(range, snippet.range) && rangeInRange(range, placeholder.range)
   }
 
@@ -244,21 +304,22 @@ export class SnippetSession {
     const { start, end } = this.snippet.range
     const [code, resetCodes] = result
     let pos = `[${start.line},${start.character},${end.line},${end.character}]`
-    let codes = [...resetCodes, `snip = coc_ultisnips_dict["PostExpandContext"](${pos})`, code]
+    let codes = [...resetCodes, `snip = coc_ultisnips_dict["PostExpandContext"](${pos})`]
     this.cancel()
-    await executePythonCode(this.nvim, codes)
+    let trigger = getSnippetTrigger(textmateSnippet.related.context)
+    await executePythonBlock(this.nvim, codes, code, textmateSnippet.pythonId, false, { trigger, kind: 'postExpand' })
     await this.forceSynchronize()
   }
 
-  private async tryPostJump(code: string, resetCodes: string[], info: JumpInfo, bufnr: number): Promise<void> {
+  private async tryPostJump(code: string, resetCodes: string[], info: JumpInfo, bufnr: number, owner: number | string, trigger?: string): Promise<void> {
     // make events.requesting = false
     await waitNextTick()
     this.nvim.setVar('coc_ultisnips_tabstops', info.tabstops, true)
     const { snippet_start, snippet_end } = info
     let pos = `[${snippet_start.line},${snippet_start.character},${snippet_end.line},${snippet_end.character}]`
-    let codes = [...resetCodes, `snip = coc_ultisnips_dict["PostJumpContext"](${pos},${info.index},${info.forward ? 1 : 0})`, code]
+    let codes = [...resetCodes, `snip = coc_ultisnips_dict["PostJumpContext"](${pos},${info.index},${info.forward ? 1 : 0})`]
     this.cancel()
-    await executePythonCode(this.nvim, codes)
+    await executePythonBlock(this.nvim, codes, code, owner, false, { trigger, kind: 'postJump' })
     await this.forceSynchronize()
     void events.fire('PlaceholderJump', [bufnr, info])
   }
@@ -340,7 +401,10 @@ export class SnippetSession {
     }
     let result = getUltiSnipActionCodes(marker, 'postJump')
     if (result) {
-      this.tryPostJump(result[0], result[1], info, document.bufnr).catch(onUnexpectedError)
+      let trigger = getSnippetTrigger(marker.snippet?.related.context)
+      let promise = this._postJump = this.tryPostJump(result[0], result[1], info, document.bufnr, marker.snippet?.pythonId ?? 0, trigger).catch(onUnexpectedError).finally(() => {
+        if (this._postJump === promise) this._postJump = undefined
+      })
     } else {
       void events.fire('PlaceholderJump', [document.bufnr, info])
     }
@@ -407,11 +471,22 @@ export class SnippetSession {
     this.synchronize({ version: e.textDocument.version, change: changes[0] }).catch(onUnexpectedError)
   }
 
+  /**
+   * Synchronize document changes to the snippet, latest wins: changes made
+   * before a waiting synchronize started are merged into it, so stale states
+   * are never evaluated.
+   */
   public async synchronize(change?: DocumentChange): Promise<void> {
     const { document, isActive } = this
     this._paused = false
     if (!isActive) return
-    await this.mutex.use(() => {
+    this._pendingChange = change
+    if (this._pendingSync) return await this._pendingSync
+    let delay = change && this.config.updateDelay > 0 && this.snippet.hasPython ? this.config.updateDelay : 0
+    let promise = this._pendingSync = wait(delay).then(() => this.mutex.use(() => {
+      this._pendingSync = undefined
+      let change = this._pendingChange
+      this._pendingChange = undefined
       if (!document.attached
         || document.dirty
         || !this.snippet
@@ -422,7 +497,8 @@ export class SnippetSession {
         change = undefined
       }
       return this._synchronize(change)
-    })
+    }))
+    await promise
   }
 
   public async _synchronize(documentChange?: DocumentChange): Promise<void> {
@@ -579,6 +655,7 @@ export class SnippetSession {
   public deactivate(): void {
     this.cancel()
     if (!this.isActive) return
+    this.releaseSnippet(this.snippet)
     this.snippet = null
     this.current = null
     this.nvim.call('coc#snippet#disable', [this.bufnr], true)
@@ -587,6 +664,19 @@ export class SnippetSession {
     logger.debug(`session ${this.bufnr} deactivate`)
   }
 
+  private releaseSnippet(snippet: CocSnippet): void {
+    if (!snippet.hasPython) return
+    const { nvim, bufnr } = this
+    const ids = snippet.snippets.map(o => o.pythonId)
+    const release = () => releasePythonCodes(nvim, bufnr, ids).catch(onUnexpectedError)
+    // the context is used by post jump action.
+    if (this._postJump) {
+      void this._postJump.then(release)
+    } else {
+      void release()
+    }
+  }
+
   public get placeholder(): CocSnippetPlaceholder | undefined {
     if (!this.snippet || !this.current) return undefined
     return this.snippet.getPlaceholderByMarker(this.current)
@@ -620,7 +710,9 @@ export class SnippetSession {
         line: ''
       }, ultisnip, { id: generateContextId(events.bufnr) })
       if (ultisnip.noPython !== true && snippetString.includes('`!p')) {
-        await executePythonCode(nvim, getInitialPythonCode(context))
+        const codes = getInitialPythonCode(context, this.config.contextLimit)
+        context.worker = isWorkerContext(context)
+        await executePythonCode(nvim, codes, codes, context.worker)
       }
     }
     const resolver = new SnippetVariableResolver(nvim, workspace.workspaceFolderControl)
@@ -629,3 +721,18 @@ export class SnippetSession {
     return snippet.text
   }
 }
+
+/**
+ * Shift range of the original text by sorted edits, position inside replaced
+ * range is moved to the end of the replacement.
+ */
+export function shiftRange(range: Range, edits: TextEdit[]): Range {
+  const shift = (position: Position): Position => {
+    for (let edit of edits) {
+      let { start, end } = edit.range
+      if (comparePosition(position, start) >= 0 && comparePosition(position, end) < 0) position = end
+    }
+    return getPositionFromEdits(position, edits)
+  }
+  return Range.create(shift(range.start), shift(range.end))
+}
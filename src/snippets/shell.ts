@@ -0,0 +1,211 @@
+'use strict'
+import type { ChildProcess, ExecOptions } from 'child_process'
+import { createLogger } from '../logger'
+import { Mutex } from '../util/mutex'
+import { child_process, crypto, path, promisify } from '../util/node'
+import { isWindows } from '../util/platform'
+import { terminate } from '../util/processes'
+const logger = createLogger('snippets-shell')
+
+// shells which could run commands from stdin with POSIX syntax
+const POSIX_SHELLS = ['sh', 'bash', 'zsh', 'dash', 'ksh', 'mksh']
+// max count of cached results
+const CACHE_SIZE = 100
+// milliseconds before a command of the long-lived shell is killed
+export const SHELL_TIMEOUT = 5000
+
+export interface ShellOptions {
+  // milliseconds to keep results of commands, 0 to disable
+  cacheTTL: number
+  // run commands by a long-lived shell process
+  persistent: boolean
+}
+
+interface CacheItem {
+  expires: number
+  value: Promise<string>
+}
+
+/**
+ * Long-lived shell process run commands one by one, output of a command is
+ * delimited by a marker line with exit status. A command running longer than
+ * timeout is rejected and the shell is killed, a new shell is started for the
+ * next command.
+ */
+export class ShellProcess {
+  private process: ChildProcess | undefined
+  private mutex = new Mutex()
+  private marker = `__COC_SHELL_${crypto.randomBytes(8).toString('hex')}__`
+  private onData: ((stdout: boolean, data: Buffer) => void) | undefined
+  private onError: ((err: Error) => void) | undefined
+
+  constructor(public readonly shell: string, public readonly timeout = SHELL_TIMEOUT) {
+  }
+
+  public get running(): boolean {
+    return this.process != null
+  }
+
+  /**
+   * Run command in cwd by a subshell, resolved with stdout, rejected when the
+   * exit status is not 0 like exec().
+   */
+  public run(command: string, cwd: string): Promise<string> {
+    return this.mutex.use(() => {
+      let proc = this.start()
+      let marker = this.marker
+      let end = new RegExp(`\\n${marker} \\d+\\n$`)
+      return new Promise<string>((resolve, reject) => {
+        let stdout: Buffer[] = []
+        let stderr: Buffer[] = []
+        let tail = ''
+        let timer = setTimeout(() => {
+          finish(new Error(`Command timed out after ${this.timeout}ms: ${command}`))
+          this.kill(proc)
+        }, this.timeout)
+        const finish = (err: Error | undefined, value?: string) => {
+          clearTimeout(timer)
+          this.onData = this.onError = undefined
+          if (err) reject(err)
+          else resolve(value)
+        }
+        this.onError = err => finish(err)
+        this.onData = (isStdout, data) => {
+          if (!isStdout) {
+            stderr.push(data)
+            return
+          }
+          stdout.push(data)
+          // marker is ascii, search in the end of received output only
+          tail = (tail + data.toString('latin1')).slice(-(marker.length + 64))
+          if (!end.test(tail)) return
+          let text = Buffer.concat(stdout).toString('utf8')
+          let idx = text.lastIndexOf(`\n${marker} `)
+          let code = parseInt(text.slice(idx + marker.length + 2), 10)
+          let output = text.slice(0, idx)
+          if (code !== 0) {
+            finish(new Error(`Command failed: ${command}\n${Buffer.concat(stderr).toString('utf8')}`))
+          } else {
+            finish(undefined, output)
+          }
+        }
+        // command evaluated by eval, so a syntax error doesn't wait for more input
+        proc.stdin.write(`cd ${quote(cwd)} && (eval ${quote(command)}) </dev/null; printf '\\n%s %d\\n' '${marker}' "$?"\n`)
+      })
+    })
+  }
+
+  public dispose(): void {
+    let proc = this.process
+    if (!proc) return
+    this.onExit(proc, new Error('Shell process disposed'))
+    proc.kill()
+  }
+
+  /**
+   * Kill the shell with the running command.
+   */
+  private kill(proc: ChildProcess): void {
+    if (this.process === proc) this.process = undefined
+    terminate(proc)
+  }
+
+  private start(): ChildProcess {
+    if (this.process) return this.process
+    let proc = this.process = child_process.spawn(this.shell, [], { stdio: 'pipe', windowsHide: true })
+    proc.on('error', err => {
+      this.onExit(proc, err)
+    })
+    proc.on('exit', code => {
+      this.onExit(proc, new Error(`Shell process exited with code ${code}`))
+    })
+    proc.stdin.on('error', err => {
+      logger.error(`Shell process stdin error:`, err)
+    })
+    proc.stdout.on('data', (data: Buffer) => {
+      if (this.process === proc) this.onData?.(true, data)
+    })
+    proc.stderr.on('data', (data: Buffer) => {
+      if (this.process === proc) this.onData?.(false, data)
+    })
+    return proc
+  }
+
+  private onExit(proc: ChildProcess, err: Error): void {
+    if (this.process !== proc) return
+    this.process = undefined
+    this.onError?.(err)
+  }
+}
+
+let options: ShellOptions = { cacheTTL: 0, persistent: false }
+let shellProcess: ShellProcess | undefined
+const cache: Map<string, CacheItem> = new Map()
+
+function quote(str: string): string {
+  return `'${str.replace(/'/g, `'\\''`)}'`
+}
+
+/**
+ * $SHELL when it's used for commands of shell blocks and supports POSIX syntax,
+ * undefined when commands should be evaluated by exec().
+ */
+function getPersistentShell(): string | undefined {
+  if (!options.persistent || isWindows) return undefined
+  let shell = process.env.SHELL || '/bin/sh'
+  return POSIX_SHELLS.includes(path.basename(shell)) ? shell : undefined
+}
+
+export function setShellOptions(opts: ShellOptions): void {
+  options = opts
+  if (opts.cacheTTL <= 0) cache.clear()
+  if (shellProcess && shellProcess.shell !== getPersistentShell()) disposeShell()
+}
+
+export function disposeShell(): void {
+  shellProcess?.dispose()
+  shellProcess = undefined
+  cache.clear()
+}
+
+async function runCommand(command: string, cwd: string): Promise<string> {
+  let shell = getPersistentShell()
+  if (shell) {
+    shellProcess = shellProcess ?? new ShellProcess(shell)
+    return await shellProcess.run(command, cwd)
+  }
+  let opts: ExecOptions = { windowsHide: true, cwd }
+  Object.assign(opts, { shell: process.env.SHELL })
+  let res = await promisify(child_process.exec)(command, opts)
+  return res.stdout.toString()
+}
+
+/**
+ * Evaluate command of shell block, the output is trimmed at end. Results are
+ * cached by command and cwd for options.cacheTTL, concurrent evaluations of
+ * the same command share one run.
+ */
+export async function evalShellCommand(command: string, cwd = process.cwd()): Promise<string> {
+  let ttl = options.cacheTTL
+  if (ttl <= 0) return (await runCommand(command, cwd)).replace(/\s*$/, '')
+  let key = `${cwd}\n${command}`
+  let now = Date.now()
+  let item = cache.get(key)
+  if (item && item.expires > now) {
+    // most recently used at end
+    cache.delete(key)
+    cache.set(key, item)
+    return await item.value
+  }
+  let value = runCommand(command, cwd).then(res => res.replace(/\s*$/, ''))
+  cache.delete(key)
+  cache.set(key, { expires: now + ttl, value })
+  if (cache.size > CACHE_SIZE) cache.delete(cache.keys().next().value)
+  try {
+    return await value
+  } catch (e) {
+    // errors are not cached
+    if (cache.get(key)?.value === value) cache.delete(key)
+    throw e
+  }
+}
@@ -95,7 +95,7 @@ export class CocSnippet {
   public async init(ultisnip?: UltiSnippetContext): Promise<void> {
     if (typeof this.snippet === 'string') {
       const parser = new SnippetParser(!!ultisnip)
-      const snippet = parser.parse(this.snippet, true)
+      const snippet = parser.parseCached(this.snippet, true)
       this._tmSnippet = snippet
     } else {
       this._tmSnippet = this.snippet
@@ -316,7 +316,7 @@ export class CocSnippet {
   }
 
   public async replaceWithSnippet(range: Range, text: string, current?: Placeholder, ultisnip?: UltiSnippetContext): Promise<TextmateSnippet> {
-    let snippet = new SnippetParser(!!ultisnip).parse(text, true)
+    let snippet = new SnippetParser(!!ultisnip).parseCached(text, true)
     // no need to move cursor, there should be placeholder selection afterwards.
     let marker = this.replaceWithMarker(range, snippet, current)
     await this.resolve(snippet, ultisnip)
@@ -9,6 +9,14 @@ export type UltiSnipsAction = 'preExpand' | 'postExpand' | 'postJump'
 
 export type UltiSnipsOption = 'trimTrailingWhitespace' | 'removeWhiteSpace' | 'noExpand'
 
+/**
+ * Snippet expanded by expand_anon() of the python runtime.
+ */
+export interface AnonymousSnippet {
+  range: Range
+  text: string
+}
+
 export interface UltiSnippetContext {
   id: string
   /**
@@ -23,6 +31,10 @@ export interface UltiSnippetContext {
    * Context python code.
    */
   context?: string
+  /**
+   * Id of saved context evaluated before.
+   */
+  contextId?: string
   /**
    * Regex trigger (python code)
    */
@@ -43,6 +55,10 @@ export interface UltiSnippetContext {
    * Remove whitespace immediately before the cursor at the end of a line before jumping to the next tabstop
    */
   removeWhiteSpace?: boolean
+  /**
+   * Python code evaluated by the python worker.
+   */
+  worker?: boolean
 
   actions?: UltiSnipsActions
 }
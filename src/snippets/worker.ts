@@ -0,0 +1,217 @@
+'use strict'
+import { Neovim } from '@chemzqm/neovim'
+import { decodeMultiStream, encode } from '@msgpack/msgpack'
+import type { ChildProcess } from 'child_process'
+import { createLogger } from '../logger'
+import { isVim } from '../util/constants'
+import { Mutex } from '../util/mutex'
+import { child_process } from '../util/node'
+const logger = createLogger('snippets-worker')
+
+// the selected text, which could be large, is requested by the worker on use
+const SNAPSHOT_VARIABLES = ['coc_last_placeholder']
+
+/**
+ * Editor state sent with code to the worker, host decides the types of
+ * vim.eval() results, variables with null value don't exist.
+ */
+export interface WorkerSnapshot {
+  host: 'vim' | 'nvim'
+  bufnr: number
+  cursor: [number, number]
+  exprs: { [expr: string]: any }
+  vars: { [name: string]: any }
+}
+
+/**
+ * Changes made by code executed in the worker, buffers are [bufnr, start,
+ * end, replacement] of changed buffers, deleted variables have null value.
+ */
+export interface WorkerChanges {
+  buffers: [number, number, number, string[]][]
+  vars: { [name: string]: any }
+  options: { [name: string]: any }
+  cursor: [number, number] | null
+  commands: string[]
+}
+
+interface PendingRequest {
+  resolve: (value: any) => void
+  reject: (err: Error) => void
+}
+
+/**
+ * Long-lived python process evaluate snippet code with msgpack-rpc over stdio,
+ * see bin/ultisnips_worker.py for the protocol.
+ */
+export class PythonWorker {
+  private process: ChildProcess | undefined
+  private msgid = 0
+  private pending: Map<number, PendingRequest> = new Map()
+  private mutex = new Mutex()
+  // expressions of editor state evaluated by the runtime, fetched on start
+  private expressions: Promise<string[]> | undefined
+  // last output of stderr, reported when the process exits
+  private stderr = ''
+  // ids of code compiled by the worker
+  public readonly compiled: Set<string> = new Set()
+
+  constructor(private nvim: Neovim, public readonly command: string[]) {
+  }
+
+  public get running(): boolean {
+    return this.process != null
+  }
+
+  /**
+   * Execute python code with snapshot of editor state and apply the changes.
+   */
+  public async execute(code: string): Promise<void> {
+    let snapshot = await this.snapshot()
+    let [, changes] = await this.request('execute', [code, null, snapshot]) as [unknown, WorkerChanges]
+    await this.applyChanges(changes)
+  }
+
+  /**
+   * Evaluate python expression after previous executed code.
+   */
+  public async eval(expr: string): Promise<any> {
+    let [value] = await this.request('execute', ['', expr, null]) as [any, WorkerChanges]
+    return value
+  }
+
+  public dispose(): void {
+    let proc = this.process
+    if (!proc) return
+    this.onExit(proc, new Error('Python worker disposed'))
+    proc.kill()
+  }
+
+  private async snapshot(): Promise<WorkerSnapshot> {
+    if (!this.expressions) this.expressions = this.request('expressions', [])
+    let expressions = await this.expressions
+    let vars = SNAPSHOT_VARIABLES.map(name => `get(g:, '${name}', v:null)`)
+    let [bufnr, cursor, values, varValues] = await this.nvim.eval(`[bufnr('%'), [line('.'), col('.') - 1], [${expressions.join(', ')}], [${vars.join(', ')}]]`) as [number, [number, number], any[], any[]]
+    let snapshot: WorkerSnapshot = { host: isVim ? 'vim' : 'nvim', bufnr, cursor, exprs: {}, vars: {} }
+    expressions.forEach((expr, i) => {
+      snapshot.exprs[expr] = values[i]
+    })
+    SNAPSHOT_VARIABLES.forEach((name, i) => {
+      snapshot.vars[name] = varValues[i]
+    })
+    return snapshot
+  }
+
+  private async applyChanges(changes: WorkerChanges): Promise<void> {
+    let { nvim } = this
+    let { buffers, vars, options, cursor, commands } = changes
+    if (buffers.length == 0 && !cursor && commands.length == 0 && Object.keys(vars).length == 0 && Object.keys(options).length == 0) return
+    nvim.pauseNotification()
+    for (let [nr, start, end, lines] of buffers) {
+      nvim.createBuffer(nr).setLines(lines, { start, end, strictIndexing: false }, true)
+    }
+    for (let [name, value] of Object.entries(options)) {
+      nvim.setOption(name, value, true)
+    }
+    for (let [name, value] of Object.entries(vars)) {
+      if (value == null) {
+        nvim.call('coc#compat#del_var', [name], true)
+      } else {
+        nvim.setVar(name, value, true)
+      }
+    }
+    if (cursor) nvim.call('cursor', [cursor[0], cursor[1] + 1], true)
+    for (let cmd of commands) {
+      nvim.command(cmd, true)
+    }
+    await nvim.resumeNotification(true)
+  }
+
+  private request(method: string, params: any[]): Promise<any> {
+    return this.mutex.use(() => {
+      let proc = this.start()
+      let id = ++this.msgid
+      return new Promise((resolve, reject) => {
+        this.pending.set(id, { resolve, reject })
+        proc.stdin.write(encode([0, id, method, params]))
+      })
+    })
+  }
+
+  private start(): ChildProcess {
+    if (this.process) return this.process
+    let [cmd, ...args] = this.command
+    let proc = this.process = child_process.spawn(cmd, args, { stdio: 'pipe', windowsHide: true })
+    proc.on('error', err => {
+      this.onExit(proc, err)
+    })
+    // close after exit and end of stdio, the output of stderr is complete
+    proc.on('close', code => {
+      let output = this.stderr.trim()
+      this.onExit(proc, new Error(`Python worker exited with code ${code}${output ? `: ${output}` : ''}`))
+    })
+    // write after exit, handled by exit event
+    proc.stdin.on('error', err => {
+      logger.error(`Python worker stdin error:`, err)
+    })
+    proc.stderr.on('data', data => {
+      this.stderr = data.toString()
+      logger.warn(`Python worker: ${this.stderr}`)
+    })
+    void this.listen(proc)
+    return proc
+  }
+
+  private async listen(proc: ChildProcess): Promise<void> {
+    try {
+      for await (const msg of decodeMultiStream(proc.stdout)) {
+        this.onMessage(proc, msg as any[])
+      }
+    } catch (e: any) {
+      logger.error(`Invalid message from python worker:`, e)
+      proc.kill()
+    }
+  }
+
+  private onMessage(proc: ChildProcess, msg: any[]): void {
+    if (msg[0] === 1) {
+      let [, id, error, result] = msg
+      let pending = this.pending.get(id)
+      if (!pending) return
+      this.pending.delete(id)
+      if (error) {
+        pending.reject(new Error(error.toString()))
+      } else {
+        pending.resolve(result)
+      }
+    } else if (msg[0] === 0) {
+      // vim.eval() of expression not in the snapshot and vim.call()
+      let [, id, method, params] = msg
+      const reply = (error: string | null, result: any) => {
+        if (this.process === proc) proc.stdin.write(encode([1, id, error, result]))
+      }
+      if (method !== 'eval' && method !== 'call') {
+        reply(`Unknown method ${method}`, null)
+        return
+      }
+      let promise = method === 'eval' ? this.nvim.eval(params[0]) : this.nvim.call(params[0], params[1])
+      promise.then(res => {
+        reply(null, res)
+      }, (e: any) => {
+        reply(e instanceof Error ? e.message : String(e), null)
+      })
+    }
+  }
+
+  private onExit(proc: ChildProcess, err: Error): void {
+    if (this.process !== proc) return
+    this.process = undefined
+    this.expressions = undefined
+    this.stderr = ''
+    this.compiled.clear()
+    for (let pending of this.pending.values()) {
+      pending.reject(err)
+    }
+    this.pending.clear()
+  }
+}
@@ -297,6 +297,11 @@ export interface UltiSnipsActions {
 export interface UltiSnippetOption {
   regex?: string
   context?: string
+  /**
+   * Id of context evaluated by `snippetManager.evaluateContexts()`, the saved
+   * context is used instead of evaluating `context` again.
+   */
+  contextId?: string
   noPython?: boolean
   range?: Range
   line?: string
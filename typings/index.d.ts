@@ -12786,6 +12786,11 @@ declare module 'coc.nvim' {
      * Context code to execute.
      */
     context?: string
+    /**
+     * Id of context evaluated by `snippetManager.evaluateContexts()`, the
+     * saved context is used instead of evaluating `context` again.
+     */
+    contextId?: string
     /**
      * Do not expand tabs.
      */
@@ -12880,6 +12885,23 @@ declare module 'coc.nvim' {
      */
     appendVariable(name: string, defaultValue?: string | ((snippet: SnippetString) => any)): SnippetString
   }
+  /**
+   * Regex trigger matched by python.
+   */
+  export interface RegexTriggerMatch {
+    /**
+     * Index of the trigger.
+     */
+    index: number
+    /**
+     * Character index of the matched text in the prefix.
+     */
+    start: number
+    /**
+     * Groups of the match, null for group not participated.
+     */
+    groups: (string | null)[]
+  }
   /**
    * Manage snippet sessions.
    */
@@ -12892,6 +12914,28 @@ declare module 'coc.nvim' {
      * Resolve snippet string to text.
      */
     export function resolveSnippet(body: string, ultisnip?: UltiSnippetOption): Promise<string>
+    /**
+     * Match regex triggers of UltiSnips snippets with python against the text
+     * before cursor in one call, the match should end at the end of prefix,
+     * invalid patterns never match.  Compiled patterns are cached by the
+     * UltiSnips python runtime, which should be loaded.
+     *
+     * @param prefix Text before cursor.
+     * @param triggers Python regex of triggers.
+     * @returns Matched triggers.
+     */
+    export function matchRegexTriggers(prefix: string, triggers: string[]): Promise<RegexTriggerMatch[]>
+    /**
+     * Evaluate context expressions of UltiSnips snippets in one call against
+     * one shared `snip` of current buffer, exceptions are reported by
+     * context.  Use `contextId` of active result as option of `insertSnippet()`
+     * to expand with the saved context.  The UltiSnips python runtime should
+     * be loaded.
+     *
+     * @param contexts Python expressions with optional trigger for profile.
+     * @returns Results in the same order.
+     */
+    export function evaluateContexts(contexts: { context: string, trigger?: string }[]): Promise<{ active: boolean, contextId?: string, error?: string }[]>
     /**
      * Insert snippet to specific buffer, ultisnips not supported, and the placeholder is not selected.
      *